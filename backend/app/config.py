@@ -19,21 +19,75 @@ APP_VERSION = _read_version()
 class Settings(BaseSettings):
     # Database
     mongodb_url: str = "mongodb://mongo:27017/remotifex"
+    mongodb_max_pool_size: int = 100
+    mongodb_min_pool_size: int = 0
 
     # Auth
     jwt_secret: str = "change-me-in-production"
     jwt_algorithm: str = "HS256"
     jwt_expire_minutes: int = 1440  # 24 hours
 
+    # Password hashing
+    bcrypt_rounds: int = 12  # existing hashes are upgraded on next login
+    password_hash_workers: int = 2
+
+    # Login throttling (attempts per window)
+    login_rate_limit_window: int = 300  # seconds
+    login_rate_limit_per_ip: int = 30
+    login_rate_limit_per_username: int = 10
+    # Comma-separated IPs, networks or hostnames of reverse proxies whose
+    # X-Forwarded-For header is believed
+    trusted_proxies: str = "caddy"
+
     # Encryption for secrets at rest
     encryption_key: str = "change-me-to-a-random-32-byte-key"
 
     # Redis
     redis_url: str = "redis://redis:6379/0"
+    redis_max_connections: int = 50
+    redis_pool_timeout: float = 5.0  # seconds to wait for a free connection
 
     # Storage
     projects_data_dir: str = "/data/projects"
 
+    # Threads used by /files/search
+    search_workers: int = 8
+    search_regex_timeout: float = 1.0  # seconds a query may spend on one file
+
+    # In-memory file index (quick open, tree listings)
+    file_index_max_files: int = 200_000  # per project environment
+    file_index_max_memory_mb: int = 256  # across all indexes
+    file_index_idle_ttl: int = 900  # seconds
+    file_index_watch: bool = True  # inotify; falls back to mtime polling
+
+    # Live file-change events on the project websocket
+    file_watch_debounce_ms: int = 200
+    file_watch_max_batch: int = 500  # changes per event before truncating
+
+    # Bulk uploads and archive imports (per request)
+    import_max_files: int = 50_000
+    import_max_mb: int = 2048  # uncompressed
+
+    # Per-project disk quotas (0 = unlimited); over the soft limit writes
+    # succeed with a warning, over the hard limit they are refused
+    project_quota_soft_mb: int = 0
+    project_quota_hard_mb: int = 0
+    disk_usage_scan_interval: int = 300  # seconds between passes over all projects
+    disk_usage_full_scan_every: int = 12  # measurements; others skip unchanged dirs
+
+    # Background fetch of projects' git remotes (0 = only on request)
+    git_fetch_interval: int = 900  # seconds
+
+    # Preview containers serving {slug}.{base_domain}; the worker starts
+    # them on the first request and stops them when idle. Environments
+    # can override image, command and port.
+    preview_image: str = "python:3.12-slim"
+    preview_command: str = "python -m http.server $PORT"
+    preview_port: int = 8080
+    preview_start_timeout: int = 60  # seconds a request waits for a container
+    preview_proxy_timeout: float = 300.0  # seconds to wait for response data
+    preview_touch_interval: int = 10  # seconds between last-access updates
+
     model_config = {"env_file": ".env", "extra": "ignore"}
 
 
@@ -1,6 +1,7 @@
 """MongoDB connection management using Motor async driver."""
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
 
 from app.config import settings
 
@@ -8,10 +9,61 @@ client: AsyncIOMotorClient | None = None
 db: AsyncIOMotorDatabase | None = None
 
 
+class _PoolStats(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage from PyMongo's CMAP events."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.wait_queue_timeouts = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self.wait_queue_timeouts += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+
+_pool_stats = _PoolStats()
+
+
 async def connect_db() -> None:
     """Connect to MongoDB and initialize indexes."""
     global client, db
-    client = AsyncIOMotorClient(settings.mongodb_url)
+    client = AsyncIOMotorClient(
+        settings.mongodb_url,
+        maxPoolSize=settings.mongodb_max_pool_size,
+        minPoolSize=settings.mongodb_min_pool_size,
+        event_listeners=[_pool_stats],
+    )
     db = client.remotifex
     await _create_indexes()
 
@@ -29,6 +81,21 @@ async def _create_indexes() -> None:
 
     await db.users.create_index("username", unique=True)
     await db.projects.create_index("slug", unique=True)
+    await db.projects.create_index("status")
+    # Project listing: one index per sort order, _id as tie-breaker
+    for field, direction in (
+        ("created_at", -1),
+        ("last_activity_at", -1),
+        ("name", 1),
+    ):
+        await db.projects.create_index(
+            [("owner_id", 1), (field, direction), ("_id", direction)]
+        )
+    # Projects created before activity tracking sort by their last update
+    await db.projects.update_many(
+        {"last_activity_at": {"$exists": False}},
+        [{"$set": {"last_activity_at": "$updated_at"}}],
+    )
     await db.environments.create_index(
         [("project_id", 1), ("type", 1)], unique=True
     )
@@ -36,6 +103,9 @@ async def _create_indexes() -> None:
     await db.chat_sessions.create_index("project_id")
     await db.chat_messages.create_index([("session_id", 1), ("created_at", 1)])
     await db.chat_messages.create_index("project_id")
+    await db.chat_messages.create_index(
+        [("content", "text")], name="content_text", default_language="english"
+    )
     await db.deploys.create_index([("project_id", 1), ("version", 1)], unique=True)
     await db.tasks.create_index("task_id", unique=True)
     await db.tasks.create_index("project_id")
@@ -46,3 +116,17 @@ def get_db() -> AsyncIOMotorDatabase:
     """Get database instance. Must be called after connect_db()."""
     assert db is not None, "Database not connected. Call connect_db() first."
     return db
+
+
+def pool_stats() -> dict:
+    """Connection pool usage for the health endpoint."""
+    if client is None:
+        return {"connected": False}
+    return {
+        "connected": True,
+        "max_pool_size": settings.mongodb_max_pool_size,
+        "min_pool_size": settings.mongodb_min_pool_size,
+        "open": _pool_stats.open,
+        "in_use": _pool_stats.checked_out,
+        "wait_queue_timeouts": _pool_stats.wait_queue_timeouts,
+    }
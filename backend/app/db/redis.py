@@ -0,0 +1,148 @@
+"""Shared Redis connection pool and pub/sub fan-out."""
+
+import asyncio
+import logging
+
+import redis.asyncio as aioredis
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+client: aioredis.Redis | None = None
+hub: "PubSubHub | None" = None
+
+
+class PubSubHub:
+    """Multiplexes Redis pub/sub channels onto in-process subscriber queues.
+
+    All websocket connections in a process share a single Redis pub/sub
+    connection instead of opening one each.
+    """
+
+    def __init__(self, redis: aioredis.Redis, queue_size: int = 1000):
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        self._queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._lock = asyncio.Lock()
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._pubsub.aclose()
+
+    async def subscribe(self, channel: str) -> asyncio.Queue:
+        """Subscribe to a channel; messages arrive on the returned queue as str."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        async with self._lock:
+            queues = self._subscribers.setdefault(channel, set())
+            if not queues:
+                await self._pubsub.subscribe(channel)
+                self._ready.set()
+            queues.add(queue)
+        return queue
+
+    async def unsubscribe(self, channel: str, queue: asyncio.Queue) -> None:
+        async with self._lock:
+            queues = self._subscribers.get(channel)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[channel]
+                await self._pubsub.unsubscribe(channel)
+                if not self._subscribers:
+                    self._ready.clear()
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(q) for q in self._subscribers.values()),
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Redis pub/sub connection lost, retrying in 1s")
+                await asyncio.sleep(1)
+                continue
+
+            if not message or message["type"] != "message":
+                continue
+
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            data = message["data"]
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+
+            for queue in list(self._subscribers.get(channel, ())):
+                try:
+                    queue.put_nowait(data)
+                except asyncio.QueueFull:
+                    logger.warning("Dropping message for slow subscriber on %s", channel)
+
+
+async def connect_redis() -> None:
+    """Create the process-wide Redis pool and pub/sub hub."""
+    global client, hub
+    pool = aioredis.BlockingConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+    )
+    client = aioredis.Redis(connection_pool=pool)
+    hub = PubSubHub(client)
+    hub.start()
+
+
+async def close_redis() -> None:
+    """Close the pub/sub hub and the Redis pool."""
+    if hub:
+        await hub.close()
+    if client:
+        await client.aclose()
+        await client.connection_pool.disconnect()
+
+
+def get_redis() -> aioredis.Redis:
+    """Get the shared Redis client. Must be called after connect_redis()."""
+    assert client is not None, "Redis not connected. Call connect_redis() first."
+    return client
+
+
+def get_hub() -> PubSubHub:
+    """Get the pub/sub hub. Must be called after connect_redis()."""
+    assert hub is not None, "Redis not connected. Call connect_redis() first."
+    return hub
+
+
+def pool_stats() -> dict:
+    """Connection pool usage for the health endpoint."""
+    if client is None:
+        return {"connected": False}
+    pool = client.connection_pool
+    stats = {
+        "connected": True,
+        "max_connections": pool.max_connections,
+        "in_use": len(getattr(pool, "_in_use_connections", ())),
+        "available": len(getattr(pool, "_available_connections", ())),
+    }
+    if hub is not None:
+        stats["pubsub"] = hub.stats()
+    return stats
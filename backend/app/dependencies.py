@@ -1,14 +1,79 @@
 """FastAPI dependency injection."""
 
+import time
+
+from bson import ObjectId
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.db.mongodb import get_db
-from app.utils.security import decode_access_token
+from app.utils import invalidation
+from app.utils.cache import TTLCache
+from app.utils.security import decode_access_token_claims
 
 security = HTTPBearer(auto_error=False)
 
+# Short-lived caches for the per-request auth and ownership lookups. Changes
+# are announced on the invalidation channel (by the worker too, for the
+# project stats and git state it writes); the TTLs bound staleness if an
+# invalidation is missed.
+_token_cache = TTLCache(maxsize=10_000, ttl=300)  # token -> user_id
+_user_cache = TTLCache(maxsize=10_000, ttl=30)  # user_id -> user doc
+_project_cache = TTLCache(maxsize=10_000, ttl=30)  # (user_id, project_id) -> project doc
+
+
+def _invalidate_user(user_id: str | None) -> None:
+    if user_id is None:
+        _user_cache.clear()
+        _token_cache.clear()
+        _project_cache.clear()
+        return
+    # Cached tokens only map to a user_id; the user lookup is what must refresh
+    _user_cache.pop(user_id)
+    _project_cache.discard_where(lambda key: key[0] == user_id)
+
+
+def _invalidate_project(project_id: str | None) -> None:
+    if project_id is None:
+        _project_cache.clear()
+        return
+    _project_cache.discard_where(lambda key: key[1] == project_id)
+
+
+invalidation.register("user", _invalidate_user)
+invalidation.register("project", _invalidate_project)
+
+
+async def invalidate_user(user_id: str) -> None:
+    """Drop cached auth state for a user in every backend process."""
+    await invalidation.publish("user", user_id)
+
+
+async def invalidate_project(project_id: str) -> None:
+    """Drop cached copies of a project in every backend process.
+
+    Call it after any change to the project document.
+    """
+    await invalidation.publish("project", project_id)
+
+
+def _verify_token(token: str) -> str | None:
+    """Return the user_id for a valid token, caching the signature check."""
+    user_id = _token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    claims = decode_access_token_claims(token)
+    if claims is None or not claims.get("sub"):
+        return None
+
+    user_id = claims["sub"]
+    remaining = claims.get("exp", 0) - time.time()
+    if remaining > 0:
+        _token_cache.set(token, user_id, ttl=remaining)
+    return user_id
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials | None = Depends(security),
@@ -21,24 +86,25 @@ async def get_current_user(
             detail="Not authenticated",
         )
 
-    user_id = decode_access_token(credentials.credentials)
-    if user_id is None:
+    user_id = _verify_token(credentials.credentials)
+    if user_id is None or not ObjectId.is_valid(user_id):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
         )
 
-    from bson import ObjectId
-
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = _user_cache.get(user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
-        )
+        user = await db.users.find_one({"_id": ObjectId(user_id)})
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found",
+            )
+        user["_id"] = str(user["_id"])
+        _user_cache.set(user_id, user)
 
-    user["_id"] = str(user["_id"])
-    return user
+    return dict(user)
 
 
 async def get_admin_user(user: dict = Depends(get_current_user)) -> dict:
@@ -49,3 +115,39 @@ async def get_admin_user(user: dict = Depends(get_current_user)) -> dict:
             detail="Admin access required",
         )
     return user
+
+
+async def get_owned_project_any_status(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    user: dict = Depends(get_current_user),
+) -> dict:
+    """Load the project from the path, requiring the current user to own it.
+
+    Unlike :func:`get_owned_project`, projects being deleted are returned.
+    """
+    key = (user["_id"], project_id)
+    project = _project_cache.get(key)
+    if project is None:
+        if not ObjectId.is_valid(project_id):
+            raise HTTPException(status_code=404, detail="Project not found")
+        project = await db.projects.find_one(
+            {"_id": ObjectId(project_id), "owner_id": user["_id"]}
+        )
+        if project is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        _project_cache.set(key, project)
+
+    return dict(project)
+
+
+async def get_owned_project(
+    project: dict = Depends(get_owned_project_any_status),
+) -> dict:
+    """Load the project from the path, requiring the current user to own it."""
+    if project.get("status") == "deleting":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Project is being deleted",
+        )
+    return project
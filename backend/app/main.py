@@ -1,21 +1,60 @@
 """Remotifex API server."""
 
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import APP_VERSION
-from app.db.mongodb import close_db, connect_db
-from app.routers import auth, chat, files, projects, settings, websocket
+from app.db import mongodb
+from app.db import redis as redis_db
+from app.routers import (
+    auth,
+    chat,
+    deploys,
+    environments,
+    files,
+    git,
+    projects,
+    search,
+    settings,
+    tasks,
+    websocket,
+)
+from app.utils import (
+    dir_watch,
+    disk_usage,
+    file_index,
+    git_sync,
+    invalidation,
+    preview,
+    project_cleanup,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Manage application lifecycle: connect/disconnect database."""
-    await connect_db()
+    """Manage application lifecycle: connection pools, background tasks."""
+    await mongodb.connect_db()
+    await redis_db.connect_redis()
+    await preview.prewarm_default_image()
+    background = [
+        asyncio.create_task(invalidation.listen()),
+        asyncio.create_task(file_index.run_janitor()),
+        asyncio.create_task(project_cleanup.run_janitor()),
+        asyncio.create_task(disk_usage.run_scanner()),
+        asyncio.create_task(git_sync.run_scheduler()),
+    ]
     yield
-    await close_db()
+    for task in background:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await dir_watch.close()
+    await preview.close()
+    await redis_db.close_redis()
+    await mongodb.close_db()
 
 
 app = FastAPI(
@@ -32,6 +71,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost: {slug}.{base_domain} requests never reach the API routes
+app.add_middleware(preview.PreviewProxy)
 
 # API routes under /api prefix (Caddy forwards /api/* with path intact)
 api_router = APIRouter(prefix="/api")
@@ -43,6 +84,21 @@ api_router.include_router(
 api_router.include_router(
     files.router, prefix="/projects/{project_id}/files", tags=["files"]
 )
+api_router.include_router(
+    deploys.router, prefix="/projects/{project_id}/deploys", tags=["deploys"]
+)
+api_router.include_router(
+    tasks.router, prefix="/projects/{project_id}/tasks", tags=["tasks"]
+)
+api_router.include_router(
+    git.router, prefix="/projects/{project_id}/git", tags=["git"]
+)
+api_router.include_router(
+    environments.router,
+    prefix="/projects/{project_id}/environments",
+    tags=["environments"],
+)
+api_router.include_router(search.router, prefix="/search", tags=["search"])
 api_router.include_router(settings.router, prefix="/settings", tags=["settings"])
 app.include_router(api_router)
 
@@ -52,5 +108,13 @@ app.include_router(websocket.router, prefix="/ws", tags=["websocket"])
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
-    return {"status": "ok", "version": APP_VERSION}
+    """Health check endpoint with connection pool stats."""
+    return {
+        "status": "ok",
+        "version": APP_VERSION,
+        "pools": {
+            "mongodb": mongodb.pool_stats(),
+            "redis": redis_db.pool_stats(),
+        },
+        "file_index": file_index.stats(),
+    }
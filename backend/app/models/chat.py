@@ -6,6 +6,7 @@ from datetime import datetime, timezone
 def create_chat_session_doc(
     project_id: str,
     title: str = "New conversation",
+    isolated: bool = False,
 ) -> dict:
     """Create a chat session document for MongoDB insertion."""
     now = datetime.now(timezone.utc)
@@ -14,6 +15,7 @@ def create_chat_session_doc(
         "claude_session_id": None,
         "title": title,
         "status": "active",
+        "isolated": isolated,
         "created_at": now,
         "updated_at": now,
     }
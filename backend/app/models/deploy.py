@@ -0,0 +1,27 @@
+"""Deploy document model."""
+
+from datetime import datetime, timezone
+
+
+def create_deploy_doc(
+    project_id: str,
+    version: int,
+    created_by: str,
+    message: str | None = None,
+) -> dict:
+    """Create a deploy document for MongoDB insertion."""
+    return {
+        "project_id": project_id,
+        "version": version,
+        "status": "building",  # building, ready, failed; pruned (tree rebuilt on activate)
+        "message": message,
+        "created_by": created_by,
+        "file_count": 0,
+        "total_bytes": 0,
+        "new_bytes": 0,  # bytes added to the object store by this deploy
+        "manifest_digest": None,
+        "error": None,
+        "created_at": datetime.now(timezone.utc),
+        "finished_at": None,
+        "activated_at": None,
+    }
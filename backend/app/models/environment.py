@@ -0,0 +1,27 @@
+"""Environment document model."""
+
+from datetime import datetime, timezone
+
+ENV_TYPES = ("staging", "prod")
+
+
+def environment_domain(slug: str, env_type: str) -> str:
+    """Subdomain label serving an environment: ``{slug}`` or ``{slug}-staging``."""
+    return slug if env_type == "prod" else f"{slug}-{env_type}"
+
+
+def create_environment_doc(project_id: str, env_type: str, slug: str) -> dict:
+    """Create an environment document for MongoDB insertion."""
+    now = datetime.now(timezone.utc)
+    return {
+        "project_id": project_id,
+        "type": env_type,  # staging, prod
+        "domain": environment_domain(slug, env_type),
+        # Preview container; None uses the server's default
+        "image": None,
+        "command": None,
+        "port": None,
+        "idle_timeout": None,  # seconds
+        "created_at": now,
+        "updated_at": now,
+    }
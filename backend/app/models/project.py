@@ -36,7 +36,16 @@ def create_project_doc(
             "model": "sonnet",
             "allowed_tools": ["Bash", "Read", "Edit", "Write", "Glob", "Grep"],
             "append_system_prompt": None,
+            "isolated_sessions": False,
         },
+        # Counters kept up to date by the API and the worker, so listings
+        # need no per-project aggregation
+        "stats": {
+            "active_tasks": 0,
+            "last_task_status": None,
+            "disk_usage_bytes": None,
+        },
+        "last_activity_at": now,
         "created_at": now,
         "updated_at": now,
     }
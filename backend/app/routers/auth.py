@@ -1,12 +1,22 @@
 """Authentication routes: login, setup."""
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import redis.asyncio as aioredis
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from app.config import settings
 from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import invalidate_user
 from app.models.user import create_user_doc
 from app.schemas.user import LoginRequest, LoginResponse, SetupRequest, UserResponse
-from app.utils.security import create_access_token, hash_password, verify_password
+from app.utils import rate_limit
+from app.utils.security import (
+    create_access_token,
+    hash_password_async,
+    password_needs_rehash,
+    verify_password_async,
+)
 
 router = APIRouter()
 
@@ -14,17 +24,40 @@ router = APIRouter()
 @router.post("/login", response_model=LoginResponse)
 async def login(
     request: LoginRequest,
+    http_request: Request,
     db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
 ):
     """Authenticate user and return JWT token."""
+    # Throttle before doing any bcrypt work
+    window = settings.login_rate_limit_window
+    ip_key = f"ratelimit:login:ip:{await rate_limit.client_ip(http_request)}"
+    user_key = f"ratelimit:login:user:{request.username.lower()}"
+    await rate_limit.hit(redis, ip_key, settings.login_rate_limit_per_ip, window)
+    await rate_limit.hit(
+        redis, user_key, settings.login_rate_limit_per_username, window
+    )
+
     user = await db.users.find_one({"username": request.username})
-    if user is None or not verify_password(request.password, user["password_hash"]):
+    if user is None or not await verify_password_async(
+        request.password, user["password_hash"]
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
         )
 
+    await rate_limit.reset(redis, user_key)
     user_id = str(user["_id"])
+
+    # Transparently upgrade hashes made with an outdated cost factor
+    if password_needs_rehash(user["password_hash"]):
+        new_hash = await hash_password_async(request.password)
+        await db.users.update_one(
+            {"_id": user["_id"]}, {"$set": {"password_hash": new_hash}}
+        )
+        await invalidate_user(user_id)
+
     token = create_access_token(user_id)
 
     return LoginResponse(
@@ -52,7 +85,7 @@ async def setup(
 
     doc = create_user_doc(
         username=request.username,
-        password_hash=hash_password(request.password),
+        password_hash=await hash_password_async(request.password),
         is_admin=True,
     )
     result = await db.users.insert_one(doc)
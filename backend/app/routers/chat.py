@@ -1,22 +1,33 @@
-"""Chat routes: send messages, list sessions and messages."""
+"""Chat routes: send messages, list sessions and messages, merge sessions."""
 
 import json
+import logging
 import uuid
 
+import redis.asyncio as aioredis
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from starlette.concurrency import run_in_threadpool
 
-from app.config import settings
 from app.db.mongodb import get_db
-from app.dependencies import get_current_user
+from app.db.redis import get_redis
+from app.dependencies import get_owned_project, invalidate_project
 from app.models.chat import create_chat_message_doc, create_chat_session_doc
 from app.schemas.chat import (
     ChatMessageCreate,
     ChatMessageResponse,
+    ChatSearchResponse,
     ChatSendResponse,
     ChatSessionResponse,
+    SessionMergeResponse,
 )
+from app.utils import checkpoints, disk_usage
+from app.utils.checkpoints import CheckpointError
+from app.utils.settings_cache import get_secret
+from app.utils.text_search import search_messages
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -40,6 +51,7 @@ def _session_to_response(doc: dict) -> ChatSessionResponse:
         project_id=doc["project_id"],
         title=doc["title"],
         status=doc["status"],
+        isolated=doc.get("isolated", False),
         created_at=doc["created_at"],
         updated_at=doc["updated_at"],
     )
@@ -49,16 +61,9 @@ def _session_to_response(doc: dict) -> ChatSessionResponse:
 async def list_sessions(
     project_id: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    project: dict = Depends(get_owned_project),
 ):
     """List chat sessions for a project."""
-    # Verify project ownership
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
-    )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
-
     cursor = db.chat_sessions.find({"project_id": project_id}).sort("created_at", -1)
     sessions = await cursor.to_list(length=50)
     return [_session_to_response(s) for s in sessions]
@@ -69,15 +74,9 @@ async def list_messages(
     project_id: str,
     session_id: str | None = None,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    project: dict = Depends(get_owned_project),
 ):
     """List messages for a project, optionally filtered by session."""
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
-    )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
-
     query = {"project_id": project_id}
     if session_id:
         query["session_id"] = session_id
@@ -87,19 +86,32 @@ async def list_messages(
     return [_message_to_response(m) for m in messages]
 
 
+@router.get("/search", response_model=ChatSearchResponse)
+async def search_project_messages(
+    project_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=20, ge=1, le=100),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Full-text search over this project's chat history."""
+    return await search_messages(db, q, [project_id], page, page_size)
+
+
 @router.post("/messages", response_model=ChatSendResponse)
 async def send_message(
     project_id: str,
     request: ChatMessageCreate,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
 ):
-    """Send a chat message and trigger an AI task."""
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
-    )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
+    """Send a chat message and trigger an AI task.
+
+    Refused with 507 while the project is over its hard disk quota.
+    """
+    await disk_usage.enforce_quota(db, project_id)
 
     # Get or create session
     if request.session_id:
@@ -109,14 +121,20 @@ async def send_message(
         if session is None:
             raise HTTPException(status_code=404, detail="Session not found")
         session_id = request.session_id
+        # Claude session ID for --resume
+        claude_session_id = session.get("claude_session_id")
+        isolated = session.get("isolated", False)
     else:
         # Create new session
+        isolated = project.get("ai_config", {}).get("isolated_sessions", False)
         session_doc = create_chat_session_doc(
             project_id=project_id,
             title=request.content[:50],
+            isolated=isolated,
         )
         result = await db.chat_sessions.insert_one(session_doc)
         session_id = str(result.inserted_id)
+        claude_session_id = None
 
     # Store user message
     message_doc = create_chat_message_doc(
@@ -128,17 +146,8 @@ async def send_message(
     msg_result = await db.chat_messages.insert_one(message_doc)
     message_id = str(msg_result.inserted_id)
 
-    # Load global settings for API key
-    global_settings = await db.settings.find_one({"type": "global"})
-    api_key = None
-    if global_settings and global_settings.get("ai", {}).get("claude_api_key_encrypted"):
-        from app.utils.security import decrypt_value
-
-        api_key = decrypt_value(global_settings["ai"]["claude_api_key_encrypted"])
-
-    # Get session's claude_session_id for --resume
-    session = await db.chat_sessions.find_one({"_id": ObjectId(session_id)})
-    claude_session_id = session.get("claude_session_id") if session else None
+    # API key comes from the cached global settings
+    api_key = await get_secret(db, "ai", "claude_api_key_encrypted")
 
     # Submit task to Redis queue
     task_id = str(uuid.uuid4())
@@ -157,17 +166,16 @@ async def send_message(
         ),
         "append_system_prompt": ai_config.get("append_system_prompt"),
         "claude_session_id": claude_session_id,
+        # Run in the session's own worktree instead of staging
+        "isolated": isolated,
     }
 
-    import redis.asyncio as aioredis
-
-    r = aioredis.from_url(settings.redis_url)
-    await r.lpush("ai_tasks", json.dumps(task))
-    await r.aclose()
+    await redis.lpush("ai_tasks", json.dumps(task))
 
     # Store task record
     from datetime import datetime, timezone
 
+    now = datetime.now(timezone.utc)
     await db.tasks.insert_one(
         {
             "task_id": task_id,
@@ -175,18 +183,111 @@ async def send_message(
             "session_id": session_id,
             "status": "queued",
             "tool": ai_config.get("tool", "claude"),
+            "isolated": isolated,
             "prompt": request.content,
             "started_at": None,
             "completed_at": None,
             "result": None,
             "error": None,
             "usage": {"tokens_in": 0, "tokens_out": 0, "cost_usd": 0},
-            "created_at": datetime.now(timezone.utc),
+            "created_at": now,
         }
     )
+    # Counters shown in project listings; the worker decrements on completion
+    await db.projects.update_one(
+        {"_id": ObjectId(project_id)},
+        {
+            "$inc": {"stats.active_tasks": 1},
+            "$set": {"stats.last_task_status": "queued", "last_activity_at": now},
+        },
+    )
+    await invalidate_project(project_id)
 
     return ChatSendResponse(
         task_id=task_id,
         message_id=message_id,
         session_id=session_id,
     )
+
+
+async def _get_isolated_session(
+    db: AsyncIOMotorDatabase, project_id: str, session_id: str
+) -> dict:
+    """An isolated session with no task queued or running in it."""
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    session = await db.chat_sessions.find_one(
+        {"_id": ObjectId(session_id), "project_id": project_id}
+    )
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session.get("isolated"):
+        raise HTTPException(
+            status_code=400, detail="Session works directly in staging"
+        )
+    if await checkpoints.workspace_busy(db, project_id, session_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A task is still running in this session",
+        )
+    return session
+
+
+@router.post("/sessions/{session_id}/merge", response_model=SessionMergeResponse)
+async def merge_session(
+    project_id: str,
+    session_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Merge an isolated session's work into staging.
+
+    A three-way merge against the staging snapshot the session started
+    from (or was last merged at). If any file conflicts, staging is left
+    untouched and the conflicting paths are returned with a 409, as is a
+    merge while a task is queued or running in staging.
+    """
+    await _get_isolated_session(db, project_id, session_id)
+    if await checkpoints.workspace_busy(db, project_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Cannot merge while a task is running in staging",
+        )
+    try:
+        result = await run_in_threadpool(
+            checkpoints.merge_session, project_id, session_id
+        )
+    except CheckpointError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result["merged"]:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "The session conflicts with staging",
+                "conflicts": result["conflicts"],
+            },
+        )
+    logger.info(
+        "Merged session %s into staging of project %s (%d files)",
+        session_id,
+        project_id,
+        len(result["files"]),
+    )
+    return SessionMergeResponse(session_id=session_id, **result)
+
+
+@router.delete(
+    "/sessions/{session_id}/worktree", status_code=status.HTTP_204_NO_CONTENT
+)
+async def discard_session_worktree(
+    project_id: str,
+    session_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Throw away an isolated session's worktree and unmerged work.
+
+    The next message in the session starts again from current staging.
+    """
+    await _get_isolated_session(db, project_id, session_id)
+    await run_in_threadpool(checkpoints.discard_session, project_id, session_id)
@@ -0,0 +1,234 @@
+"""Deploy routes: snapshot staging into a release, list, activate, roll back."""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+import redis.asyncio as aioredis
+from fastapi import APIRouter, Depends, HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DESCENDING
+from starlette.concurrency import run_in_threadpool
+
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import get_current_user, get_owned_project
+from app.models.deploy import create_deploy_doc
+from app.schemas.deploy import (
+    DeployCreate,
+    DeployListResponse,
+    DeployManifestResponse,
+    DeployResponse,
+)
+from app.utils import deploy, disk_usage, file_index, preview
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Upper bound on how long a deploy may hold the project's deploy lock
+DEPLOY_LOCK_TTL = 3600
+
+
+def _deploy_to_response(doc: dict, active_version: int | None) -> DeployResponse:
+    """Convert a MongoDB deploy document to a response schema."""
+    return DeployResponse(
+        id=str(doc["_id"]),
+        project_id=doc["project_id"],
+        version=doc["version"],
+        status=doc["status"],
+        message=doc.get("message"),
+        active=doc["version"] == active_version,
+        file_count=doc["file_count"],
+        total_bytes=doc["total_bytes"],
+        new_bytes=doc["new_bytes"],
+        manifest_digest=doc.get("manifest_digest"),
+        error=doc.get("error"),
+        created_at=doc["created_at"],
+        finished_at=doc.get("finished_at"),
+        activated_at=doc.get("activated_at"),
+    )
+
+
+async def _acquire_lock(redis: aioredis.Redis, project_id: str) -> None:
+    if not await redis.set(f"deploy:{project_id}", "1", nx=True, ex=DEPLOY_LOCK_TTL):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another deploy is in progress for this project",
+        )
+
+
+async def _activate(db: AsyncIOMotorDatabase, project_id: str, version: int) -> None:
+    """Flip prod to a release and tell connected clients."""
+    await run_in_threadpool(deploy.activate, project_id, version)
+    await db.deploys.update_one(
+        {"project_id": project_id, "version": version},
+        {"$set": {"activated_at": datetime.now(timezone.utc)}},
+    )
+    # The prod index describes the previous release
+    file_index.drop(os.path.join(deploy.project_dir(project_id), "prod"))
+    # The prod preview mounted the previous release; recreate it
+    try:
+        await preview.stop(get_redis(), project_id, "prod", remove=True)
+    except Exception:
+        logger.warning("Could not restart the prod preview of project %s", project_id)
+    try:
+        await get_redis().publish(
+            f"project:{project_id}:chat",
+            json.dumps({"event": {"type": "deploy_activated", "version": version}}),
+        )
+    except Exception:
+        logger.warning("Could not publish deploy_activated for project %s", project_id)
+
+
+async def _prune(project_id: str) -> None:
+    """Clear up after interrupted deploys; complete releases are kept."""
+    freed = await run_in_threadpool(deploy.prune, project_id)
+    if freed:
+        logger.info("Collected %d unreferenced bytes of project %s", freed, project_id)
+
+
+@router.get("", response_model=DeployListResponse)
+async def list_deploys(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """List a project's deploys, newest first."""
+    cursor = db.deploys.find({"project_id": project_id}).sort("version", DESCENDING)
+    docs = await cursor.to_list(length=100)
+    active = await run_in_threadpool(deploy.active_version, project_id)
+    return DeployListResponse(
+        deploys=[_deploy_to_response(d, active) for d in docs],
+        active_version=active,
+    )
+
+
+@router.post("", response_model=DeployResponse, status_code=status.HTTP_201_CREATED)
+async def create_deploy(
+    project_id: str,
+    request: DeployCreate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+    user: dict = Depends(get_current_user),
+):
+    """Snapshot staging as a new deploy version and (by default) make it prod.
+
+    Unchanged files are hardlinked to content already in the project's
+    object store, so a deploy costs only what changed. ``prod`` is switched
+    atomically; readers never see a half-copied tree. Refused with 507 when
+    the project is over its hard disk quota.
+    """
+    await disk_usage.enforce_quota(db, project_id)
+    await _acquire_lock(redis, project_id)
+    try:
+        last = await db.deploys.find_one(
+            {"project_id": project_id}, sort=[("version", DESCENDING)]
+        )
+        version = (last["version"] if last else 0) + 1
+        doc = create_deploy_doc(project_id, version, user["_id"], request.message)
+        result = await db.deploys.insert_one(doc)
+        doc["_id"] = result.inserted_id
+
+        try:
+            stats = await run_in_threadpool(
+                deploy.build_release, project_id, version, request.gitignore
+            )
+        except Exception as e:
+            error = (
+                "Nothing to deploy: staging does not exist"
+                if isinstance(e, FileNotFoundError)
+                else str(e)
+            )
+            await db.deploys.update_one(
+                {"_id": doc["_id"]},
+                {
+                    "$set": {
+                        "status": "failed",
+                        "error": error,
+                        "finished_at": datetime.now(timezone.utc),
+                    }
+                },
+            )
+            if isinstance(e, FileNotFoundError):
+                raise HTTPException(status_code=400, detail=error)
+            raise
+
+        update = {
+            **stats,
+            "status": "ready",
+            "finished_at": datetime.now(timezone.utc),
+        }
+        await db.deploys.update_one({"_id": doc["_id"]}, {"$set": update})
+        doc.update(update)
+
+        if request.activate:
+            await _activate(db, project_id, version)
+            doc["activated_at"] = datetime.now(timezone.utc)
+        await _prune(project_id)
+    finally:
+        await redis.delete(f"deploy:{project_id}")
+    await disk_usage.mark_dirty(project_id)
+
+    active = await run_in_threadpool(deploy.active_version, project_id)
+    return _deploy_to_response(doc, active)
+
+
+@router.get("/{version}/manifest", response_model=DeployManifestResponse)
+async def get_deploy_manifest(
+    project_id: str,
+    version: int,
+    project: dict = Depends(get_owned_project),
+):
+    """Files of a deploy version with their content object and size."""
+    try:
+        files = await run_in_threadpool(deploy.read_manifest, project_id, version)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Deploy not found")
+    return DeployManifestResponse(version=version, files=files)
+
+
+@router.post("/{version}/activate", response_model=DeployResponse)
+async def activate_deploy(
+    project_id: str,
+    version: int,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Point prod at an earlier (or later) deploy version.
+
+    Releases are kept as complete trees on disk, so this is a single
+    symlink swap regardless of project size. A release missing from disk
+    (``pruned`` by older versions) is first rebuilt from its manifest and
+    the object store.
+    """
+    doc = await db.deploys.find_one({"project_id": project_id, "version": version})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Deploy not found")
+    if doc["status"] not in ("ready", "pruned"):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Deploy {version} cannot be activated (status: {doc['status']})",
+        )
+
+    await _acquire_lock(redis, project_id)
+    try:
+        try:
+            await run_in_threadpool(deploy.restore_release, project_id, version)
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Release content is no longer in the object store",
+            )
+        if doc["status"] == "pruned":
+            await db.deploys.update_one({"_id": doc["_id"]}, {"$set": {"status": "ready"}})
+            await disk_usage.mark_dirty(project_id)
+        await _activate(db, project_id, version)
+    finally:
+        await redis.delete(f"deploy:{project_id}")
+
+    doc = await db.deploys.find_one({"_id": doc["_id"]})
+    return _deploy_to_response(doc, version)
@@ -0,0 +1,136 @@
+"""Environment routes: preview container settings and state."""
+
+from datetime import datetime, timezone
+
+import redis.asyncio as aioredis
+from fastapi import APIRouter, Depends, HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import get_owned_project
+from app.models.environment import ENV_TYPES
+from app.schemas.environment import (
+    EnvironmentListResponse,
+    EnvironmentResponse,
+    EnvironmentUpdate,
+)
+from app.utils import preview
+from app.utils.settings_cache import get_global_settings
+
+router = APIRouter()
+
+
+async def _environment(
+    db: AsyncIOMotorDatabase, project: dict, env_type: str
+) -> dict:
+    if env_type not in ENV_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid environment")
+    for env in await preview.ensure_environments(db, project):
+        if env["type"] == env_type:
+            return env
+
+
+async def _to_response(
+    db: AsyncIOMotorDatabase, redis: aioredis.Redis, env: dict
+) -> EnvironmentResponse:
+    config = preview.container_config(env)
+    current = await preview.state(redis, env["project_id"], env["type"])
+    last_access = current["last_access"]
+    return EnvironmentResponse(
+        type=env["type"],
+        domain=env.get("domain"),
+        url=preview.preview_url(await get_global_settings(db), env.get("domain")),
+        image=config["image"],
+        command=config["command"],
+        port=config["port"],
+        idle_timeout=config["idle_timeout"],
+        state=current["state"],
+        last_access_at=(
+            datetime.fromtimestamp(last_access, timezone.utc)
+            if last_access is not None
+            else None
+        ),
+        error=current["error"],
+    )
+
+
+@router.get("", response_model=EnvironmentListResponse)
+async def list_environments(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """The project's environments, their preview settings and whether they run."""
+    envs = await preview.ensure_environments(db, project)
+    return EnvironmentListResponse(
+        environments=[await _to_response(db, redis, env) for env in envs]
+    )
+
+
+@router.patch("/{env_type}", response_model=EnvironmentResponse)
+async def update_environment(
+    project_id: str,
+    env_type: str,
+    request: EnvironmentUpdate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Change the preview container's image, command, port or idle timeout.
+
+    Empty values go back to the server's defaults. A running preview is
+    stopped when its container changes, and the next request starts it
+    with the new settings; a new idle timeout applies from the next start.
+    """
+    update_data = request.model_dump(exclude_none=True)
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    env = await _environment(db, project, env_type)
+    update = {name: value or None for name, value in update_data.items()}
+    update["updated_at"] = datetime.now(timezone.utc)
+    await db.environments.update_one({"_id": env["_id"]}, {"$set": update})
+    env.update(update)
+
+    if env.get("image"):
+        await preview.register_image(redis, env["image"])
+    if update_data.keys() & {"image", "command", "port"}:
+        await preview.stop(redis, project_id, env_type)
+    return await _to_response(db, redis, env)
+
+
+@router.post(
+    "/{env_type}/start",
+    response_model=EnvironmentResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def start_environment(
+    project_id: str,
+    env_type: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Start the preview ahead of its first request (it still stops when idle)."""
+    env = await _environment(db, project, env_type)
+    await preview.start(redis, env)
+    return await _to_response(db, redis, env)
+
+
+@router.post(
+    "/{env_type}/stop",
+    response_model=EnvironmentResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def stop_environment(
+    project_id: str,
+    env_type: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Stop the preview now; the next request to it starts it again."""
+    env = await _environment(db, project, env_type)
+    await preview.stop(redis, project_id, env_type)
+    return await _to_response(db, redis, env)
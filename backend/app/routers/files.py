@@ -1,23 +1,81 @@
 """File browser routes: list, read, write files within project directories."""
 
+import io
+import json
+import logging
 import mimetypes
 import os
+import re
+import stat as stat_module
+import time
+import uuid
+from collections.abc import Iterable, Iterator
 from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 
-from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, Query
+from anyio import from_thread
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import FileResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 
 from app.config import settings
 from app.db.mongodb import get_db
-from app.dependencies import get_current_user
+from app.db.redis import get_redis
+from app.dependencies import get_owned_project
+from app.utils import disk_usage, file_index
+from app.utils.archive import (
+    ArchiveError,
+    Importer,
+    QuotaExceeded,
+    extract_multipart,
+    extract_tar,
+    iter_tar_gz,
+    iter_zip,
+)
+from app.utils.code_search import compile_query, search
+from app.utils.fs import (
+    atomic_write,
+    file_etag,
+    iter_files,
+    list_dir,
+    walk_tree,
+    write_lock,
+)
+from app.utils.gitignore import DEFAULT_EXCLUDES
+from app.utils.line_index import read_lines
+from app.utils.patch import PatchError, apply_range_edits, apply_unified_diff
+from app.utils.tree_hash import compare, unified_diff
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # Maximum file size for reading/writing (10 MB)
 MAX_FILE_SIZE = 10 * 1024 * 1024
 
+# Maximum number of lines returned by a single line-windowed read
+MAX_WINDOW_LINES = 10_000
+
+# Maximum number of entries returned by a single directory listing
+MAX_LIST_ENTRIES = 5000
+
+# Maximum number of entries streamed by a single tree request
+MAX_TREE_ENTRIES = 100_000
+
+# Limits for batch reads: files per request and total content size
+MAX_BATCH_FILES = 200
+MAX_BATCH_BYTES = 20 * 1024 * 1024
+
 
 class FileEntry(BaseModel):
     name: str
@@ -29,6 +87,9 @@ class FileEntry(BaseModel):
 class DirectoryListing(BaseModel):
     path: str
     entries: list[FileEntry]
+    total: int = 0
+    offset: int = 0
+    truncated: bool = False  # more entries exist beyond this page
 
 
 class FileContent(BaseModel):
@@ -36,6 +97,69 @@ class FileContent(BaseModel):
     content: str
     language: str | None = None
     size: int
+    etag: str | None = None
+    # Set for line-windowed reads (lines=start:end)
+    start_line: int | None = None
+    end_line: int | None = None
+    total_lines: int | None = None
+
+
+class FileMatch(BaseModel):
+    path: str
+    score: int
+
+
+class FileFindResult(BaseModel):
+    results: list[FileMatch]
+    candidates: int  # paths matching the query before ranking
+    total_files: int
+    truncated: bool = False  # index stopped at file_index_max_files
+
+
+class BatchReadRequest(BaseModel):
+    paths: list[str] = Field(..., min_length=1, max_length=MAX_BATCH_FILES)
+    max_size: int = Field(default=1024 * 1024, ge=1, le=MAX_FILE_SIZE)  # per file
+    etags: dict[str, str] = {}  # path -> ETag the client already has
+
+
+class BatchFile(BaseModel):
+    path: str
+    content: str | None = None
+    language: str | None = None
+    size: int | None = None
+    etag: str | None = None
+    not_modified: bool = False  # matches the ETag sent in ``etags``
+    # "not_found", "access_denied", "too_large", "binary", "not_utf8" or
+    # "batch_too_large" (the response reached MAX_BATCH_BYTES)
+    error: str | None = None
+
+
+class BatchReadResponse(BaseModel):
+    files: list[BatchFile]
+
+
+class ImportResult(BaseModel):
+    import_id: str
+    files: int
+    directories: int
+    bytes: int
+    skipped: list[str]  # "name: reason", first 100 only
+    skipped_count: int
+
+
+class EnvComparison(BaseModel):
+    base: str
+    target: str
+    identical: bool
+    base_hash: str
+    target_hash: str
+    # Going from base to target
+    added: list[str]
+    removed: list[str]
+    modified: list[str]
+    # An index stopped at file_index_max_files: directories it left out are
+    # not compared, so the lists may be incomplete and identical is false
+    truncated: bool = False
 
 
 class FileWriteRequest(BaseModel):
@@ -43,6 +167,37 @@ class FileWriteRequest(BaseModel):
     content: str
 
 
+class RangeEdit(BaseModel):
+    start: int = Field(..., ge=1)  # first line replaced (1-based)
+    end: int = Field(..., ge=0)  # last line replaced, inclusive; start - 1 inserts
+    content: str
+
+
+class FilePatchRequest(BaseModel):
+    path: str = Field(..., min_length=1)
+    diff: str | None = None  # unified diff against the current content
+    # Line numbers refer to the current content
+    edits: list[RangeEdit] | None = Field(default=None, min_length=1)
+
+
+class FileWriteResult(BaseModel):
+    status: str = "ok"
+    path: str
+    etag: str
+    size: int
+
+
+def _env_root(project_id: str, env: str) -> str:
+    """Root directory of a project environment."""
+    return os.path.join(settings.projects_data_dir, project_id, env)
+
+
+def _relative_path(project_id: str, env: str, resolved: str) -> str:
+    """POSIX path of a resolved path relative to its environment root."""
+    rel = os.path.relpath(resolved, _env_root(project_id, env))
+    return "" if rel == "." else rel.replace(os.sep, "/")
+
+
 def _resolve_project_path(project_id: str, env: str, file_path: str) -> str:
     """Resolve and validate a file path within a project directory.
 
@@ -52,7 +207,7 @@ def _resolve_project_path(project_id: str, env: str, file_path: str) -> str:
     if env not in ("staging", "prod"):
         raise HTTPException(status_code=400, detail="Invalid environment")
 
-    base_dir = os.path.join(settings.projects_data_dir, project_id, env)
+    base_dir = _env_root(project_id, env)
     # Normalize and join the path
     resolved = os.path.normpath(os.path.join(base_dir, file_path.lstrip("/")))
 
@@ -63,6 +218,286 @@ def _resolve_project_path(project_id: str, env: str, file_path: str) -> str:
     return resolved
 
 
+def _resolve_writable_path(project_id: str, env: str, file_path: str) -> str:
+    """Like :func:`_resolve_project_path`, for writes; prod is refused (403).
+
+    prod only changes through deploys: its files are hardlinks to objects
+    shared by every release, so writing one would change them all.
+    """
+    resolved = _resolve_project_path(project_id, env, file_path)
+    if env != "staging":
+        raise HTTPException(
+            status_code=403, detail="prod is read-only; deploy staging to change it"
+        )
+    return resolved
+
+
+def _ndjson(
+    records: Iterable[dict],
+    chunk_size: int = 64 * 1024,
+    flush_interval: float = 0.1,
+) -> Iterator[bytes]:
+    """Encode records as NDJSON, batched into chunks.
+
+    A chunk is sent once it reaches ``chunk_size`` bytes or ``flush_interval``
+    seconds after the previous one, so slow producers still stream.
+    """
+    buf: list[bytes] = []
+    size = 0
+    last_flush = time.monotonic()
+    for record in records:
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        buf.append(line)
+        size += len(line)
+        if size >= chunk_size or time.monotonic() - last_flush >= flush_interval:
+            yield b"".join(buf)
+            buf, size = [], 0
+            last_flush = time.monotonic()
+    if buf:
+        yield b"".join(buf)
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _not_modified(
+    st: os.stat_result,
+    etag: str,
+    if_none_match: str | None,
+    if_modified_since: str | None,
+) -> bool:
+    """Evaluate conditional request headers against a file's stat results."""
+    if if_none_match is not None:
+        candidates = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(st.st_mtime) <= since.timestamp()
+    return False
+
+
+def _read_batch(project_id: str, env: str, request: BatchReadRequest) -> list[dict]:
+    """Read several files, reporting problems per file instead of failing."""
+    files = []
+    budget = MAX_BATCH_BYTES
+    for path in request.paths:
+        result = {"path": path, "language": _detect_language(path)}
+        files.append(result)
+        try:
+            resolved = _resolve_project_path(project_id, env, path)
+        except HTTPException:
+            result["error"] = "access_denied"
+            continue
+        try:
+            st = os.stat(resolved)
+        except OSError:
+            st = None
+        if st is None or not stat_module.S_ISREG(st.st_mode):
+            result["error"] = "not_found"
+            continue
+
+        etag = file_etag(st)
+        result.update(size=st.st_size, etag=etag)
+        if request.etags.get(path) == etag:
+            result["not_modified"] = True
+            continue
+        mime_type, _ = mimetypes.guess_type(resolved)
+        if mime_type and not mime_type.startswith("text") and mime_type != "application/json":
+            result["error"] = "binary"
+            continue
+        if st.st_size > request.max_size:
+            result["error"] = "too_large"
+            continue
+        if st.st_size > budget:
+            result["error"] = "batch_too_large"
+            continue
+        try:
+            result["content"] = _read_text(resolved)
+        except UnicodeDecodeError:
+            result["error"] = "not_utf8"
+            continue
+        except OSError:
+            result["error"] = "not_found"
+            continue
+        budget -= st.st_size
+    return files
+
+
+class _RequestBodyReader(io.RawIOBase):
+    """Blocking file-like view of a request body, for use in a worker thread.
+
+    Each read pulls the next chunk from the event loop, so the upload is
+    consumed as fast as the consumer writes it out, never buffered whole.
+    """
+
+    def __init__(self, request: Request):
+        self._chunks = request.stream()
+        self._buf = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    async def _next_chunk(self) -> bytes | None:
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def readinto(self, buffer) -> int:
+        while not self._buf:
+            chunk = from_thread.run(self._next_chunk)
+            if chunk is None:
+                return 0
+            self._buf = memoryview(chunk)
+        n = min(len(buffer), len(self._buf))
+        buffer[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+async def _publish_event(project_id: str, event: dict) -> None:
+    """Publish an event on the project's websocket channel (best effort)."""
+    try:
+        await get_redis().publish(
+            f"project:{project_id}:chat", json.dumps({"event": event})
+        )
+    except Exception:
+        logger.warning("Could not publish %s for project %s", event["type"], project_id)
+
+
+async def _run_import(
+    project_id: str,
+    env: str,
+    dest: str,
+    import_id: str,
+    overwrite: bool,
+    work,
+    response: Response,
+) -> ImportResult:
+    """Run ``work(importer)`` in a worker thread, publishing progress events.
+
+    The import may use up what is left of the project's hard disk quota
+    (413 beyond it). Usage moves by each written file's size change at once
+    (replaced files count only their growth); the project is re-measured
+    afterwards.
+    """
+    quota = await disk_usage.enforce_quota(get_db(), project_id)
+    max_bytes = settings.import_max_mb * 1024 * 1024
+    if quota["headroom_bytes"] is not None:
+        max_bytes = min(max_bytes, quota["headroom_bytes"])
+    if quota["state"] != "ok":
+        response.headers["X-Disk-Quota"] = quota["state"]
+
+    def on_progress(totals: dict) -> None:
+        event = {"type": "import_progress", "import_id": import_id, "done": False}
+        event.update(files=totals["files"], bytes=totals["bytes"])
+        from_thread.run(_publish_event, project_id, event)
+
+    def on_file(old: os.stat_result | None, new: os.stat_result) -> None:
+        nonlocal size_delta
+        size_delta += disk_usage.size_change(old, new)
+
+    def run() -> dict:
+        importer = Importer(
+            _env_root(project_id, env),
+            _relative_path(project_id, env, dest),
+            settings.import_max_files,
+            max_bytes,
+            overwrite=overwrite,
+            on_progress=on_progress,
+            on_file=on_file,
+        )
+        try:
+            work(importer)
+        finally:
+            totals.update(importer.result())
+        return totals
+
+    totals: dict = {"files": 0, "bytes": 0}
+    size_delta = 0
+    error = None
+    try:
+        await run_in_threadpool(run)
+    except QuotaExceeded as e:
+        error = HTTPException(status_code=413, detail=str(e))
+    except ArchiveError as e:
+        error = HTTPException(status_code=400, detail=str(e))
+    finally:
+        await disk_usage.add(get_db(), project_id, size_delta)
+        await disk_usage.mark_dirty(project_id)
+        await _publish_event(
+            project_id,
+            {
+                "type": "import_progress",
+                "import_id": import_id,
+                "done": True,
+                "files": totals["files"],
+                "bytes": totals["bytes"],
+                "error": error.detail if error else None,
+            },
+        )
+    if error:
+        raise error
+    return ImportResult(import_id=import_id, **totals)
+
+
+def _etag_matches(if_match: str, etag: str) -> bool:
+    """Evaluate an If-Match header (strong comparison, as RFC 9110 requires)."""
+    candidates = {t.strip() for t in if_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _check_precondition(path: str, if_match: str | None) -> os.stat_result | None:
+    """Stat ``path`` and enforce If-Match. Call with the file's write lock held."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if if_match is not None and (st is None or not _etag_matches(if_match, file_etag(st))):
+        raise HTTPException(
+            status_code=412, detail="File has been modified (ETag mismatch)"
+        )
+    return st
+
+
+def _put_file(path: str, if_match: str | None, data: bytes) -> tuple:
+    """Write ``path``; returns its stat before (or None) and after."""
+    with write_lock(path):
+        old = _check_precondition(path, if_match)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return old, atomic_write(path, data)
+
+
+def _patch_file(path: str, if_match: str | None, request: FilePatchRequest) -> tuple:
+    """Patch ``path``; returns its stat before and after."""
+    with write_lock(path):
+        st = _check_precondition(path, if_match)
+        if st is None or not stat_module.S_ISREG(st.st_mode):
+            raise HTTPException(status_code=404, detail="File not found")
+        if st.st_size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail="File too large (max 10 MB)")
+        try:
+            text = _read_text(path)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=415, detail="File is not valid UTF-8 text")
+
+        try:
+            if request.diff is not None:
+                text = apply_unified_diff(text, request.diff)
+            else:
+                text = apply_range_edits(
+                    text, [(e.start, e.end, e.content) for e in request.edits]
+                )
+        except PatchError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return st, atomic_write(path, text.encode("utf-8"))
+
+
 def _detect_language(file_path: str) -> str | None:
     """Detect editor language from file extension."""
     ext_map = {
@@ -108,68 +543,398 @@ async def list_directory(
     project_id: str,
     path: str = Query(default="/"),
     env: str = Query(default="staging"),
-    db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    sort: str = Query(default="name", pattern="^(name|mtime|size)$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
+    dirs_first: bool = Query(default=False),
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=1000, ge=1, le=MAX_LIST_ENTRIES),
+    project: dict = Depends(get_owned_project),
 ):
     """List files and directories at the given path."""
-    # Verify project ownership
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
+    resolved = _resolve_project_path(project_id, env, path)
+
+    try:
+        entries, total = await run_in_threadpool(
+            list_dir, resolved, sort, order, dirs_first, offset, limit
+        )
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="Directory not found")
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    return DirectoryListing(
+        path=path,
+        entries=[
+            FileEntry(
+                name=e["name"],
+                type=e["type"],
+                size=e["size"],
+                modified=datetime.fromtimestamp(e["mtime"], tz=timezone.utc),
+            )
+            for e in entries
+        ],
+        total=total,
+        offset=offset,
+        truncated=offset + len(entries) < total,
     )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
 
+
+@router.get("/tree")
+async def tree(
+    project_id: str,
+    path: str = Query(default="/"),
+    env: str = Query(default="staging"),
+    depth: int = Query(default=5, ge=1, le=50),
+    max_entries: int = Query(default=10_000, ge=1, le=MAX_TREE_ENTRIES),
+    gitignore: bool = Query(default=True),
+    exclude_defaults: bool = Query(default=True),
+    details: bool = Query(default=False),
+    project: dict = Depends(get_owned_project),
+):
+    """Stream a recursive, gitignore-aware listing as NDJSON.
+
+    Emits one ``{"path", "entries"}`` line per directory, breadth-first, so
+    the client can render the top of the tree before the walk finishes.
+    Listings with the default filters and without details are served from
+    the project's in-memory file index.
+    """
     resolved = _resolve_project_path(project_id, env, path)
+    if not await run_in_threadpool(os.path.isdir, resolved):
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    root = _env_root(project_id, env)
+    start = _relative_path(project_id, env, resolved)
+    if gitignore and exclude_defaults and not details:
+        index = await file_index.get_index(root)
+        if index.has_dir(start):
+            records = await run_in_threadpool(index.walk, start, depth, max_entries)
+            return StreamingResponse(
+                _ndjson(records), media_type="application/x-ndjson"
+            )
+
+    records = walk_tree(
+        root,
+        start,
+        depth=depth,
+        max_entries=max_entries,
+        use_gitignore=gitignore,
+        excludes=DEFAULT_EXCLUDES if exclude_defaults else frozenset({".git"}),
+        details=details,
+    )
+    # Starlette iterates sync generators in the threadpool
+    return StreamingResponse(_ndjson(records), media_type="application/x-ndjson")
 
-    if not os.path.isdir(resolved):
+
+@router.get("/find", response_model=FileFindResult)
+async def find_files(
+    project_id: str,
+    q: str = Query(..., min_length=1, max_length=256),
+    env: str = Query(default="staging"),
+    limit: int = Query(default=50, ge=1, le=500),
+    project: dict = Depends(get_owned_project),
+):
+    """Fuzzy file lookup ("go to file") served from the in-memory index.
+
+    Matches paths containing the query's characters in order, ranked by
+    file-name hits, consecutive runs and word starts. Ignored files are
+    never indexed.
+    """
+    root = _resolve_project_path(project_id, env, "/")
+    if not await run_in_threadpool(os.path.isdir, root):
         raise HTTPException(status_code=404, detail="Directory not found")
 
-    entries = []
+    index = await file_index.get_index(root)
+    results, candidates = await run_in_threadpool(index.find, q, limit)
+    return FileFindResult(
+        results=[FileMatch(**r) for r in results],
+        candidates=candidates,
+        total_files=index.file_count,
+        truncated=index.truncated,
+    )
+
+
+@router.get("/search")
+async def search_files(
+    project_id: str,
+    q: str = Query(..., min_length=1, max_length=1000),
+    path: str = Query(default="/"),
+    env: str = Query(default="staging"),
+    regex: bool = Query(default=False),
+    case_sensitive: bool = Query(default=False),
+    include: list[str] = Query(default=[]),
+    exclude: list[str] = Query(default=[]),
+    gitignore: bool = Query(default=True),
+    exclude_defaults: bool = Query(default=True),
+    context: int = Query(default=2, ge=0, le=10),
+    max_results: int = Query(default=500, ge=1, le=10_000),
+    project: dict = Depends(get_owned_project),
+):
+    """Search file contents, streaming matches as NDJSON.
+
+    Each ``{"type": "match"}`` line carries the path, 1-based line and
+    column, the line text and ``context`` lines before and after. A final
+    ``{"type": "summary"}`` line reports totals and whether the search
+    stopped at ``max_results``. ``include``/``exclude`` are globs matched
+    against the relative path or the file name. Regexes with nested
+    quantifiers are refused (400), and a file the query cannot finish
+    within ``search_regex_timeout`` is counted in ``files_timed_out``.
+    """
     try:
-        for entry_name in sorted(os.listdir(resolved)):
-            # Skip hidden files like .git internals, but keep .env, .gitignore etc.
-            if entry_name in (".git",):
-                continue
-
-            entry_path = os.path.join(resolved, entry_name)
-            stat = os.stat(entry_path)
-            entries.append(
-                FileEntry(
-                    name=entry_name,
-                    type="directory" if os.path.isdir(entry_path) else "file",
-                    size=stat.st_size,
-                    modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
-                )
-            )
-    except PermissionError:
-        raise HTTPException(status_code=403, detail="Permission denied")
+        pattern = compile_query(q, regex, case_sensitive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    resolved = _resolve_project_path(project_id, env, path)
+    if not await run_in_threadpool(os.path.isdir, resolved):
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    results = search(
+        _env_root(project_id, env),
+        _relative_path(project_id, env, resolved),
+        pattern,
+        include,
+        exclude,
+        use_gitignore=gitignore,
+        exclude_defaults=exclude_defaults,
+        context=context,
+        max_results=max_results,
+    )
+    return StreamingResponse(_ndjson(results), media_type="application/x-ndjson")
+
+
+@router.post("/batch", response_model=BatchReadResponse)
+async def read_files(
+    project_id: str,
+    request: BatchReadRequest,
+    env: str = Query(default="staging"),
+    project: dict = Depends(get_owned_project),
+):
+    """Read many text files in one request.
+
+    Problems are reported per file in ``error`` rather than failing the
+    whole batch. Files whose ETag matches the one given in ``etags`` come
+    back with ``not_modified`` and no content.
+    """
+    _resolve_project_path(project_id, env, "/")  # validates env
+    files = await run_in_threadpool(_read_batch, project_id, env, request)
+    return BatchReadResponse(files=[BatchFile(**f) for f in files])
+
+
+@router.get("/archive")
+async def download_archive(
+    project_id: str,
+    path: str = Query(default="/"),
+    env: str = Query(default="staging"),
+    format: str = Query(default="zip", pattern="^(zip|tar.gz)$"),
+    gitignore: bool = Query(default=True),
+    exclude_defaults: bool = Query(default=True),
+    project: dict = Depends(get_owned_project),
+):
+    """Download a directory (or a whole environment) as a streamed archive.
+
+    The archive is generated while it is sent, so any size can be exported
+    without buffering it. Ignored files are left out unless ``gitignore``
+    and ``exclude_defaults`` are turned off (``.git`` is always skipped).
+    """
+    resolved = _resolve_project_path(project_id, env, path)
+    if not await run_in_threadpool(os.path.isdir, resolved):
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    root = _env_root(project_id, env)
+    start = _relative_path(project_id, env, resolved)
+    files = iter_files(
+        root,
+        start,
+        use_gitignore=gitignore,
+        excludes=DEFAULT_EXCLUDES if exclude_defaults else frozenset({".git"}),
+    )
+
+    name = re.sub(r"[^\w.-]+", "_", project.get("name") or project_id)
+    if start:
+        name += "-" + re.sub(r"[^\w.-]+", "_", start)
+    filename = f"{name}-{env}.{format}"
+    if format == "zip":
+        body, media_type = iter_zip(root, files), "application/zip"
+    else:
+        body, media_type = iter_tar_gz(root, files), "application/gzip"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/compare", response_model=EnvComparison)
+async def compare_environments(
+    project_id: str,
+    base: str = Query(default="prod"),
+    target: str = Query(default="staging"),
+    project: dict = Depends(get_owned_project),
+):
+    """List files added, removed and modified between two environments.
+
+    By default this shows what promoting ``staging`` to ``prod`` would
+    change. Both environments are compared through cached content-hash
+    trees, so unchanged subtrees cost nothing. Ignored files are left out.
+    If either index is truncated the result is flagged as such and never
+    reported identical.
+    """
+    indexes = []
+    for env in (base, target):
+        _resolve_project_path(project_id, env, "/")  # validates env
+        indexes.append(await file_index.get_index(_env_root(project_id, env)))
+
+    changes = await run_in_threadpool(compare, *indexes)
+    base_hash, target_hash = [
+        await run_in_threadpool(index.digest) for index in indexes
+    ]
+    truncated = any(index.truncated for index in indexes)
+    return EnvComparison(
+        base=base,
+        target=target,
+        identical=not truncated and base_hash == target_hash,
+        truncated=truncated,
+        base_hash=base_hash,
+        target_hash=target_hash,
+        **changes,
+    )
+
+
+@router.get("/compare/file")
+async def diff_file_between_environments(
+    project_id: str,
+    path: str = Query(...),
+    base: str = Query(default="prod"),
+    target: str = Query(default="staging"),
+    context: int = Query(default=3, ge=0, le=100),
+    project: dict = Depends(get_owned_project),
+):
+    """Unified diff of one file between two environments (``text/x-diff``).
+
+    A file missing on one side diffs against empty content. The output can
+    be applied with ``PATCH /content``.
+    """
+    base_path = _resolve_project_path(project_id, base, path)
+    target_path = _resolve_project_path(project_id, target, path)
+    rel = path.lstrip("/")
+    try:
+        diff = await run_in_threadpool(
+            unified_diff,
+            base_path,
+            target_path,
+            f"{base}/{rel}",
+            f"{target}/{rel}",
+            context,
+        )
+    except IsADirectoryError:
+        raise HTTPException(status_code=400, detail="Path is a directory")
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    return Response(content=diff, media_type="text/x-diff")
+
+
+@router.post("/import", response_model=ImportResult)
+async def import_archive(
+    project_id: str,
+    request: Request,
+    response: Response,
+    path: str = Query(default="/"),
+    env: str = Query(default="staging"),
+    strip_components: int = Query(default=0, ge=0, le=10),
+    overwrite: bool = Query(default=True),
+    import_id: str | None = Query(default=None, pattern=r"^[\w-]{1,64}$"),
+    project: dict = Depends(get_owned_project),
+):
+    """Import a tar archive (plain, gzip, bzip2 or xz) sent as the request body.
+
+    Members are extracted while the upload streams in. Paths escaping the
+    destination, links and special files are skipped and listed. Exceeding
+    ``import_max_files`` or ``import_max_mb`` aborts with 413 (files written
+    so far are kept). Progress is published on the project websocket as
+    ``import_progress`` events; pass ``import_id`` to recognise them.
+    Only staging can be imported into (403 for prod).
+    """
+    dest = _resolve_writable_path(project_id, env, path)
+    reader = io.BufferedReader(_RequestBodyReader(request), 256 * 1024)
+    return await _run_import(
+        project_id,
+        env,
+        dest,
+        import_id or uuid.uuid4().hex,
+        overwrite,
+        lambda importer: extract_tar(reader, importer, strip_components),
+        response,
+    )
 
-    return DirectoryListing(path=path, entries=entries)
+
+@router.post("/upload", response_model=ImportResult)
+async def upload_files(
+    project_id: str,
+    request: Request,
+    response: Response,
+    path: str = Query(default="/"),
+    env: str = Query(default="staging"),
+    overwrite: bool = Query(default=True),
+    import_id: str | None = Query(default=None, pattern=r"^[\w-]{1,64}$"),
+    project: dict = Depends(get_owned_project),
+):
+    """Upload many files in one multipart request.
+
+    Each file part's filename is its path relative to ``path`` (browsers
+    send ``webkitRelativePath`` when it is passed as the filename), so a
+    whole folder can be uploaded at once. Files are written while the body
+    streams in, never spooled first. Same checks, quotas and progress
+    events as ``/import``.
+    """
+    dest = _resolve_writable_path(project_id, env, path)
+    max_bytes = settings.import_max_mb * 1024 * 1024
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(
+            status_code=413, detail=f"Upload too large (max {max_bytes} bytes)"
+        )
+
+    reader = io.BufferedReader(_RequestBodyReader(request), 256 * 1024)
+    content_type = request.headers.get("content-type", "")
+    return await _run_import(
+        project_id,
+        env,
+        dest,
+        import_id or uuid.uuid4().hex,
+        overwrite,
+        lambda importer: extract_multipart(reader, content_type, importer),
+        response,
+    )
 
 
 @router.get("/content", response_model=FileContent)
 async def read_file(
     project_id: str,
+    response: Response,
     path: str = Query(...),
     env: str = Query(default="staging"),
-    db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    lines: str | None = Query(default=None, pattern=r"^(-?\d+)?:(\d+)?$"),
+    if_none_match: str | None = Header(default=None),
+    project: dict = Depends(get_owned_project),
 ):
-    """Read a file's content."""
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
-    )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
+    """Read a file's content.
 
+    With ``lines=start:end`` (1-based, inclusive, either side optional;
+    ``-N:`` for the last N lines) only that window is returned, along with
+    the file's total line count. Windowed reads work on files of any size.
+    """
     resolved = _resolve_project_path(project_id, env, path)
 
-    if not os.path.isfile(resolved):
+    try:
+        st = await run_in_threadpool(os.stat, resolved)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat_module.S_ISREG(st.st_mode):
         raise HTTPException(status_code=404, detail="File not found")
 
-    file_size = os.path.getsize(resolved)
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail="File too large (max 10 MB)")
+    etag = file_etag(st)
+    if _not_modified(st, etag, if_none_match, None):
+        return Response(status_code=304, headers={"ETag": etag})
 
     # Check if file is binary
     mime_type, _ = mimetypes.guess_type(resolved)
@@ -178,9 +943,32 @@ async def read_file(
             status_code=415, detail="Binary files cannot be displayed"
         )
 
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    if lines is not None:
+        start_text, end_text = lines.split(":")
+        window = await run_in_threadpool(
+            read_lines,
+            resolved,
+            int(start_text) if start_text else None,
+            int(end_text) if end_text else None,
+            MAX_WINDOW_LINES,
+            MAX_FILE_SIZE,
+        )
+        return FileContent(
+            path=path,
+            language=_detect_language(path),
+            etag=etag,
+            **window,
+        )
+
+    file_size = st.st_size
+    if file_size > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File too large (max 10 MB)")
+
     try:
-        with open(resolved, "r", encoding="utf-8") as f:
-            content = f.read()
+        content = await run_in_threadpool(_read_text, resolved)
     except UnicodeDecodeError:
         raise HTTPException(status_code=415, detail="File is not valid UTF-8 text")
 
@@ -189,30 +977,118 @@ async def read_file(
         content=content,
         language=_detect_language(path),
         size=file_size,
+        etag=etag,
+    )
+
+
+@router.api_route("/raw", methods=["GET", "HEAD"])
+async def download_file(
+    project_id: str,
+    path: str = Query(...),
+    env: str = Query(default="staging"),
+    download: bool = Query(default=False),
+    if_none_match: str | None = Header(default=None),
+    if_modified_since: str | None = Header(default=None),
+    project: dict = Depends(get_owned_project),
+):
+    """Serve a file's raw bytes, any type or size.
+
+    Supports Range requests and revalidation through ETag/If-None-Match and
+    Last-Modified/If-Modified-Since; the body is sent with zero-copy
+    ``sendfile`` when the server supports it.
+    """
+    resolved = _resolve_project_path(project_id, env, path)
+
+    try:
+        st = await run_in_threadpool(os.stat, resolved)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat_module.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag = file_etag(st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+    if _not_modified(st, etag, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        resolved,
+        headers=headers,
+        filename=os.path.basename(resolved),
+        stat_result=st,
+        content_disposition_type="attachment" if download else "inline",
     )
 
 
-@router.put("/content")
+@router.put("/content", response_model=FileWriteResult)
 async def write_file(
     project_id: str,
     request: FileWriteRequest,
+    response: Response,
     env: str = Query(default="staging"),
+    if_match: str | None = Header(default=None),
     db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    project: dict = Depends(get_owned_project),
 ):
-    """Write content to a file."""
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
-    )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
+    """Write content to a file.
+
+    The file is replaced atomically. With ``If-Match`` the write only
+    happens if the file still has that ETag (412 otherwise); the new ETag
+    is returned. Refused with 507 if it would exceed the project's hard
+    disk quota; over the soft quota the ``X-Disk-Quota: soft`` header is
+    set. prod only changes through deploys (403).
+    """
+    resolved = _resolve_writable_path(project_id, env, request.path)
+    data = request.content.encode("utf-8")
+    quota = await disk_usage.enforce_quota(db, project_id, len(data))
 
-    resolved = _resolve_project_path(project_id, env, request.path)
+    old, st = await run_in_threadpool(_put_file, resolved, if_match, data)
+    await disk_usage.add(db, project_id, disk_usage.size_change(old, st))
 
-    # Create parent directories if needed
-    os.makedirs(os.path.dirname(resolved), exist_ok=True)
+    if quota["state"] != "ok":
+        response.headers["X-Disk-Quota"] = quota["state"]
+    etag = file_etag(st)
+    response.headers["ETag"] = etag
+    return FileWriteResult(path=request.path, etag=etag, size=st.st_size)
+
+
+@router.patch("/content", response_model=FileWriteResult)
+async def patch_file(
+    project_id: str,
+    request: FilePatchRequest,
+    response: Response,
+    env: str = Query(default="staging"),
+    if_match: str | None = Header(default=None),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Change part of a file without uploading all of it.
+
+    Send either ``diff`` (a unified diff; hunks may have drifted a little
+    from their stated positions) or ``edits`` (line ranges to replace).
+    Responds 409 if the patch does not apply and 412 if ``If-Match`` no
+    longer matches. The file is replaced atomically and the new ETag is
+    returned. Disk quotas apply as for ``PUT``.
+    """
+    if (request.diff is None) == (request.edits is None):
+        raise HTTPException(
+            status_code=422, detail="Provide exactly one of 'diff' or 'edits'"
+        )
+    resolved = _resolve_writable_path(project_id, env, request.path)
+    incoming = len((request.diff or "").encode("utf-8")) + sum(
+        len(e.content.encode("utf-8")) for e in request.edits or []
+    )
+    quota = await disk_usage.enforce_quota(db, project_id, incoming)
 
-    with open(resolved, "w", encoding="utf-8") as f:
-        f.write(request.content)
+    old, st = await run_in_threadpool(_patch_file, resolved, if_match, request)
+    await disk_usage.add(db, project_id, disk_usage.size_change(old, st))
 
-    return {"status": "ok", "path": request.path}
+    if quota["state"] != "ok":
+        response.headers["X-Disk-Quota"] = quota["state"]
+    etag = file_etag(st)
+    response.headers["ETag"] = etag
+    return FileWriteResult(path=request.path, etag=etag, size=st.st_size)
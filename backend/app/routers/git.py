@@ -0,0 +1,76 @@
+"""Git routes: clone, fetch and push a project's repository in the background."""
+
+import redis.asyncio as aioredis
+from fastapi import APIRouter, Depends, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import get_owned_project
+from app.schemas.project import GitSyncResponse
+from app.utils import git_sync
+
+router = APIRouter()
+
+
+@router.get("", response_model=GitSyncResponse)
+async def get_git_sync(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """State of the project's last clone, fetch or push."""
+    doc = await db.projects.find_one({"_id": project["_id"]}, {"git.sync": 1})
+    return GitSyncResponse(**(((doc or {}).get("git") or {}).get("sync") or {}))
+
+
+async def _queue(
+    action: str, db: AsyncIOMotorDatabase, redis: aioredis.Redis, project: dict
+) -> GitSyncResponse:
+    # Read fresh: the cached project may predate a change of remote or token
+    project = await db.projects.find_one({"_id": project["_id"]}) or project
+    return GitSyncResponse(**await git_sync.enqueue(db, redis, project, action))
+
+
+@router.post(
+    "/clone", response_model=GitSyncResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def clone_repository(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Check out the configured branch of the remote into staging.
+
+    Runs after any AI task working in staging. Files the branch contains
+    are overwritten; others are kept. Progress arrives as ``git_sync``
+    events on the project websocket.
+    """
+    return await _queue("clone", db, redis, project)
+
+
+@router.post(
+    "/fetch", response_model=GitSyncResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def fetch_repository(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Update ``origin/*`` from the remote; staging files are not touched."""
+    return await _queue("fetch", db, redis, project)
+
+
+@router.post(
+    "/push", response_model=GitSyncResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def push_repository(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis),
+    project: dict = Depends(get_owned_project),
+):
+    """Push the checked-out commit of staging to the configured branch."""
+    return await _queue("push", db, redis, project)
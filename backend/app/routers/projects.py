@@ -1,26 +1,49 @@
 """Project CRUD routes."""
 
+import base64
+import binascii
+import json
 import os
-import shutil
+import re
+from datetime import datetime, timezone
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
 
 from app.config import settings
 from app.db.mongodb import get_db
-from app.dependencies import get_current_user
+from app.dependencies import (
+    get_current_user,
+    get_owned_project,
+    get_owned_project_any_status,
+    invalidate_project,
+)
 from app.models.project import create_project_doc
 from app.schemas.project import (
     AIConfigUpdate,
+    GitConfigUpdate,
     ProjectCreate,
     ProjectListResponse,
     ProjectResponse,
+    ProjectStats,
     ProjectUpdate,
+    ProjectUsageResponse,
 )
+from app.utils import disk_usage, git_sync, preview, project_cleanup
+from app.utils.security import encrypt_value
 
 router = APIRouter()
 
+# ?sort= value -> (field, direction); ties are broken by _id in the same
+# direction, matching the (owner_id, field, _id) indexes
+_SORTS = {
+    "created": ("created_at", DESCENDING),
+    "activity": ("last_activity_at", DESCENDING),
+    "name": ("name", ASCENDING),
+}
+
 
 def _project_to_response(doc: dict) -> ProjectResponse:
     """Convert a MongoDB project document to a response schema."""
@@ -32,23 +55,82 @@ def _project_to_response(doc: dict) -> ProjectResponse:
         owner_id=doc["owner_id"],
         status=doc["status"],
         ai_config=doc["ai_config"],
-        git=doc["git"],
+        git=git_sync.project_git(doc["git"]),
+        deletion=doc.get("deletion"),
+        stats=ProjectStats(**doc.get("stats", {})),
+        last_activity_at=doc.get("last_activity_at", doc["updated_at"]),
         created_at=doc["created_at"],
         updated_at=doc["updated_at"],
     )
 
 
+def _encode_cursor(doc: dict, field: str) -> str:
+    value = doc.get(field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps([value, str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, last_id = json.loads(raw)
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, ObjectId(last_id)
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("", response_model=ProjectListResponse)
 async def list_projects(
+    q: str | None = Query(default=None, max_length=100),
+    sort: str = Query(default="created", pattern="^(created|activity|name)$"),
+    limit: int = Query(default=100, ge=1, le=200),
+    cursor: str | None = Query(default=None),
     db: AsyncIOMotorDatabase = Depends(get_db),
     user: dict = Depends(get_current_user),
 ):
-    """List all projects for the current user."""
-    cursor = db.projects.find({"owner_id": user["_id"]}).sort("created_at", -1)
-    projects = await cursor.to_list(length=100)
+    """List the current user's projects, a page at a time.
+
+    Pages are keyset-paginated: ``next_cursor`` encodes the sort key of
+    the last project returned, so every page is a single index range scan
+    however deep it is. ``q`` filters by name (case-insensitive substring).
+    Task and disk usage figures come from counters on each project.
+    """
+    field, direction = _SORTS[sort]
+    query: dict = {"owner_id": user["_id"]}
+    if q:
+        query["name"] = {"$regex": re.escape(q), "$options": "i"}
+
+    page_query = query
+    if cursor:
+        value, last_id = _decode_cursor(cursor)
+        op = "$lt" if direction == DESCENDING else "$gt"
+        page_query = {
+            **query,
+            "$or": [
+                {field: {op: value}},
+                {field: value, "_id": {op: last_id}},
+            ],
+        }
+
+    docs = (
+        await db.projects.find(page_query)
+        .sort([(field, direction), ("_id", direction)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = _encode_cursor(docs[-1], field)
+
     return ProjectListResponse(
-        projects=[_project_to_response(p) for p in projects],
-        total=len(projects),
+        projects=[_project_to_response(p) for p in docs],
+        total=await db.projects.count_documents(query),
+        next_cursor=next_cursor,
     )
 
 
@@ -83,6 +165,7 @@ async def create_project(
     os.makedirs(os.path.join(project_dir, ".home", ".claude"), exist_ok=True)
 
     doc["_id"] = result.inserted_id
+    await preview.ensure_environments(db, doc)
     return _project_to_response(doc)
 
 
@@ -90,17 +173,42 @@ async def create_project(
 async def get_project(
     project_id: str,
     db: AsyncIOMotorDatabase = Depends(get_db),
-    user: dict = Depends(get_current_user),
+    project: dict = Depends(get_owned_project_any_status),
 ):
-    """Get a project by ID."""
-    project = await db.projects.find_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
-    )
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
+    """Get a project by ID (including the progress of a pending deletion)."""
+    if project["status"] == "deleting":
+        # Progress changes faster than the ownership cache expires
+        project = await db.projects.find_one({"_id": project["_id"]}) or project
     return _project_to_response(project)
 
 
+@router.get("/{project_id}/usage", response_model=ProjectUsageResponse)
+async def get_project_usage(
+    project_id: str,
+    refresh: bool = Query(default=False),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Disk used by the project, per top-level directory, and its quota.
+
+    With ``refresh`` the project is re-measured now instead of on the
+    scanner's next pass.
+    """
+    if refresh:
+        await disk_usage.rescan(project_id)
+    doc = await db.projects.find_one(
+        {"_id": project["_id"]}, {"stats.disk_usage_bytes": 1, "disk_usage": 1}
+    ) or {}
+    usage = (doc.get("stats") or {}).get("disk_usage_bytes")
+    measured = doc.get("disk_usage") or {}
+    return ProjectUsageResponse(
+        disk_usage_bytes=usage,
+        breakdown=measured.get("breakdown", {}),
+        scanned_at=measured.get("scanned_at"),
+        **disk_usage.quota(usage),
+    )
+
+
 @router.patch("/{project_id}", response_model=ProjectResponse)
 async def update_project(
     project_id: str,
@@ -113,16 +221,19 @@ async def update_project(
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    from datetime import datetime, timezone
-
     update_data["updated_at"] = datetime.now(timezone.utc)
 
     result = await db.projects.update_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]},
+        {
+            "_id": ObjectId(project_id),
+            "owner_id": user["_id"],
+            "status": {"$ne": "deleting"},
+        },
         {"$set": update_data},
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
+    await invalidate_project(project_id)
 
     project = await db.projects.find_one({"_id": ObjectId(project_id)})
     return _project_to_response(project)
@@ -143,42 +254,104 @@ async def update_ai_config(
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    from datetime import datetime, timezone
-
     update_fields["updated_at"] = datetime.now(timezone.utc)
 
     result = await db.projects.update_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]},
+        {
+            "_id": ObjectId(project_id),
+            "owner_id": user["_id"],
+            "status": {"$ne": "deleting"},
+        },
         {"$set": update_fields},
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
+    await invalidate_project(project_id)
 
     project = await db.projects.find_one({"_id": ObjectId(project_id)})
     return _project_to_response(project)
 
 
-@router.delete("/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_project(
+@router.patch("/{project_id}/git", response_model=ProjectResponse)
+async def update_git_config(
     project_id: str,
+    request: GitConfigUpdate,
     db: AsyncIOMotorDatabase = Depends(get_db),
     user: dict = Depends(get_current_user),
 ):
-    """Delete a project and its data."""
-    result = await db.projects.delete_one(
-        {"_id": ObjectId(project_id), "owner_id": user["_id"]}
+    """Update a project's git remote, branch or access token.
+
+    Changing the remote stops background fetches until it is cloned again.
+    """
+    data = request.model_dump(exclude_none=True)
+    if not data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+
+    update: dict = {"$set": {"updated_at": datetime.now(timezone.utc)}}
+    if "repo_url" in data:
+        update["$set"]["git.repo_url"] = data["repo_url"]
+        update["$unset"] = {"git.cloned_at": ""}
+    if "branch" in data:
+        update["$set"]["git.branch"] = data["branch"]
+    if "token" in data:
+        token = data["token"]
+        update["$set"]["git.credentials"] = encrypt_value(token) if token else None
+
+    result = await db.projects.update_one(
+        {
+            "_id": ObjectId(project_id),
+            "owner_id": user["_id"],
+            "status": {"$ne": "deleting"},
+        },
+        update,
     )
-    if result.deleted_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
+    await invalidate_project(project_id)
 
-    # Clean up related data
-    await db.environments.delete_many({"project_id": project_id})
-    await db.chat_sessions.delete_many({"project_id": project_id})
-    await db.chat_messages.delete_many({"project_id": project_id})
-    await db.deploys.delete_many({"project_id": project_id})
-    await db.tasks.delete_many({"project_id": project_id})
+    project = await db.projects.find_one({"_id": ObjectId(project_id)})
+    return _project_to_response(project)
 
-    # Remove project directory
-    project_dir = os.path.join(settings.projects_data_dir, project_id)
-    if os.path.exists(project_dir):
-        shutil.rmtree(project_dir)
+
+@router.delete(
+    "/{project_id}",
+    response_model=ProjectResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def delete_project(
+    project_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    user: dict = Depends(get_current_user),
+):
+    """Delete a project and its data.
+
+    The project is marked ``deleting`` and cleaned up in the background;
+    ``GET /projects/{id}`` reports progress until it is gone.
+    """
+    if not ObjectId.is_valid(project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    owned = {"_id": ObjectId(project_id), "owner_id": user["_id"]}
+    project = await db.projects.find_one_and_update(
+        {**owned, "status": {"$ne": "deleting"}},
+        {
+            "$set": {
+                "status": "deleting",
+                "deletion": {
+                    "started_at": datetime.now(timezone.utc),
+                    "progress": None,
+                    "error": None,
+                },
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if project is None:
+        # Already being deleted: report it rather than starting over
+        project = await db.projects.find_one(owned)
+        if project is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+    else:
+        await invalidate_project(project_id)
+
+    project_cleanup.start(project_id)
+    return _project_to_response(project)
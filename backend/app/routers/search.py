@@ -0,0 +1,25 @@
+"""Search routes spanning all of the current user's projects."""
+
+from fastapi import APIRouter, Depends, Query
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.db.mongodb import get_db
+from app.dependencies import get_current_user
+from app.schemas.chat import ChatSearchResponse
+from app.utils.text_search import search_messages
+
+router = APIRouter()
+
+
+@router.get("/messages", response_model=ChatSearchResponse)
+async def search_all_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=20, ge=1, le=100),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    user: dict = Depends(get_current_user),
+):
+    """Full-text search over chat history across all of the user's projects."""
+    cursor = db.projects.find({"owner_id": user["_id"]}, {"_id": 1})
+    project_ids = [str(p["_id"]) async for p in cursor]
+    return await search_messages(db, q, project_ids, page, page_size)
@@ -8,17 +8,20 @@ from datetime import datetime, timezone
 from pathlib import Path
 
 import httpx
+import redis.asyncio as aioredis
 from fastapi import APIRouter, Depends, HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.config import APP_VERSION
 from app.db.mongodb import get_db
+from app.db.redis import get_redis
 from app.dependencies import get_admin_user
 from app.models.settings import create_default_settings_doc
 from app.schemas.settings import (
     AISettingsUpdate,
     AccessSettingsUpdate,
     DomainSettingsUpdate,
+    PackageCacheStatsResponse,
     ServerInfoResponse,
     SetupCompleteRequest,
     SetupStatusResponse,
@@ -26,6 +29,7 @@ from app.schemas.settings import (
     VersionInfoResponse,
 )
 from app.utils.security import encrypt_value
+from app.utils.settings_cache import get_global_settings, publish_change
 
 UPDATE_DIR = Path("/app/.update")
 
@@ -184,7 +188,7 @@ async def get_setup_status(
 ):
     """Check if initial setup has been completed. No auth required."""
     user_count = await db.users.count_documents({})
-    settings_doc = await db.settings.find_one({"type": "global"})
+    settings_doc = await get_global_settings(db)
     setup_done = user_count > 0 and (
         settings_doc is not None and settings_doc.get("setup_completed", False)
     )
@@ -266,6 +270,7 @@ async def complete_setup(
             await _write_env_value("PORT", str(access_data["port"]))
 
     await db.settings.update_one({"type": "global"}, {"$set": update})
+    await publish_change()
 
     # Reload Caddy with new config
     updated_doc = await db.settings.find_one({"type": "global"})
@@ -323,6 +328,7 @@ async def update_ai_settings(
         update["ai.amp_api_key_encrypted"] = encrypt_value(data["amp_api_key"])
 
     await db.settings.update_one({"type": "global"}, {"$set": update})
+    await publish_change()
     return {"status": "ok"}
 
 
@@ -344,6 +350,7 @@ async def update_domain_settings(
         update["domain.ssl_email"] = data["ssl_email"]
 
     await db.settings.update_one({"type": "global"}, {"$set": update})
+    await publish_change()
 
     # Reload Caddy to pick up new domain config
     updated_doc = await db.settings.find_one({"type": "global"})
@@ -372,6 +379,7 @@ async def update_access_settings(
         await _write_env_value("PORT", str(data["port"]))
 
     await db.settings.update_one({"type": "global"}, {"$set": update})
+    await publish_change()
 
     # Reload Caddy with new config
     updated_doc = await db.settings.find_one({"type": "global"})
@@ -484,3 +492,32 @@ async def get_update_status(
                 pass
 
     return result
+
+
+@router.get("/package-cache", response_model=PackageCacheStatsResponse)
+async def get_package_cache_stats(
+    redis: aioredis.Redis = Depends(get_redis),
+    user: dict = Depends(get_admin_user),
+):
+    """Sizes and hit/miss totals of the package caches shared by all tasks."""
+    raw = await redis.hgetall("package_cache:stats")
+    values = {k.decode(): int(v) for k, v in raw.items()}
+
+    ecosystems: dict[str, dict] = {}
+    for key, value in values.items():
+        if ":" in key:
+            ecosystem, field = key.split(":", 1)
+            ecosystems.setdefault(ecosystem, {})[field] = value
+    for counts in ecosystems.values():
+        lookups = counts.get("hits", 0) + counts.get("misses", 0)
+        if lookups:
+            counts["hit_rate"] = counts.get("hits", 0) / lookups
+
+    pruned_at = values.get("pruned_at")
+    return PackageCacheStatsResponse(
+        max_bytes=values.get("max_bytes"),
+        pruned_at=(
+            datetime.fromtimestamp(pruned_at, timezone.utc) if pruned_at else None
+        ),
+        ecosystems=ecosystems,
+    )
@@ -0,0 +1,154 @@
+"""Task routes: inspect and roll back the workspace changes of an AI task."""
+
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from starlette.concurrency import run_in_threadpool
+
+from app.db.mongodb import get_db
+from app.dependencies import get_owned_project
+from app.schemas.task import (
+    TaskChangesResponse,
+    TaskRollbackRequest,
+    TaskRollbackResponse,
+)
+from app.utils import checkpoints
+from app.utils.checkpoints import CheckpointError
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+async def _get_task(db: AsyncIOMotorDatabase, project_id: str, task_id: str) -> dict:
+    task = await db.tasks.find_one({"task_id": task_id, "project_id": project_id})
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+
+def _workspace(task: dict) -> str | None:
+    """Session whose worktree the task ran in, or None for ``staging``."""
+    return task["session_id"] if task.get("isolated") else None
+
+
+async def _checkpoint_range(project_id: str, task: dict) -> tuple[str, str]:
+    """A task's ``(before, after)`` checkpoints.
+
+    Until the task has finished, ``after`` is the live workspace tree.
+    """
+    task_id = task["task_id"]
+    before, after = [
+        await run_in_threadpool(checkpoints.resolve, project_id, task_id, label)
+        for label in ("before", "after")
+    ]
+    if before is None:
+        raise HTTPException(status_code=404, detail="This task has no checkpoint")
+    if after is None:
+        try:
+            after = await run_in_threadpool(
+                checkpoints.snapshot_workspace, project_id, _workspace(task)
+            )
+        except CheckpointError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    return before, after
+
+
+@router.get("/{task_id}/changes", response_model=TaskChangesResponse)
+async def get_task_changes(
+    project_id: str,
+    task_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Files a task added, deleted or modified in ``staging``.
+
+    Both sides are git commits in the project's checkpoint repository, so
+    this costs one tree comparison however large the workspace is.
+    """
+    task = await _get_task(db, project_id, task_id)
+    before, after = await _checkpoint_range(project_id, task)
+    try:
+        files = await run_in_threadpool(checkpoints.changes, project_id, before, after)
+    except CheckpointError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finished = task["status"] not in checkpoints.ACTIVE_TASK_STATUSES
+    return TaskChangesResponse(
+        task_id=task_id,
+        status=task["status"],
+        before=before,
+        after=after if finished else None,
+        files=files,
+    )
+
+
+@router.get("/{task_id}/diff")
+async def get_task_diff(
+    project_id: str,
+    task_id: str,
+    path: str | None = Query(default=None),
+    context: int = Query(default=3, ge=0, le=100),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Unified diff (``text/x-diff``) of a task's changes, or of one file."""
+    task = await _get_task(db, project_id, task_id)
+    before, after = await _checkpoint_range(project_id, task)
+    try:
+        diff = await run_in_threadpool(
+            checkpoints.diff, project_id, before, after, path, context
+        )
+    except CheckpointError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=diff, media_type="text/x-diff")
+
+
+@router.post("/{task_id}/rollback", response_model=TaskRollbackResponse)
+async def rollback_task(
+    project_id: str,
+    task_id: str,
+    request: TaskRollbackRequest,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    project: dict = Depends(get_owned_project),
+):
+    """Restore the files a task changed to their state before it ran.
+
+    Only the task's own changes are undone. Files edited again since the
+    task finished are reported as conflicts (409) unless ``force`` is set.
+    The workspace as it was before the rollback is kept as a checkpoint.
+    Tasks of isolated sessions are rolled back in the session's worktree.
+    """
+    task = await _get_task(db, project_id, task_id)
+    if await checkpoints.workspace_busy(db, project_id, _workspace(task)):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Cannot roll back while a task is running in this workspace",
+        )
+
+    try:
+        result = await run_in_threadpool(
+            checkpoints.rollback,
+            project_id,
+            task_id,
+            request.force,
+            _workspace(task),
+        )
+    except CheckpointError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if result["conflicts"] and not request.force:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Files were changed again after the task",
+                "conflicts": result["conflicts"],
+            },
+        )
+
+    logger.info(
+        "Rolled back %d files of task %s in project %s",
+        len(result["restored"]),
+        task_id,
+        project_id,
+    )
+    return TaskRollbackResponse(task_id=task_id, **result)
@@ -1,12 +1,13 @@
 """WebSocket handler for real-time chat streaming."""
 
 import asyncio
-import json
 
-import redis.asyncio as aioredis
+from bson import ObjectId
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from app.config import settings
+from app.db.mongodb import get_db
+from app.db.redis import get_hub
+from app.utils import file_watch
 from app.utils.security import decode_access_token
 
 router = APIRouter()
@@ -19,8 +20,11 @@ async def chat_websocket(
 ):
     """WebSocket endpoint for streaming AI chat output.
 
-    Subscribes to Redis pub/sub channel for the project and forwards
-    all events to the connected client.
+    Subscribes to the project's Redis pub/sub channel through the shared
+    hub and forwards all events to the connected client. While connected,
+    the project's files are watched and ``files_changed`` events are
+    published on the same channel. Only the project's owner may connect
+    (4004 otherwise), and not while the project is being deleted (4003).
     """
     # Authenticate via query parameter
     token = websocket.query_params.get("token")
@@ -33,29 +37,38 @@ async def chat_websocket(
         await websocket.close(code=4001, reason="Invalid token")
         return
 
+    # Checked before anything is subscribed or watched
+    project = None
+    if ObjectId.is_valid(project_id):
+        project = await get_db().projects.find_one(
+            {"_id": ObjectId(project_id), "owner_id": user_id}, {"status": 1}
+        )
+    if project is None:
+        await websocket.close(code=4004, reason="Project not found")
+        return
+    if project.get("status") == "deleting":
+        await websocket.close(code=4003, reason="Project is being deleted")
+        return
+
     await websocket.accept()
 
-    r = aioredis.from_url(settings.redis_url)
-    pubsub = r.pubsub()
+    hub = get_hub()
     channel = f"project:{project_id}:chat"
-    await pubsub.subscribe(channel)
+    queue = await hub.subscribe(channel)
 
-    try:
+    async def forward() -> None:
         while True:
-            message = await pubsub.get_message(
-                ignore_subscribe_messages=True, timeout=1.0
-            )
-            if message and message["type"] == "message":
-                data = message["data"]
-                if isinstance(data, bytes):
-                    data = data.decode("utf-8")
-                await websocket.send_text(data)
-
-            # Small sleep to prevent busy-waiting
-            await asyncio.sleep(0.01)
+            data = await queue.get()
+            await websocket.send_text(data)
+
+    forwarder = asyncio.create_task(forward())
+    try:
+        async with file_watch.subscription(project_id):
+            # Reading detects client disconnects even when no events are flowing
+            while True:
+                await websocket.receive_text()
     except WebSocketDisconnect:
         pass
     finally:
-        await pubsub.unsubscribe(channel)
-        await pubsub.aclose()
-        await r.aclose()
+        forwarder.cancel()
+        await hub.unsubscribe(channel, queue)
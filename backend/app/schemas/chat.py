@@ -4,6 +4,8 @@ from datetime import datetime
 
 from pydantic import BaseModel, Field
 
+from app.schemas.task import TaskFileChange
+
 
 class ChatMessageCreate(BaseModel):
     content: str = Field(..., min_length=1, max_length=50000)
@@ -26,11 +28,43 @@ class ChatSessionResponse(BaseModel):
     project_id: str
     title: str
     status: str
+    isolated: bool = False  # works in its own worktree; merged into staging
     created_at: datetime
     updated_at: datetime
 
 
+class SessionMergeResponse(BaseModel):
+    session_id: str
+    merged: bool
+    files: list[TaskFileChange]  # changed in staging
+    conflicts: list[str]
+
+
 class ChatSendResponse(BaseModel):
     task_id: str
     message_id: str
     session_id: str
+
+
+class ChatSearchSnippet(BaseModel):
+    text: str
+    matches: list[list[int]]  # [start, end] offsets into text
+
+
+class ChatSearchHit(BaseModel):
+    id: str
+    session_id: str
+    session_title: str
+    project_id: str
+    role: str
+    score: float
+    snippets: list[ChatSearchSnippet]
+    created_at: datetime
+
+
+class ChatSearchResponse(BaseModel):
+    query: str
+    page: int
+    page_size: int
+    has_more: bool
+    results: list[ChatSearchHit]
@@ -0,0 +1,38 @@
+"""Deploy request/response schemas."""
+
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class DeployCreate(BaseModel):
+    message: str | None = Field(None, max_length=500)
+    activate: bool = True
+    gitignore: bool = False  # leave out files ignored by .gitignore
+
+
+class DeployResponse(BaseModel):
+    id: str
+    project_id: str
+    version: int
+    status: str
+    message: str | None
+    active: bool
+    file_count: int
+    total_bytes: int
+    new_bytes: int
+    manifest_digest: str | None
+    error: str | None
+    created_at: datetime
+    finished_at: datetime | None
+    activated_at: datetime | None
+
+
+class DeployListResponse(BaseModel):
+    deploys: list[DeployResponse]
+    active_version: int | None
+
+
+class DeployManifestResponse(BaseModel):
+    version: int
+    files: dict[str, list]  # path -> [object, size], symlinks [None, 0, target]
@@ -0,0 +1,30 @@
+"""Environment (preview container) request/response schemas."""
+
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class EnvironmentUpdate(BaseModel):
+    # "" goes back to the server's default
+    image: str | None = Field(None, max_length=200, pattern=r"^[\w./:@-]*$")
+    command: str | None = Field(None, max_length=1000)
+    port: int | None = Field(None, ge=1, le=65535)
+    idle_timeout: int | None = Field(None, ge=0, le=86400)  # seconds; 0 = default
+
+
+class EnvironmentResponse(BaseModel):
+    type: str  # staging | prod
+    domain: str | None  # subdomain label; None if another project has it
+    url: str | None  # None until a base domain is configured
+    image: str
+    command: str
+    port: int
+    idle_timeout: int | None  # None = the worker's default
+    state: str  # stopped | starting | running
+    last_access_at: datetime | None  # while running
+    error: str | None  # why the last start failed, for a minute
+
+
+class EnvironmentListResponse(BaseModel):
+    environments: list[EnvironmentResponse]
@@ -20,6 +20,36 @@ class AIConfigUpdate(BaseModel):
     model: str | None = None
     allowed_tools: list[str] | None = None
     append_system_prompt: str | None = None
+    # New chat sessions each work in their own git worktree, concurrently
+    isolated_sessions: bool | None = None
+
+
+class GitConfigUpdate(BaseModel):
+    repo_url: str | None = Field(
+        None, max_length=500, pattern=r"^(https?://|ssh://|git@)\S+$"
+    )
+    branch: str | None = Field(None, min_length=1, max_length=200)
+    # HTTPS access token; stored encrypted, "" removes it
+    token: str | None = None
+
+
+class GitSyncResponse(BaseModel):
+    job_id: str | None = None
+    action: str | None = None  # clone | fetch | push
+    state: str = "idle"  # idle | queued | running | done | failed
+    error: str | None = None
+    head: str | None = None
+    ahead: int | None = None  # commits on the project's branch, not on origin
+    behind: int | None = None  # commits on origin, not on the project's branch
+    queued_at: datetime | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+
+class ProjectStats(BaseModel):
+    active_tasks: int = 0  # queued or running
+    last_task_status: str | None = None
+    disk_usage_bytes: int | None = None  # None until first measured
 
 
 class ProjectResponse(BaseModel):
@@ -31,10 +61,23 @@ class ProjectResponse(BaseModel):
     status: str
     ai_config: dict
     git: dict
+    deletion: dict | None = None  # {"started_at", "progress", "error"}
+    stats: ProjectStats
+    last_activity_at: datetime
     created_at: datetime
     updated_at: datetime
 
 
+class ProjectUsageResponse(BaseModel):
+    disk_usage_bytes: int | None  # None until first measured
+    breakdown: dict[str, int]  # bytes per top-level entry (staging, prod, ...)
+    scanned_at: datetime | None  # last full measurement; writes adjust in between
+    soft_limit_bytes: int | None  # None = unlimited
+    hard_limit_bytes: int | None
+    state: str  # "ok", "soft" or "hard"
+
+
 class ProjectListResponse(BaseModel):
     projects: list[ProjectResponse]
-    total: int
+    total: int  # all projects matching the search, across pages
+    next_cursor: str | None = None  # pass as ?cursor= for the next page
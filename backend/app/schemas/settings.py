@@ -1,5 +1,7 @@
 """Settings request/response schemas."""
 
+from datetime import datetime
+
 from pydantic import BaseModel, Field
 
 
@@ -55,3 +57,19 @@ class UpdateStatusResponse(BaseModel):
     error: str | None = None
     log: str | None = None
     log_lines: int | None = None
+
+
+class PackageCacheEcosystem(BaseModel):
+    bytes: int = 0  # size at the last prune
+    entries: int = 0
+    hits: int = 0  # entries tasks reused (approximate, see the worker)
+    misses: int = 0  # entries tasks had to download
+    miss_bytes: int = 0
+    evicted_bytes: int = 0
+    hit_rate: float | None = None
+
+
+class PackageCacheStatsResponse(BaseModel):
+    max_bytes: int | None = None  # None until the worker has pruned once
+    pruned_at: datetime | None = None
+    ecosystems: dict[str, PackageCacheEcosystem]
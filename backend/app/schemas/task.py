@@ -0,0 +1,26 @@
+"""Task checkpoint request/response schemas."""
+
+from pydantic import BaseModel
+
+
+class TaskFileChange(BaseModel):
+    path: str
+    status: str  # "added", "deleted", "modified" or "type_changed"
+
+
+class TaskChangesResponse(BaseModel):
+    task_id: str
+    status: str
+    before: str
+    after: str | None  # None while the task runs: compared with the workspace
+    files: list[TaskFileChange]
+
+
+class TaskRollbackRequest(BaseModel):
+    force: bool = False  # also restore files changed again since the task
+
+
+class TaskRollbackResponse(BaseModel):
+    task_id: str
+    restored: list[str]
+    conflicts: list[str]
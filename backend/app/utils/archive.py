@@ -0,0 +1,541 @@
+"""Streaming archive export and import.
+
+Archives are produced as an iterator of byte chunks while the files are
+being read, and imported member by member while the upload is still
+arriving, so memory use is bounded by the chunk size rather than the
+archive size. Everything here is blocking and meant to run in a worker
+thread (Starlette iterates sync generators in its threadpool).
+"""
+
+import io
+import os
+import stat as stat_module
+import tarfile
+import time
+import uuid
+import zipfile
+import zlib
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from typing import BinaryIO
+
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+
+CHUNK_SIZE = 256 * 1024
+
+
+class _Sink:
+    """Write-only, unseekable buffer; zipfile then writes data descriptors."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _regular_files(
+    root: str, rel_paths: Iterable[str]
+) -> Iterator[tuple[str, str, os.stat_result]]:
+    for rel_path in rel_paths:
+        abs_path = os.path.join(root, rel_path)
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            continue
+        if stat_module.S_ISREG(st.st_mode):
+            yield rel_path, abs_path, st
+
+
+def iter_zip(root: str, rel_paths: Iterable[str]) -> Iterator[bytes]:
+    """Stream a deflated zip of ``rel_paths`` (POSIX paths relative to ``root``)."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for rel_path, abs_path, st in _regular_files(root, rel_paths):
+            info = zipfile.ZipInfo.from_file(
+                abs_path, rel_path, strict_timestamps=False
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            try:
+                src = open(abs_path, "rb")
+            except OSError:
+                continue
+            with src, zf.open(
+                info, "w", force_zip64=st.st_size >= zipfile.ZIP64_LIMIT
+            ) as dest:
+                while chunk := src.read(CHUNK_SIZE):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    yield sink.drain()
+
+
+def iter_tar_gz(root: str, rel_paths: Iterable[str]) -> Iterator[bytes]:
+    """Stream a gzip-compressed tar (PAX format) of ``rel_paths``.
+
+    Headers are written with ``TarInfo.tobuf`` and file bodies copied in
+    chunks, since ``tarfile`` itself buffers each member while adding it.
+    """
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for rel_path, abs_path, st in _regular_files(root, rel_paths):
+        try:
+            src = open(abs_path, "rb")
+        except OSError:
+            continue
+        with src:
+            info = tarfile.TarInfo(rel_path)
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = st.st_mode & 0o7777
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            yield gz.compress(header)
+
+            # Copy exactly the size in the header, even if the file changed
+            remaining = info.size
+            while remaining:
+                chunk = src.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    chunk = b"\0" * min(CHUNK_SIZE, remaining)
+                remaining -= len(chunk)
+                data = gz.compress(chunk)
+                if data:
+                    yield data
+            padding = -info.size % tarfile.BLOCKSIZE
+            if padding:
+                yield gz.compress(b"\0" * padding)
+    # End-of-archive marker: two zero blocks
+    yield gz.compress(b"\0" * (2 * tarfile.BLOCKSIZE))
+    yield gz.flush()
+
+
+class ArchiveError(ValueError):
+    """The upload is not a readable archive."""
+
+
+class QuotaExceeded(ArchiveError):
+    """The upload has more files or bytes than allowed."""
+
+
+# Skipped entries listed in an import result (the count is always exact)
+_MAX_SKIPPED_LISTED = 100
+
+
+def _unlink_quietly(name: str, dir_fd: int) -> None:
+    try:
+        os.unlink(name, dir_fd=dir_fd)
+    except OSError:
+        pass
+
+
+class Importer:
+    """Writes uploaded files below ``root/dest``, enforcing paths and quotas.
+
+    ``dest`` is a POSIX path relative to ``root``; it is created if missing
+    and refused (ArchiveError) if a symlink or file is in its way. Names are
+    POSIX paths relative to ``dest``. Names that would escape it (``..``,
+    absolute paths) are skipped, as are names with a symlink anywhere in
+    their path.
+    ``on_progress`` receives the running totals at most every
+    ``progress_interval`` seconds. ``on_file`` receives each written file's
+    stat from before (None if it is new) and after the import.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        dest: str,
+        max_files: int,
+        max_bytes: int,
+        overwrite: bool = True,
+        on_progress: Callable[[dict], None] | None = None,
+        progress_interval: float = 0.5,
+        on_file: Callable[[os.stat_result | None, os.stat_result], None] | None = None,
+    ):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self._dest_parts = [p for p in dest.split("/") if p not in ("", ".")]
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.overwrite = overwrite
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.on_file = on_file
+        self.files = 0
+        self.directories = 0
+        self.bytes = 0
+        self.skipped: list[str] = []
+        self.skipped_count = 0
+        self._last_progress = time.monotonic()
+        try:
+            os.close(self._open_dir([]))
+        except OSError as e:
+            raise ArchiveError(
+                f"Cannot write to {dest or '/'}: {e.strerror or 'not a directory'}"
+            )
+
+    def result(self) -> dict:
+        return {
+            "files": self.files,
+            "directories": self.directories,
+            "bytes": self.bytes,
+            "skipped": self.skipped,
+            "skipped_count": self.skipped_count,
+        }
+
+    def skip(self, name: str, reason: str) -> None:
+        self.skipped_count += 1
+        if len(self.skipped) < _MAX_SKIPPED_LISTED:
+            self.skipped.append(f"{name}: {reason}")
+
+    def _progress(self) -> None:
+        now = time.monotonic()
+        if self.on_progress and now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self.on_progress(self.result())
+
+    def _parts(self, name: str, strip_components: int = 0) -> list[str] | None:
+        """Path components of a member below ``dest``, or None if it escapes."""
+        parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+        if ".." in parts or any("\0" in p for p in parts):
+            return None
+        return parts[strip_components:]
+
+    def _open_dir(self, parts: list[str]) -> int:
+        """Open ``root/dest/parts`` as a directory fd, creating missing components.
+
+        Each component, those of ``dest`` included, is created and opened
+        relative to its parent without following symlinks, so a symlink in
+        the way (ELOOP) or a file (ENOTDIR) fails instead of leading outside
+        the destination.
+        """
+        fd = os.open(self.root, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for part in self._dest_parts + parts:
+                try:
+                    os.mkdir(part, 0o755, dir_fd=fd)
+                except FileExistsError:
+                    pass
+                child = os.open(
+                    part, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd
+                )
+                os.close(fd)
+                fd = child
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def _copy(self, src: BinaryIO, out: BinaryIO) -> None:
+        while chunk := src.read(CHUNK_SIZE):
+            self.bytes += len(chunk)
+            if self.bytes > self.max_bytes:
+                raise QuotaExceeded(f"Upload too large (max {self.max_bytes} bytes)")
+            out.write(chunk)
+
+    def add_directory(self, name: str, strip_components: int = 0) -> None:
+        parts = self._parts(name, strip_components)
+        if parts is None:
+            self.skip(name, "outside the destination")
+            return
+        if not parts:
+            return
+        try:
+            os.close(self._open_dir(parts))
+        except OSError as e:
+            self.skip(name, e.strerror or "cannot create directory")
+            return
+        self.directories += 1
+        self._progress()
+
+    def add_file(
+        self,
+        name: str,
+        src: BinaryIO,
+        size: int | None = None,
+        mode: int | None = None,
+        mtime: float | None = None,
+        strip_components: int = 0,
+    ) -> None:
+        """Copy ``src`` to ``name``. ``size`` is checked upfront when known.
+
+        An existing file is only replaced once the copy is complete; on any
+        error it is left untouched.
+        """
+        parts = self._parts(name, strip_components)
+        if parts is None:
+            self.skip(name, "outside the destination")
+            return
+        if not parts:
+            return
+        if self.files >= self.max_files:
+            raise QuotaExceeded(f"Too many files (max {self.max_files})")
+        if size is not None and self.bytes + size > self.max_bytes:
+            raise QuotaExceeded(f"Upload too large (max {self.max_bytes} bytes)")
+
+        try:
+            parent_fd = self._open_dir(parts[:-1])
+        except OSError as e:
+            self.skip(name, e.strerror or "cannot create directory")
+            return
+
+        perms = 0o755 if mode is not None and mode & 0o111 else 0o644
+        target = parts[-1]
+        try:
+            try:
+                old = os.stat(target, dir_fd=parent_fd, follow_symlinks=False)
+            except OSError:
+                old = None
+            if old is not None:
+                if not self.overwrite:
+                    self.skip(name, "already exists")
+                    return
+                if not stat_module.S_ISREG(old.st_mode):
+                    self.skip(name, "not a regular file")
+                    return
+            # Written under a temporary name and renamed into place, so an
+            # aborted copy never leaves a replaced file half-written
+            tmp = f".{target[:200]}.{uuid.uuid4().hex}.tmp"
+            try:
+                fd = os.open(
+                    tmp,
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                    perms,
+                    dir_fd=parent_fd,
+                )
+            except OSError as e:
+                self.skip(name, e.strerror or "cannot write")
+                return
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    self._copy(src, out)
+                    out.flush()
+                    os.fchmod(out.fileno(), perms)
+                    if mtime is not None:
+                        try:
+                            os.utime(out.fileno(), (mtime, mtime))
+                        except (OverflowError, OSError, ValueError):
+                            pass  # out-of-range archive timestamp: keep now
+                    new = os.fstat(out.fileno())
+            except BaseException:
+                _unlink_quietly(tmp, parent_fd)
+                raise
+            try:
+                if self.overwrite:
+                    os.rename(tmp, target, src_dir_fd=parent_fd, dst_dir_fd=parent_fd)
+                else:
+                    # link(2) fails if the name was taken in the meantime
+                    os.link(tmp, target, src_dir_fd=parent_fd, dst_dir_fd=parent_fd)
+                    os.unlink(tmp, dir_fd=parent_fd)
+            except OSError as e:
+                _unlink_quietly(tmp, parent_fd)
+                if isinstance(e, FileExistsError):
+                    self.skip(name, "already exists")
+                else:
+                    # EISDIR when a directory took the name...
+                    self.skip(name, e.strerror or "cannot write")
+                return
+        finally:
+            os.close(parent_fd)
+
+        if self.on_file:
+            self.on_file(old, new)
+        self.files += 1
+        self._progress()
+
+
+def extract_tar(
+    fileobj: BinaryIO, importer: Importer, strip_components: int = 0
+) -> None:
+    """Extract a (possibly compressed) tar stream member by member.
+
+    Only regular files and directories are extracted; links and special
+    files are skipped.
+    """
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+            for member in tf:
+                if member.isdir():
+                    importer.add_directory(member.name, strip_components)
+                elif member.isfile():
+                    importer.add_file(
+                        member.name,
+                        tf.extractfile(member),
+                        size=member.size,
+                        mode=member.mode,
+                        mtime=member.mtime,
+                        strip_components=strip_components,
+                    )
+                else:
+                    importer.skip(member.name, "not a regular file")
+    except (tarfile.TarError, EOFError, zlib.error) as e:
+        raise ArchiveError(f"Invalid tar archive: {e}")
+
+
+# Non-file fields accepted in a multipart upload, and bytes of headers
+# per part (python-multipart leaves both unbounded)
+_MAX_MULTIPART_FIELDS = 100
+_MAX_PART_HEADER_BYTES = 16 * 1024
+
+
+class _MultipartStream:
+    """Pull-style view of python-multipart's push parser.
+
+    The body is fed to the parser one chunk at a time, only when the
+    consumer needs more of the current part, so no more than one chunk of
+    it is held in memory.
+    """
+
+    def __init__(self, fileobj: BinaryIO, boundary: bytes):
+        self._src = fileobj
+        self._events: deque[tuple[str, object]] = deque()
+        self._eof = False
+        self._ended = False
+        self._in_part = False
+        self._header_bytes = 0
+        self._field = bytearray()
+        self._value = bytearray()
+        self._headers: dict[bytes, bytes] = {}
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_end": self._on_end,
+            },
+        )
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._header_bytes = 0
+
+    def _add_header(self, target: bytearray, data: bytes, start: int, end: int) -> None:
+        self._header_bytes += end - start
+        if self._header_bytes > _MAX_PART_HEADER_BYTES:
+            raise ArchiveError("Invalid multipart body: part headers too large")
+        target += data[start:end]
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._add_header(self._field, data, start, end)
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._add_header(self._value, data, start, end)
+
+    def _on_header_end(self) -> None:
+        self._headers[bytes(self._field).lower()] = bytes(self._value)
+        self._field.clear()
+        self._value.clear()
+
+    def _on_headers_finished(self) -> None:
+        self._events.append(("part", self._headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if end > start:
+            self._events.append(("data", bytes(data[start:end])))
+
+    def _on_part_end(self) -> None:
+        self._events.append(("end", None))
+
+    def _on_end(self) -> None:
+        self._ended = True
+
+    def _next(self) -> tuple[str, object] | None:
+        while not self._events:
+            if self._eof:
+                return None
+            chunk = self._src.read(CHUNK_SIZE)
+            if not chunk:
+                self._eof = True
+                if not self._ended:
+                    raise ArchiveError("Invalid multipart body: truncated")
+                continue
+            try:
+                self._parser.write(chunk)
+            except MultipartParseError as e:
+                raise ArchiveError(f"Invalid multipart body: {e}")
+        return self._events.popleft()
+
+    def read_data(self) -> bytes:
+        """Next data of the current part; empty once the part is over."""
+        if not self._in_part:
+            return b""
+        event = self._next()
+        if event is None:
+            raise ArchiveError("Invalid multipart body: truncated")
+        kind, value = event
+        if kind == "end":
+            self._in_part = False
+            return b""
+        return value
+
+    def parts(self) -> Iterator[dict[bytes, bytes]]:
+        """Headers of each part; read its content before the next one."""
+        while (event := self._next()) is not None:
+            kind, headers = event
+            if kind != "part":
+                continue
+            self._in_part = True
+            yield headers
+            while self.read_data():
+                pass  # whatever the consumer left unread
+
+
+class _PartReader(io.RawIOBase):
+    def __init__(self, stream: _MultipartStream):
+        self._stream = stream
+        self._buf = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buf:
+            data = self._stream.read_data()
+            if not data:
+                return 0
+            self._buf = memoryview(data)
+        n = min(len(buffer), len(self._buf))
+        buffer[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def extract_multipart(fileobj: BinaryIO, content_type: str, importer: Importer) -> None:
+    """Import each file part of a ``multipart/form-data`` stream as it arrives.
+
+    A file part's filename is its path. Other fields are read past.
+    """
+    mime, options = parse_options_header(content_type)
+    if mime != b"multipart/form-data" or not options.get(b"boundary"):
+        raise ArchiveError("Expected a multipart/form-data body with a boundary")
+    stream = _MultipartStream(fileobj, options[b"boundary"])
+    fields = 0
+    for headers in stream.parts():
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        filename = disposition.get(b"filename")
+        if filename is None:
+            fields += 1
+            if fields > _MAX_MULTIPART_FIELDS:
+                raise ArchiveError(f"Too many fields (max {_MAX_MULTIPART_FIELDS})")
+            continue
+        importer.add_file(filename.decode(errors="replace"), _PartReader(stream))
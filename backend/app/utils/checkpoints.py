@@ -0,0 +1,351 @@
+"""Read and roll back the workspace checkpoints the worker takes per task.
+
+The worker commits ``staging`` to ``{project}/.checkpoints.git`` before
+and after every task, under ``refs/remotifex/checkpoints/{task_id}/``.
+This module diffs those commits and restores a task's files. It uses its
+own index files, so it never contends with a running snapshot for the
+worker's index lock.
+
+Sessions of projects with ``isolated_sessions`` work in git worktrees of
+the same repository (``{project}/.sessions/{session_id}``, branch
+``sessions/{session_id}``); :func:`merge_session` merges one back into
+``staging``. Everything here except :func:`workspace_busy` is blocking and
+meant to run in a worker thread.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.config import settings
+from app.db.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+REF_PREFIX = "refs/remotifex/checkpoints"
+
+ACTIVE_TASK_STATUSES = ["queued", "running"]
+
+_STATUS = {"A": "added", "D": "deleted", "M": "modified", "T": "type_changed"}
+
+class CheckpointError(Exception):
+    """The checkpoint repository is missing or a git command failed."""
+
+
+async def workspace_busy(
+    db: AsyncIOMotorDatabase, project_id: str, session_id: str | None = None
+) -> bool:
+    """Whether a task is queued or running in ``staging``.
+
+    With ``session_id``, in that isolated session's worktree instead.
+    Tasks orphaned by a worker that died (see :func:`task_orphaned`) are
+    not counted; the worker's reconciler fails them.
+    """
+    query = {"project_id": project_id, "status": {"$in": ACTIVE_TASK_STATUSES}}
+    if session_id:
+        query.update(session_id=session_id, isolated=True)
+    else:
+        query["isolated"] = {"$ne": True}
+    async for task in db.tasks.find(query, {"status": 1, "worker_id": 1}):
+        if not await task_orphaned(task):
+            return True
+    return False
+
+
+async def task_orphaned(task: dict) -> bool:
+    """Whether a queued or running task's worker is gone.
+
+    Workers record themselves as ``worker_id`` when they take a task off
+    the queue and keep ``worker:{id}:alive`` set in Redis while they live.
+    A running task without an owner predates owner ids.
+    """
+    owner = task.get("worker_id")
+    if owner is None:
+        return task["status"] == "running"
+    return not await get_redis().exists(f"worker:{owner}:alive")
+
+
+def _git_dir(project_id: str) -> str:
+    return os.path.join(settings.projects_data_dir, project_id, ".checkpoints.git")
+
+
+def session_dir(project_id: str, session_id: str) -> str:
+    return os.path.join(settings.projects_data_dir, project_id, ".sessions", session_id)
+
+
+def _run(
+    project_id: str,
+    *args: str,
+    stdin: bytes | None = None,
+    session_id: str | None = None,
+) -> subprocess.CompletedProcess:
+    git_dir = _git_dir(project_id)
+    if not os.path.isdir(git_dir):
+        raise CheckpointError("No checkpoints exist for this project")
+    if session_id:
+        work_tree = session_dir(project_id, session_id)
+        index = f"index-api-{session_id}"
+    else:
+        work_tree = os.path.join(settings.projects_data_dir, project_id, "staging")
+        index = "index-api"
+    if not os.path.isdir(work_tree):
+        raise CheckpointError("The workspace does not exist")
+    env = {
+        **os.environ,
+        "GIT_DIR": git_dir,
+        "GIT_WORK_TREE": work_tree,
+        "GIT_INDEX_FILE": os.path.join(git_dir, index),
+        "GIT_LITERAL_PATHSPECS": "1",
+        "GIT_AUTHOR_NAME": "Remotifex",
+        "GIT_AUTHOR_EMAIL": "checkpoints@remotifex.local",
+        "GIT_COMMITTER_NAME": "Remotifex",
+        "GIT_COMMITTER_EMAIL": "checkpoints@remotifex.local",
+        "GIT_TERMINAL_PROMPT": "0",
+    }
+    return subprocess.run(
+        ["git", "-c", "advice.addEmbeddedRepo=false", "-c", "core.autocrlf=false"]
+        + list(args),
+        input=stdin,
+        capture_output=True,
+        cwd=work_tree,
+        env=env,
+    )
+
+
+def _git(
+    project_id: str,
+    *args: str,
+    stdin: bytes | None = None,
+    session_id: str | None = None,
+) -> bytes:
+    result = _run(project_id, *args, stdin=stdin, session_id=session_id)
+    if result.returncode != 0:
+        raise CheckpointError(
+            f"git {args[0]} failed: {result.stderr.decode(errors='replace').strip()}"
+        )
+    return result.stdout
+
+
+def _rev(project_id: str, ref: str) -> str | None:
+    try:
+        out = _git(project_id, "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}")
+    except CheckpointError:
+        return None
+    return out.decode().strip() or None
+
+
+def resolve(project_id: str, task_id: str, label: str) -> str | None:
+    """Commit id of a task's ``before``/``after`` checkpoint, if it exists."""
+    return _rev(project_id, f"{REF_PREFIX}/{task_id}/{label}")
+
+
+def snapshot_workspace(project_id: str, session_id: str | None = None) -> str:
+    """Tree id of the current ``staging`` (or session worktree) contents."""
+    result = _run(project_id, "add", "--all", "--ignore-errors", session_id=session_id)
+    # 1: some paths (a nested repository without commits, an unreadable
+    # file) were skipped and everything else was added
+    if result.returncode not in (0, 1):
+        raise CheckpointError(
+            f"git add failed: {result.stderr.decode(errors='replace').strip()}"
+        )
+    if result.returncode == 1:
+        logger.warning(
+            "Snapshot of project %s skipped paths: %s",
+            project_id,
+            result.stderr.decode(errors="replace").strip(),
+        )
+    return _git(project_id, "write-tree", session_id=session_id).decode().strip()
+
+
+def _restore(
+    project_id: str, source: str, paths: list[str], session_id: str | None = None
+) -> None:
+    """Make ``paths`` match ``source`` in the workspace.
+
+    The index must describe the workspace (see :func:`snapshot_workspace`).
+    Restoring is no-overlay: a path missing from ``source`` is deleted.
+    """
+    if not paths:
+        return
+    _git(
+        project_id,
+        "restore",
+        f"--source={source}",
+        "--staged",
+        "--worktree",
+        "--pathspec-from-file=-",
+        "--pathspec-file-nul",
+        stdin=b"\0".join(p[1:].encode(errors="surrogateescape") for p in paths),
+        session_id=session_id,
+    )
+
+
+def changes(project_id: str, base: str, target: str) -> list[dict]:
+    """Files that differ between two commits or trees, sorted by path."""
+    out = _git(
+        project_id,
+        "diff-tree",
+        "-r",
+        "-z",
+        "--no-renames",
+        "--name-status",
+        base,
+        target,
+    )
+    fields = out.split(b"\0")
+    files = []
+    for status, path in zip(fields[0::2], fields[1::2]):
+        if not path:
+            continue
+        files.append(
+            {
+                "path": "/" + path.decode(errors="surrogateescape"),
+                "status": _STATUS.get(status.decode()[:1], "modified"),
+            }
+        )
+    files.sort(key=lambda f: f["path"])
+    return files
+
+
+def diff(
+    project_id: str, base: str, target: str, path: str | None, context: int
+) -> str:
+    """Unified diff between two commits or trees, optionally for one path."""
+    args = ["diff", "--no-color", "--no-ext-diff", f"-U{context}", base, target]
+    if path:
+        args += ["--", path.lstrip("/")]
+    return _git(project_id, *args).decode(errors="replace")
+
+
+def rollback(
+    project_id: str, task_id: str, force: bool = False, session_id: str | None = None
+) -> dict:
+    """Restore the files a task changed to their state before it ran.
+
+    Files the task did not touch are left alone. A file changed again
+    since the task finished is a conflict: nothing is restored unless
+    ``force`` is set. The workspace as it was just before the rollback is
+    kept as the task's ``pre-rollback`` checkpoint. Tasks of isolated
+    sessions are rolled back in the session's worktree.
+
+    Returns ``{"restored": [...], "conflicts": [...]}``; raises
+    CheckpointError when the task has no complete checkpoint.
+    """
+    before = resolve(project_id, task_id, "before")
+    after = resolve(project_id, task_id, "after")
+    if before is None or after is None:
+        raise CheckpointError("This task has no checkpoint to roll back to")
+
+    touched = changes(project_id, before, after)
+    current = snapshot_workspace(project_id, session_id)
+    changed_since = {
+        f["path"]: f["status"] for f in changes(project_id, after, current)
+    }
+    conflicts = [f["path"] for f in touched if f["path"] in changed_since]
+    if conflicts and not force:
+        return {"restored": [], "conflicts": conflicts}
+
+    # Added by the task and deleted since: already gone, and unknown to git
+    restore = [
+        f["path"]
+        for f in touched
+        if not (f["status"] == "added" and changed_since.get(f["path"]) == "deleted")
+    ]
+    if restore:
+        commit = _git(
+            project_id,
+            "commit-tree",
+            current,
+            "-p",
+            after,
+            "-m",
+            f"Task {task_id} (pre-rollback)",
+        ).decode().strip()
+        _git(project_id, "update-ref", f"{REF_PREFIX}/{task_id}/pre-rollback", commit)
+        _restore(project_id, before, restore, session_id)
+    return {"restored": restore, "conflicts": conflicts}
+
+
+def merge_session(project_id: str, session_id: str) -> dict:
+    """Three-way merge an isolated session's work into ``staging``.
+
+    The merge is computed entirely in the object store; ``staging`` is only
+    written when it is clean, and then only the files the merge changes.
+    The merge base is the staging snapshot the session started from, or its
+    last merge, so merging again carries over only newer work.
+
+    Returns ``{"merged", "files", "conflicts"}``; on conflicts nothing is
+    written and ``merged`` is False.
+    """
+    base_ref = f"refs/remotifex/sessions/{session_id}/base"
+    base = _rev(project_id, base_ref)
+    head = _rev(project_id, f"refs/heads/sessions/{session_id}")
+    if base is None or head is None:
+        raise CheckpointError("This session has no worktree")
+
+    staging_tree = snapshot_workspace(project_id)
+    staging = _git(
+        project_id,
+        "commit-tree",
+        staging_tree,
+        "-p",
+        base,
+        "-m",
+        f"Staging before merging session {session_id}",
+    ).decode().strip()
+
+    result = _run(
+        project_id,
+        "merge-tree",
+        "--write-tree",
+        "--name-only",
+        "-z",
+        "--no-messages",
+        staging,
+        head,
+    )
+    if result.returncode not in (0, 1):
+        raise CheckpointError(
+            f"git merge-tree failed: {result.stderr.decode(errors='replace').strip()}"
+        )
+    merged_tree, *conflicted = [f for f in result.stdout.split(b"\0") if f]
+    if result.returncode == 1:
+        conflicts = sorted(
+            {"/" + f.decode(errors="surrogateescape") for f in conflicted}
+        )
+        return {"merged": False, "files": [], "conflicts": conflicts}
+
+    merged_tree = merged_tree.decode()
+    files = changes(project_id, staging_tree, merged_tree)
+    _restore(project_id, merged_tree, [f["path"] for f in files])
+    merge = _git(
+        project_id,
+        "commit-tree",
+        merged_tree,
+        "-p",
+        staging,
+        "-p",
+        head,
+        "-m",
+        f"Merge session {session_id}",
+    ).decode().strip()
+    _git(project_id, "update-ref", base_ref, merge)
+    return {"merged": True, "files": files, "conflicts": []}
+
+
+def discard_session(project_id: str, session_id: str) -> None:
+    """Delete an isolated session's worktree, branch and merge base."""
+    if not os.path.isdir(_git_dir(project_id)):
+        return
+    path = session_dir(project_id, session_id)
+    _run(project_id, "worktree", "remove", "--force", path)
+    shutil.rmtree(path, ignore_errors=True)
+    _run(project_id, "worktree", "prune")
+    for ref in (
+        f"refs/heads/sessions/{session_id}",
+        f"refs/remotifex/sessions/{session_id}/base",
+    ):
+        _run(project_id, "update-ref", "-d", ref)
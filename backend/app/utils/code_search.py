@@ -0,0 +1,256 @@
+"""Parallel text search across a project workspace.
+
+Files are enumerated with the gitignore-aware walker and scanned on a
+shared thread pool with a bounded number of files in flight, so memory
+stays flat on large trees and the scan stops as soon as enough matches
+have been found. Everything here is blocking and meant to run in a worker
+thread (the pool threads do the actual file I/O and matching).
+
+Queries are compiled with the ``regex`` module, which matches without
+holding the GIL and gives up on a file after ``search_regex_timeout``
+seconds, so a pathological pattern can neither stall the event loop nor
+occupy the pool indefinitely.
+"""
+
+import fnmatch
+import os
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import regex
+
+from app.config import settings
+from app.utils.fs import iter_files
+from app.utils.gitignore import DEFAULT_EXCLUDES
+
+# Files larger than this, or containing NUL bytes near the start, are skipped
+MAX_SEARCH_FILE_SIZE = 2 * 1024 * 1024
+_BINARY_SNIFF_BYTES = 8192
+# Longest line text returned with a match
+_MAX_LINE_LENGTH = 500
+# Longest accepted query
+MAX_QUERY_LENGTH = 1000
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.search_workers, thread_name_prefix="search"
+)
+
+
+def _has_nested_quantifier(pattern: str) -> bool:
+    """Whether a group containing a quantifier is itself repeated, as in ``(a+)+``.
+
+    Such patterns can take exponential time to fail. ``?`` and ``{0,1}``
+    do not repeat and are allowed on either level.
+    """
+    stack = [False]  # per open group: does it contain a repeat?
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "[":
+            # Skip the character class; "]" right after "[" or "[^" is literal
+            i += 1
+            if i < len(pattern) and pattern[i] == "^":
+                i += 1
+            if i < len(pattern) and pattern[i] == "]":
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            continue
+        if ch == "(":
+            stack.append(False)
+            i += 1
+            continue
+        repeat = _repeat_at(pattern, i)
+        if ch == ")" and len(stack) > 1:
+            inner = stack.pop()
+            if inner and _repeat_at(pattern, i + 1):
+                return True
+            stack[-1] = stack[-1] or inner
+        elif repeat:
+            stack[-1] = True
+        i += 1
+    return False
+
+
+def _repeat_at(pattern: str, i: int) -> bool:
+    """Whether a quantifier allowing more than one repetition starts at ``i``."""
+    if i >= len(pattern):
+        return False
+    if pattern[i] in "*+":
+        return True
+    if pattern[i] == "{":
+        end = pattern.find("}", i)
+        bounds = pattern[i + 1 : end].split(",") if end != -1 else []
+        if not bounds or not all(b.strip().isdigit() or not b.strip() for b in bounds):
+            return False  # a literal "{"
+        upper = bounds[-1].strip()
+        return not upper or int(upper) > 1
+    return False
+
+
+def compile_query(query: str, is_regex: bool, case_sensitive: bool) -> regex.Pattern:
+    """Compile a literal or regex query.
+
+    Raises ValueError for overlong queries, regexes with nested
+    quantifiers and invalid patterns.
+    """
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Query too long (max {MAX_QUERY_LENGTH} characters)")
+    if is_regex and _has_nested_quantifier(query):
+        raise ValueError("Nested quantifiers such as (a+)+ are not supported")
+    flags = regex.MULTILINE if case_sensitive else regex.MULTILINE | regex.IGNORECASE
+    try:
+        return regex.compile(query if is_regex else regex.escape(query), flags)
+    except regex.error as e:
+        raise ValueError(f"Invalid regex: {e}")
+
+
+def _glob_match(rel_path: str, patterns: list[str]) -> bool:
+    name = rel_path.rsplit("/", 1)[-1]
+    return any(
+        fnmatch.fnmatchcase(rel_path, p) or fnmatch.fnmatchcase(name, p)
+        for p in patterns
+    )
+
+
+def _clip(line: str) -> str:
+    return line.rstrip("\r")[:_MAX_LINE_LENGTH]
+
+
+def _search_file(
+    root: str,
+    rel_path: str,
+    pattern: regex.Pattern,
+    context: int,
+    limit: int,
+) -> tuple[list[dict], bool]:
+    """Return up to ``limit`` matches in one file, and whether it timed out.
+
+    A file the pattern cannot finish within ``search_regex_timeout``
+    seconds keeps the matches found until then.
+    """
+    try:
+        with open(os.path.join(root, rel_path), "rb") as f:
+            data = f.read(MAX_SEARCH_FILE_SIZE + 1)
+    except OSError:
+        return [], False
+    if len(data) > MAX_SEARCH_FILE_SIZE or b"\0" in data[:_BINARY_SNIFF_BYTES]:
+        return [], False
+
+    text = data.decode("utf-8", errors="replace")
+    timeout = settings.search_regex_timeout
+    # Fast path: most files do not match at all
+    try:
+        first = pattern.search(text, concurrent=True, timeout=timeout)
+    except TimeoutError:
+        return [], True
+    if first is None:
+        return [], False
+
+    lines = text.split("\n")
+    # Offsets of line starts, only computed for files that match
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line) + 1)
+
+    results = []
+    last_line = -1
+    matches = pattern.finditer(text, first.start(), concurrent=True, timeout=timeout)
+    try:
+        for m in matches:
+            index = bisect_right(starts, m.start()) - 1
+            if index == last_line:
+                continue  # one result per line
+            last_line = index
+            results.append(
+                {
+                    "type": "match",
+                    "path": "/" + rel_path,
+                    "line": index + 1,
+                    "column": m.start() - starts[index] + 1,
+                    "text": _clip(lines[index]),
+                    "before": [
+                        _clip(x) for x in lines[max(0, index - context) : index]
+                    ],
+                    "after": [
+                        _clip(x) for x in lines[index + 1 : index + 1 + context]
+                    ],
+                }
+            )
+            if len(results) >= limit:
+                break
+    except TimeoutError:
+        return results, True
+    return results, False
+
+
+def search(
+    root: str,
+    start: str,
+    pattern: regex.Pattern,
+    include: list[str],
+    exclude: list[str],
+    use_gitignore: bool = True,
+    exclude_defaults: bool = True,
+    context: int = 2,
+    max_results: int = 1000,
+) -> Iterator[dict]:
+    """Yield match records, then a final ``{"type": "summary"}`` record."""
+    excludes = DEFAULT_EXCLUDES if exclude_defaults else frozenset({".git"})
+    files = iter_files(root, start, use_gitignore, excludes)
+
+    in_flight: deque[Future] = deque()
+    window = settings.search_workers * 4
+    found = 0
+    searched = 0
+    timed_out = 0
+    truncated = False
+
+    def submit_next() -> bool:
+        for rel_path in files:
+            if include and not _glob_match(rel_path, include):
+                continue
+            if exclude and _glob_match(rel_path, exclude):
+                continue
+            in_flight.append(
+                _executor.submit(
+                    _search_file, root, rel_path, pattern, context, max_results
+                )
+            )
+            return True
+        return False
+
+    try:
+        while len(in_flight) < window and submit_next():
+            pass
+
+        # Results are consumed in submission order, so output is deterministic
+        while in_flight:
+            matches, timeout = in_flight.popleft().result()
+            searched += 1
+            timed_out += timeout
+            for match in matches[: max_results - found]:
+                found += 1
+                yield match
+            if found >= max_results:
+                # Stop early; there may be more matches we did not look for
+                truncated = True
+                break
+            submit_next()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+    yield {
+        "type": "summary",
+        "matches": found,
+        "files_searched": searched,
+        "files_timed_out": timed_out,
+        "truncated": truncated,
+    }
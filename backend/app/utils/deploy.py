@@ -0,0 +1,310 @@
+"""Content-addressed deploy snapshots and atomic ``prod`` switching.
+
+Layout under a project directory::
+
+    .deploys/objects/ab/cdef...       file contents, named by SHA-256
+    .deploys/manifests/v{N}.json      path -> [object, size] per version
+                                      (symlinks: path -> [null, 0, target])
+    .deploys/releases/v{N}/...        tree of hardlinks into objects/
+    prod -> .deploys/releases/v{N}    symlink, swapped with rename(2)
+
+Each unique file content is stored once (copied with ``copy_file_range``,
+which reflinks on filesystems that support it); releases are hardlink
+trees, so a deploy costs only the bytes that changed plus directory
+entries. Symlinks are never followed: one that resolves inside staging
+is recreated as a relative link within the release, any other is left
+out, so a deploy can only publish content that lives in staging. Objects
+are read-only, and an object whose link count drops to one is referenced
+by no release and can be collected. Releases are never deleted, so any
+version can be activated again with a single symlink swap. Everything
+here is blocking and meant to run in a worker thread.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat as stat_module
+import time
+import uuid
+
+from app.config import settings
+from app.utils.fs import atomic_write, file_digest, iter_files
+
+# Never deployed, whatever the ignore settings
+_ALWAYS_EXCLUDED = frozenset({".git"})
+
+
+def project_dir(project_id: str) -> str:
+    return os.path.join(settings.projects_data_dir, project_id)
+
+
+def _store(project_id: str, *parts: str) -> str:
+    return os.path.join(project_dir(project_id), ".deploys", *parts)
+
+
+def release_dir(project_id: str, version: int) -> str:
+    return _store(project_id, "releases", f"v{version}")
+
+
+def _manifest_path(project_id: str, version: int) -> str:
+    return _store(project_id, "manifests", f"v{version}.json")
+
+
+def _object_path(project_id: str, key: str) -> str:
+    return _store(project_id, "objects", key[:2], key[2:])
+
+
+def _copy(src, dst) -> None:
+    """Copy between open files, letting the kernel share extents if it can."""
+    try:
+        while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+            pass
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            raise
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _add_object(project_id: str, path: str, executable: bool) -> tuple[str, int]:
+    """Copy a file into the object store. Returns ``(key, new_bytes)``.
+
+    The key is computed from the copied bytes, so a file changing during
+    the deploy can never be stored under another content's name.
+    """
+    tmp_dir = _store(project_id, "objects", "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp = os.path.join(tmp_dir, uuid.uuid4().hex)
+    # O_NOFOLLOW: the entry was lstat'ed as a regular file; never read
+    # through a symlink swapped in since
+    fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    with open(fd, "rb") as src, open(tmp, "w+b") as dst:
+        if not stat_module.S_ISREG(os.fstat(src.fileno()).st_mode):
+            raise OSError(errno.EINVAL, "Not a regular file", path)
+        _copy(src, dst)
+        dst.seek(0)
+        h = hashlib.sha256()
+        while chunk := dst.read(1024 * 1024):
+            h.update(chunk)
+        size = dst.tell()
+    key = h.hexdigest() + (".x" if executable else "")
+
+    target = _object_path(project_id, key)
+    if os.path.exists(target):
+        os.unlink(tmp)
+        return key, 0
+    os.chmod(tmp, 0o555 if executable else 0o444)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp, target)
+    return key, size
+
+
+def _link(project_id: str, key: str, target: str) -> None:
+    source = _object_path(project_id, key)
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno != errno.EMLINK:
+            raise
+        # Per-inode link limit reached (many identical small files): copy
+        shutil.copy2(source, target)
+
+
+def _link_target(staging: str, rel_path: str) -> str | None:
+    """Relative target for a symlink that resolves inside ``staging``.
+
+    ``staging`` must be a real path. The link is rewritten against the
+    resolved location so that, inside a release, it can only reach the
+    release's own (deployed) files. Returns None for links leading
+    anywhere else, broken links included.
+    """
+    resolved = os.path.realpath(os.path.join(staging, rel_path))
+    if resolved == staging or os.path.commonpath([resolved, staging]) != staging:
+        return None
+    if not os.path.lexists(resolved):
+        return None
+    parent = os.path.join(staging, os.path.dirname(rel_path))
+    return os.path.relpath(resolved, parent)
+
+
+def build_release(project_id: str, version: int, use_gitignore: bool = False) -> dict:
+    """Snapshot ``staging`` as release ``version``.
+
+    Returns ``{"file_count", "total_bytes", "new_bytes", "manifest_digest"}``.
+    Raises FileNotFoundError if there is no staging directory.
+    """
+    staging = os.path.join(project_dir(project_id), "staging")
+    if os.path.islink(staging) or not os.path.isdir(staging):
+        raise FileNotFoundError(staging)
+    staging = os.path.realpath(staging)
+
+    final = release_dir(project_id, version)
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    manifest: dict[str, list] = {}
+    total_bytes = 0
+    new_bytes = 0
+    files = iter_files(
+        staging, "", use_gitignore, _ALWAYS_EXCLUDED, follow_symlinks=False
+    )
+    for rel_path in files:
+        path = os.path.join(staging, rel_path)
+        target = os.path.join(tmp, rel_path)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if stat_module.S_ISLNK(st.st_mode):
+            link = _link_target(staging, rel_path)
+            if link is not None:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.symlink(link, target)
+                manifest[rel_path] = [None, 0, link]
+            continue
+        if not stat_module.S_ISREG(st.st_mode):
+            continue
+        executable = bool(st.st_mode & 0o111)
+        digest = file_digest(path)
+        if digest is None:
+            continue
+        key = digest + (".x" if executable else "")
+        if not os.path.exists(_object_path(project_id, key)):
+            try:
+                key, added = _add_object(project_id, path, executable)
+            except OSError:
+                continue  # replaced or removed since it was listed
+            new_bytes += added
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _link(project_id, key, target)
+        manifest[rel_path] = [key, st.st_size]
+        total_bytes += st.st_size
+
+    data = json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode()
+    os.makedirs(os.path.dirname(_manifest_path(project_id, version)), exist_ok=True)
+    atomic_write(_manifest_path(project_id, version), data)
+    shutil.rmtree(final, ignore_errors=True)
+    os.rename(tmp, final)
+
+    return {
+        "file_count": len(manifest),
+        "total_bytes": total_bytes,
+        "new_bytes": new_bytes,
+        "manifest_digest": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def read_manifest(project_id: str, version: int) -> dict[str, list]:
+    with open(_manifest_path(project_id, version), "rb") as f:
+        return json.load(f)
+
+
+def active_version(project_id: str) -> int | None:
+    """Version ``prod`` currently points to, if it is a release symlink."""
+    try:
+        target = os.readlink(os.path.join(project_dir(project_id), "prod"))
+    except OSError:
+        return None
+    name = os.path.basename(target.rstrip("/"))
+    if name.startswith("v") and name[1:].isdigit():
+        return int(name[1:])
+    return None
+
+
+def activate(project_id: str, version: int) -> None:
+    """Point ``prod`` at release ``version`` with a single atomic rename.
+
+    A non-empty ``prod`` directory (from before deploys existed) is moved
+    to ``.deploys/legacy-prod-<timestamp>`` first.
+    Raises FileNotFoundError if the release does not exist.
+    """
+    base = project_dir(project_id)
+    release = release_dir(project_id, version)
+    if not os.path.isdir(release):
+        raise FileNotFoundError(release)
+
+    prod = os.path.join(base, "prod")
+    if os.path.isdir(prod) and not os.path.islink(prod):
+        try:
+            os.rmdir(prod)  # the empty directory created with the project
+        except OSError:
+            os.rename(prod, _store(project_id, f"legacy-prod-{int(time.time())}"))
+
+    tmp = os.path.join(base, f".prod-{uuid.uuid4().hex}")
+    os.symlink(os.path.relpath(release, base), tmp)
+    try:
+        os.replace(tmp, prod)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def restore_release(project_id: str, version: int) -> None:
+    """Recreate the tree of release ``version`` from its manifest if it is gone.
+
+    Releases removed by earlier versions of the pruning are rebuilt from
+    the object store. Raises FileNotFoundError if the manifest or any of
+    its objects no longer exists.
+    """
+    final = release_dir(project_id, version)
+    if os.path.isdir(final):
+        return
+    manifest = read_manifest(project_id, version)
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        for rel_path, entry in manifest.items():
+            target = os.path.join(tmp, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if entry[0] is None:
+                os.symlink(entry[2], target)
+            else:
+                _link(project_id, entry[0], target)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    os.rename(tmp, final)
+
+
+def prune(project_id: str) -> int:
+    """Remove half-built ``v{N}.tmp`` trees left by interrupted deploys.
+
+    Complete releases are always kept: they are hardlink trees costing
+    only directory entries, and keeping them makes activating any version
+    a symlink swap. Objects no release links to any more are collected,
+    but the object store is only scanned if a tree was removed. Callers
+    must hold the project's deploy lock. Returns the bytes freed.
+    """
+    releases = _store(project_id, "releases")
+    try:
+        names = os.listdir(releases)
+    except FileNotFoundError:
+        return 0
+    removed = False
+    for name in names:
+        if name.startswith("v") and name.endswith(".tmp") and name[1:-4].isdigit():
+            shutil.rmtree(os.path.join(releases, name), ignore_errors=True)
+            removed = True
+    if not removed:
+        return 0
+
+    freed = 0
+    objects = _store(project_id, "objects")
+    for prefix in os.listdir(objects) if os.path.isdir(objects) else ():
+        if prefix == "tmp":
+            continue
+        prefix_dir = os.path.join(objects, prefix)
+        for name in os.listdir(prefix_dir):
+            path = os.path.join(prefix_dir, name)
+            st = os.stat(path)
+            if st.st_nlink == 1:
+                freed += st.st_size
+                os.unlink(path)
+    return freed
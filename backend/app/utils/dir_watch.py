@@ -0,0 +1,95 @@
+"""Shared filesystem watchers, one per environment root.
+
+Both the file index (to know which directories to rescan) and the live
+``files_changed`` events (to tell clients what changed) follow changes in
+the same environment roots. Instead of each running its own recursive
+inotify watch, they register a callback here and a single ``watchfiles``
+watch per root feeds every consumer. The watch stops with its last
+consumer; when it fails (missing directory, inotify watch limit) it is
+retried while consumers remain.
+"""
+
+import asyncio
+import logging
+import os
+from collections.abc import Callable
+from contextlib import suppress
+
+from watchfiles import Change, awatch
+
+logger = logging.getLogger(__name__)
+
+RETRY_INTERVAL = 10  # seconds between attempts after a watch fails
+
+Callback = Callable[[set[tuple[Change, str]]], None]
+
+
+class _Watch:
+    def __init__(self, root: str):
+        self.root = root
+        self.callbacks: list[Callback] = []
+        self.active = False
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            self.active = True
+            try:
+                async for changes in awatch(self.root, debounce=50, step=20):
+                    for callback in list(self.callbacks):
+                        callback(changes)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # watchfiles can turn a cancellation into another exception
+                if asyncio.current_task().cancelling():
+                    raise asyncio.CancelledError from e
+                logger.warning("File watcher for %s failed: %s", self.root, e)
+            finally:
+                self.active = False
+            await asyncio.sleep(RETRY_INTERVAL)
+
+
+_watches: dict[str, _Watch] = {}
+
+
+def subscribe(root: str, callback: Callback) -> None:
+    """Call ``callback`` with each batch of changes below ``root``.
+
+    Callbacks run on the event loop and must not block.
+    """
+    root = os.path.normpath(root)
+    watch = _watches.get(root)
+    if watch is None:
+        watch = _watches[root] = _Watch(root)
+    watch.callbacks.append(callback)
+
+
+def unsubscribe(root: str, callback: Callback) -> None:
+    """Remove a callback; the watch stops when none are left."""
+    root = os.path.normpath(root)
+    watch = _watches.get(root)
+    if watch is None:
+        return
+    with suppress(ValueError):
+        watch.callbacks.remove(callback)
+    if not watch.callbacks:
+        del _watches[root]
+        watch.task.cancel()
+
+
+def watching(root: str) -> bool:
+    """Whether changes below ``root`` are currently being reported."""
+    watch = _watches.get(os.path.normpath(root))
+    return watch is not None and watch.active
+
+
+async def close() -> None:
+    """Stop every watch (at shutdown)."""
+    watches = list(_watches.values())
+    _watches.clear()
+    for watch in watches:
+        watch.task.cancel()
+    for watch in watches:
+        with suppress(asyncio.CancelledError):
+            await watch.task
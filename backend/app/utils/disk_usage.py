@@ -0,0 +1,284 @@
+"""Per-project disk usage accounting and quotas.
+
+Usage is kept on the project document (``stats.disk_usage_bytes``, plus a
+per-directory breakdown under ``disk_usage``) and moves three ways:
+
+* API writes apply their size difference at once (:func:`add`);
+* finished worker tasks and API imports mark the project dirty, and the
+  scanner re-measures dirty projects within seconds;
+* a low-priority pass re-measures every project periodically.
+
+Measuring is incremental. A directory whose mtime has not changed reuses
+the cached size of the files directly in it, so a rescan costs one stat
+per directory rather than one per file. Editing a file in place does not
+touch its directory's mtime, so every ``disk_usage_full_scan_every``-th
+measurement of a project ignores the cache and corrects any drift.
+
+Sizes are allocated blocks, as ``du`` reports them; a file with several
+hard links (deploy releases) is shared between its links.
+"""
+
+import asyncio
+import logging
+import os
+import stat as stat_module
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import invalidate_project
+
+logger = logging.getLogger(__name__)
+
+DIRTY_KEY = "disk_usage:dirty"  # set of project ids; the worker adds to it too
+_LOCK_KEY = "disk_usage:scanner"
+_LOCK_TTL = 60
+
+# Seconds between checks of the dirty set
+_DIRTY_POLL = 5
+
+# Pause between projects during the periodic pass (keeps it low priority)
+_PASS_DELAY = 0.2
+
+# Cached directories across all projects before least recently measured
+# projects are forgotten
+_MAX_CACHED_DIRS = 500_000
+
+# project_id -> {dir path: (mtime_ns, bytes of files directly in it, subdirs)}
+_caches: OrderedDict[str, dict[str, tuple[int, int, tuple[str, ...]]]] = OrderedDict()
+_measure_count: dict[str, int] = {}
+# Guards both: the scanner and on-demand rescans measure in threadpool threads
+_cache_lock = threading.Lock()
+
+
+def _allocated(st: os.stat_result) -> int:
+    size = st.st_blocks * 512
+    if not stat_module.S_ISDIR(st.st_mode) and st.st_nlink > 1:
+        size //= st.st_nlink
+    return size
+
+
+def _measure_tree(root: str, cache: dict, new_cache: dict, full: bool) -> int:
+    total = 0
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except OSError:
+            continue
+        if not stat_module.S_ISDIR(st.st_mode):
+            total += _allocated(st)
+            continue
+
+        cached = None if full else cache.get(path)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            files_bytes, subdirs = cached[1], cached[2]
+        else:
+            files_bytes = 0
+            names = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                names.append(entry.name)
+                            else:
+                                files_bytes += _allocated(
+                                    entry.stat(follow_symlinks=False)
+                                )
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            subdirs = tuple(names)
+        new_cache[path] = (st.st_mtime_ns, files_bytes, subdirs)
+        total += _allocated(st) + files_bytes
+        stack.extend(os.path.join(path, name) for name in subdirs)
+    return total
+
+
+def measure(project_id: str) -> dict[str, int]:
+    """Bytes used under each top-level entry of the project directory."""
+    project_dir = os.path.join(settings.projects_data_dir, project_id)
+    with _cache_lock:
+        count = _measure_count.get(project_id, 0)
+        cache = _caches.pop(project_id, {})
+    full = count % max(settings.disk_usage_full_scan_every, 1) == 0
+    new_cache: dict = {}
+    breakdown = {}
+    try:
+        names = os.listdir(project_dir)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        breakdown[name] = _measure_tree(
+            os.path.join(project_dir, name), cache, new_cache, full
+        )
+
+    with _cache_lock:
+        _caches[project_id] = new_cache
+        _measure_count[project_id] = count + 1
+        cached_dirs = sum(len(c) for c in _caches.values())
+        while cached_dirs > _MAX_CACHED_DIRS and len(_caches) > 1:
+            forgotten, dropped = _caches.popitem(last=False)
+            _measure_count.pop(forgotten, None)
+            cached_dirs -= len(dropped)
+    return breakdown
+
+
+def forget(project_id: str) -> None:
+    """Drop the cached directory sizes of a (deleted) project."""
+    with _cache_lock:
+        _caches.pop(project_id, None)
+        _measure_count.pop(project_id, None)
+
+
+async def rescan(project_id: str) -> int:
+    """Re-measure a project and store the result; returns the total."""
+    breakdown = await run_in_threadpool(measure, project_id)
+    total = sum(breakdown.values())
+    await get_db().projects.update_one(
+        {"_id": ObjectId(project_id), "status": {"$ne": "deleting"}},
+        {
+            "$set": {
+                "stats.disk_usage_bytes": total,
+                "disk_usage": {
+                    "breakdown": breakdown,
+                    "scanned_at": datetime.now(timezone.utc),
+                },
+            }
+        },
+    )
+    await invalidate_project(project_id)
+    return total
+
+
+async def add(db: AsyncIOMotorDatabase, project_id: str, delta: int) -> None:
+    """Apply a size change made through the API (until the next rescan)."""
+    if not delta:
+        return
+    # Nothing to adjust before the first measurement
+    result = await db.projects.update_one(
+        {"_id": ObjectId(project_id), "stats.disk_usage_bytes": {"$type": "number"}},
+        {"$inc": {"stats.disk_usage_bytes": delta}},
+    )
+    if result.modified_count:
+        await invalidate_project(project_id)
+
+
+async def mark_dirty(project_id: str) -> None:
+    """Have the scanner re-measure a project soon."""
+    try:
+        await get_redis().sadd(DIRTY_KEY, project_id)
+    except Exception:
+        logger.warning("Could not mark disk usage of project %s dirty", project_id)
+
+
+def _limits() -> tuple[int | None, int | None]:
+    mb = 1024 * 1024
+    soft = settings.project_quota_soft_mb * mb or None
+    hard = settings.project_quota_hard_mb * mb or None
+    return soft, hard
+
+
+def quota(usage: int | None) -> dict:
+    """Limits and state (``ok``, ``soft`` or ``hard``) for a usage figure."""
+    soft, hard = _limits()
+    state = "ok"
+    if usage is not None:
+        if hard is not None and usage >= hard:
+            state = "hard"
+        elif soft is not None and usage >= soft:
+            state = "soft"
+    return {"soft_limit_bytes": soft, "hard_limit_bytes": hard, "state": state}
+
+
+async def enforce_quota(
+    db: AsyncIOMotorDatabase, project_id: str, incoming: int = 0
+) -> dict:
+    """Refuse (507) work that would take a project past its hard quota.
+
+    Returns ``{"state", "headroom_bytes"}``: ``state`` is ``soft`` when the
+    project is over its soft quota (callers let the work through and
+    warn), ``headroom_bytes`` what is left under the hard quota, if any.
+    """
+    soft, hard = _limits()
+    if soft is None and hard is None:
+        return {"state": "ok", "headroom_bytes": None}
+    doc = await db.projects.find_one(
+        {"_id": ObjectId(project_id)}, {"stats.disk_usage_bytes": 1}
+    )
+    usage = ((doc or {}).get("stats") or {}).get("disk_usage_bytes")
+    if usage is None:
+        # Not measured yet
+        return {"state": "ok", "headroom_bytes": None}
+    if hard is not None and usage + incoming > hard:
+        raise HTTPException(
+            status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+            detail=f"Project disk quota exceeded ({usage} of {hard} bytes used)",
+        )
+    return {
+        "state": quota(usage + incoming)["state"],
+        "headroom_bytes": hard - usage if hard is not None else None,
+    }
+
+
+def size_change(old: os.stat_result | None, new: os.stat_result) -> int:
+    """Bytes a write added (or freed), in the units the scanner counts."""
+    return _allocated(new) - (_allocated(old) if old is not None else 0)
+
+
+async def _hold_lock(token: str) -> bool:
+    """Take or keep the scanner lock, so one process measures at a time."""
+    redis = get_redis()
+    if await redis.set(_LOCK_KEY, token, nx=True, ex=_LOCK_TTL):
+        return True
+    owner = await redis.get(_LOCK_KEY)
+    if owner is not None and owner.decode() == token:
+        await redis.expire(_LOCK_KEY, _LOCK_TTL)
+        return True
+    return False
+
+
+async def _rescan_dirty() -> None:
+    redis = get_redis()
+    while project_ids := await redis.spop(DIRTY_KEY, 50):
+        for project_id in project_ids:
+            try:
+                await rescan(project_id.decode())
+            except Exception:
+                logger.exception("Measuring project %s failed", project_id)
+
+
+async def run_scanner() -> None:
+    """Re-measure dirty projects promptly and every project periodically."""
+    token = uuid.uuid4().hex
+    next_pass = 0.0
+    while True:
+        try:
+            if await _hold_lock(token):
+                await _rescan_dirty()
+                if time.monotonic() >= next_pass:
+                    cursor = get_db().projects.find(
+                        {"status": {"$ne": "deleting"}}, {"_id": 1}
+                    )
+                    async for doc in cursor:
+                        await rescan(str(doc["_id"]))
+                        await _rescan_dirty()
+                        await _hold_lock(token)
+                        await asyncio.sleep(_PASS_DELAY)
+                    next_pass = time.monotonic() + settings.disk_usage_scan_interval
+        except Exception:
+            logger.exception("Disk usage scanner failed")
+        await asyncio.sleep(_DIRTY_POLL)
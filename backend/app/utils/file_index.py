@@ -0,0 +1,544 @@
+"""In-memory file index per project environment (quick open, tree listings).
+
+An index holds the gitignore-filtered directory structure of one
+environment root. It is built with a single walk and then kept current
+incrementally: a filesystem watcher (inotify through ``watchfiles``, shared
+with the live change events by ``dir_watch``) marks the directories that
+changed, and only those are rescanned. If watching is unavailable, or as a
+periodic safety net, every indexed directory is re-stat'ed and the ones
+whose mtime moved are rescanned.
+
+Fuzzy lookups run a regex prefilter over all paths joined into a single
+string, so only candidate paths are scored in Python. Directory content
+hashes (a Merkle tree over file SHA-256s) are cached and only the chain
+from a changed directory up to the root is recomputed. Indexes idle for
+``file_index_idle_ttl`` seconds, or beyond the memory budget (least
+recently used first), are dropped and rebuilt on demand.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from collections.abc import Iterator
+from contextlib import suppress
+
+from starlette.concurrency import run_in_threadpool
+from watchfiles import Change
+
+from app.config import settings
+from app.utils import dir_watch
+from app.utils.fs import file_digest, scan_names
+from app.utils.gitignore import IgnoreMatcher
+
+# Full reconciliation interval with and without a working watcher (seconds)
+_RECONCILE_WATCHED = 60.0
+_RECONCILE_POLLING = 2.0
+
+
+# Rough per-file overhead used for the memory estimate (bytes)
+_BYTES_PER_FILE = 200
+
+_SEPARATORS = frozenset("/_-. ")
+
+
+class _Dir:
+    __slots__ = ("key", "stack", "entries")
+
+    def __init__(self, key: tuple[int, int], stack: list, entries: list):
+        self.key = key  # (dir mtime, .gitignore mtime)
+        self.stack = stack  # gitignore rule stack for this directory
+        self.entries = entries  # sorted (name, is_dir), ignored entries removed
+
+
+def _align(lower: str, query: str, start: int) -> list[int] | None:
+    """Leftmost positions of ``query``'s characters in ``lower[start:]``."""
+    positions = []
+    pos = start - 1
+    for ch in query:
+        pos = lower.find(ch, pos + 1)
+        if pos == -1:
+            return None
+        positions.append(pos)
+    return positions
+
+
+def _score(path: str, query: str) -> int:
+    """Rank a candidate: file-name hits, consecutive runs and word starts win."""
+    lower = path.lower()
+    name_start = lower.rfind("/") + 1
+    positions = _align(lower, query, name_start) or _align(lower, query, 0)
+    if positions is None:
+        return 0
+
+    score = 0
+    prev = -2
+    for pos in positions:
+        if pos == prev + 1:
+            score += 5
+        if (
+            pos == 0
+            or lower[pos - 1] in _SEPARATORS
+            or (path[pos].isupper() and not path[pos - 1].isupper())
+        ):
+            score += 3
+        if pos >= name_start:
+            score += 2
+        prev = pos
+    if lower.startswith(query, name_start):
+        score += 10
+    # Shorter paths break ties
+    return score * 1000 - len(path)
+
+
+class FileIndex:
+    """Gitignore-filtered files and directories of one environment root."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.matcher = IgnoreMatcher(root)
+        self.truncated = False  # stopped at file_index_max_files
+        self.subscribed = False  # fed by dir_watch
+        self.last_used = time.monotonic()
+        self.memory = 0
+
+        self._dirs: dict[str, _Dir] = {}
+        self._files = 0
+        # Held by build/refresh for whole walks: never take it on the event loop
+        self._lock = threading.Lock()
+        # Filled by the watcher on the event loop (deque appends need no lock)
+        self._dirty: deque[str] = deque()
+        self._reconciled_at = 0.0
+        self._generation = 0
+        self._view_generation = -1
+        # (sorted paths, paths joined by "\n", lowercased join or None),
+        # replaced whole so readers need no lock
+        self._view: tuple[list[str], str, str | None] = ([], "", None)
+        self._digests: dict[str, str] = {}  # rel_dir -> Merkle hash
+        # Bumped on every invalidation; hashes computed across one are not cached
+        self._digest_epoch = 0
+
+    # -- building and reconciling -------------------------------------------
+
+    def _dir_key(self, rel_dir: str) -> tuple[int, int]:
+        abs_dir = os.path.join(self.root, rel_dir)
+        mtime = os.stat(abs_dir).st_mtime_ns
+        try:
+            ignore_mtime = os.stat(os.path.join(abs_dir, ".gitignore")).st_mtime_ns
+        except OSError:
+            ignore_mtime = 0
+        return mtime, ignore_mtime
+
+    def _scan_dir(self, rel_dir: str, stack: list) -> _Dir | None:
+        try:
+            key = self._dir_key(rel_dir)
+            names = scan_names(os.path.join(self.root, rel_dir))
+        except OSError:
+            return None
+        entries = []
+        for name, is_dir in names:
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            if not self.matcher.is_ignored(stack, rel_path, is_dir):
+                entries.append((name, is_dir))
+        return _Dir(key, stack, entries)
+
+    def _scan_subtree(self, rel_dir: str, parent_stack: list) -> None:
+        """Scan ``rel_dir`` and everything below it into the index."""
+        seen: set[tuple[int, int]] = set()
+        pending = [(rel_dir, self.matcher.rules_for(parent_stack, rel_dir))]
+        while pending:
+            rel, stack = pending.pop()
+            try:
+                st = os.stat(os.path.join(self.root, rel))
+            except OSError:
+                continue
+            # Symlinked directories are followed once; cycles are skipped
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+
+            node = self._scan_dir(rel, stack)
+            if node is None:
+                continue
+            if self._files >= settings.file_index_max_files:
+                self.truncated = True
+                return
+            self._dirs[rel] = node
+            for name, is_dir in node.entries:
+                child = f"{rel}/{name}" if rel else name
+                if is_dir:
+                    pending.append((child, self.matcher.rules_for(stack, child)))
+                else:
+                    self._files += 1
+
+    def _drop_subtree(self, rel_dir: str) -> None:
+        prefix = rel_dir + "/" if rel_dir else ""
+        for rel in [r for r in self._dirs if r == rel_dir or r.startswith(prefix)]:
+            node = self._dirs.pop(rel)
+            self._digests.pop(rel, None)
+            self._digest_epoch += 1
+            self._files -= sum(1 for _, is_dir in node.entries if not is_dir)
+
+    def _forget_digest(self, rel_dir: str) -> None:
+        """Invalidate the hashes of ``rel_dir`` and all its ancestors."""
+        self._digest_epoch += 1
+        while True:
+            self._digests.pop(rel_dir, None)
+            if not rel_dir:
+                return
+            rel_dir = rel_dir.rsplit("/", 1)[0] if "/" in rel_dir else ""
+
+    def _parent_stack(self, rel_dir: str) -> list:
+        if not rel_dir:
+            return []
+        parent = self._dirs.get(rel_dir.rsplit("/", 1)[0] if "/" in rel_dir else "")
+        return parent.stack if parent else []
+
+    def _rescan(self, rel_dir: str) -> bool:
+        """Bring one indexed directory up to date. Returns True if it changed."""
+        node = self._dirs.get(rel_dir)
+        if node is None:
+            return False
+        try:
+            key = self._dir_key(rel_dir)
+        except OSError:
+            self._drop_subtree(rel_dir)
+            return True
+        if key == node.key:
+            return False
+
+        if key[1] != node.key[1]:
+            # The directory's .gitignore changed: everything below may differ
+            parent_stack = self._parent_stack(rel_dir)
+            self._drop_subtree(rel_dir)
+            self._scan_subtree(rel_dir, parent_stack)
+            return True
+
+        fresh = self._scan_dir(rel_dir, node.stack)
+        if fresh is None:
+            self._drop_subtree(rel_dir)
+            return True
+        old = set(node.entries)
+        new = set(fresh.entries)
+        self._dirs[rel_dir] = fresh
+        for name, is_dir in old - new:
+            child = f"{rel_dir}/{name}" if rel_dir else name
+            if is_dir:
+                self._drop_subtree(child)
+            else:
+                self._files -= 1
+        for name, is_dir in new - old:
+            child = f"{rel_dir}/{name}" if rel_dir else name
+            if is_dir:
+                self._scan_subtree(child, fresh.stack)
+            else:
+                self._files += 1
+        return True
+
+    def build(self) -> None:
+        with self._lock:
+            self._dirs.clear()
+            self._files = 0
+            self.truncated = False
+            self._digests.clear()
+            self._digest_epoch += 1
+            self._scan_subtree("", [])
+            self._reconciled_at = time.monotonic()
+            self._generation += 1
+            self._update_view()
+
+    def mark_dirty(self, abs_paths: set[str]) -> None:
+        """Record paths reported by the watcher; they are rescanned on next use."""
+        dirty = set()
+        for path in abs_paths:
+            rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+            if rel == "." or rel.startswith("../"):
+                dirty.add("")
+                continue
+            dirty.add(rel)
+            dirty.add(rel.rsplit("/", 1)[0] if "/" in rel else "")
+        self._dirty.extend(dirty)
+
+    def on_changes(self, changes: set[tuple[Change, str]]) -> None:
+        """``dir_watch`` callback."""
+        self.mark_dirty({path for _, path in changes})
+
+    def _take_dirty(self) -> set[str]:
+        dirty = set()
+        with suppress(IndexError):
+            while True:
+                dirty.add(self._dirty.popleft())
+        return dirty
+
+    def refresh(self) -> None:
+        """Apply pending changes (and a full reconcile when one is due)."""
+        interval = _RECONCILE_WATCHED if self.watching else _RECONCILE_POLLING
+        full = time.monotonic() - self._reconciled_at >= interval
+        with self._lock:
+            dirty = self._take_dirty()
+            if full:
+                targets = list(self._dirs)
+                self._reconciled_at = time.monotonic()
+            else:
+                targets = [d for d in dirty if d in self._dirs]
+            if self.watching:
+                # File edits do not touch directory mtimes; the watcher saw them
+                for rel_dir in dirty:
+                    if rel_dir in self._dirs:
+                        self._forget_digest(rel_dir)
+            else:
+                # Without a watcher, re-verify every file (by stat) on next use
+                self._digests.clear()
+                self._digest_epoch += 1
+            changed = False
+            # Parents first, so new subtrees are scanned once
+            for rel_dir in sorted(targets, key=lambda d: d.count("/")):
+                if self._rescan(rel_dir):
+                    self._forget_digest(rel_dir)
+                    changed = True
+            if changed:
+                self._generation += 1
+            self._update_view()
+
+    # -- derived views ------------------------------------------------------
+
+    def _update_view(self) -> None:
+        if self._view_generation == self._generation:
+            return
+        paths = []
+        for rel_dir, node in self._dirs.items():
+            for name, is_dir in node.entries:
+                if not is_dir:
+                    paths.append(f"{rel_dir}/{name}" if rel_dir else name)
+        paths.sort()
+        blob = "\n".join(paths)
+        lower = blob.lower()
+        # Lowercasing can change lengths for a few characters; offsets must line up
+        self._view = (paths, blob, lower if len(lower) == len(blob) else None)
+        self.memory = len(blob) * 3 + len(paths) * _BYTES_PER_FILE
+        self._view_generation = self._generation
+
+    @property
+    def watching(self) -> bool:
+        return self.subscribed and dir_watch.watching(self.root)
+
+    @property
+    def file_count(self) -> int:
+        return len(self._view[0])
+
+    def has_dir(self, rel_dir: str) -> bool:
+        return rel_dir in self._dirs
+
+    def _hash_entries(
+        self, rel_dir: str, entries: tuple
+    ) -> Iterator[tuple[str, bool, str]]:
+        # Called without the lock: reading files must not stall build/refresh
+        for name, is_dir in entries:
+            child = f"{rel_dir}/{name}" if rel_dir else name
+            if is_dir:
+                digest = self.digest(child)
+            else:
+                digest = file_digest(os.path.join(self.root, child)) or ""
+            yield name, is_dir, digest
+
+    def digest(self, rel_dir: str = "") -> str:
+        """Content hash of a directory (file names, types and contents).
+
+        Directories the index does not hold (see ``truncated``) hash as
+        empty, so the hash only covers the whole tree if it is not set.
+        Blocking (files are read on a cold cache); call it in the threadpool.
+        """
+        with self._lock:
+            cached = self._digests.get(rel_dir)
+            node = self._dirs.get(rel_dir)
+            entries = tuple(node.entries) if node else ()
+            epoch = self._digest_epoch
+        if cached is not None:
+            return cached
+        h = hashlib.sha256()
+        for name, is_dir, digest in self._hash_entries(rel_dir, entries):
+            h.update(f"{name}\0{'d' if is_dir else 'f'}\0{digest}\n".encode())
+        digest = h.hexdigest()
+        with self._lock:
+            if self._digest_epoch == epoch:
+                self._digests[rel_dir] = digest
+        return digest
+
+    def hashed_entries(self, rel_dir: str) -> dict[str, tuple[bool, str]]:
+        """``name -> (is_dir, hash)`` for one directory."""
+        with self._lock:
+            node = self._dirs.get(rel_dir)
+            entries = tuple(node.entries) if node else ()
+        return {
+            name: (is_dir, digest)
+            for name, is_dir, digest in self._hash_entries(rel_dir, entries)
+        }
+
+    def files_under(self, rel_dir: str) -> list[str]:
+        """Indexed file paths below ``rel_dir``, sorted."""
+        paths = self._view[0]
+        if not rel_dir:
+            return list(paths)
+        prefix = rel_dir + "/"
+        start = bisect_left(paths, prefix)
+        end = bisect_left(paths, rel_dir + "0")  # "0" sorts right after "/"
+        return paths[start:end]
+
+    def find(self, query: str, limit: int = 50) -> tuple[list[dict], int]:
+        """Fuzzy-match ``query`` against file paths.
+
+        Matches are paths containing the query's characters in order
+        (case-insensitive, whitespace ignored). Returns ``(results, candidates)``
+        with the ``limit`` best ``{"path", "score"}`` results.
+        """
+        query = "".join(query.lower().split())
+        if not query:
+            return [], 0
+        _, blob, lower_blob = self._view
+
+        # Each gap excludes the next character, so matching never backtracks
+        parts = [re.escape(query[0])]
+        for ch in query[1:]:
+            parts.append(f"[^\\n{re.escape(ch)}]*{re.escape(ch)}")
+        if lower_blob is not None:
+            haystack, pattern = lower_blob, re.compile("".join(parts))
+        else:
+            haystack, pattern = blob, re.compile("".join(parts), re.IGNORECASE)
+
+        candidates = 0
+
+        def scored() -> Iterator[tuple[int, str]]:
+            nonlocal candidates
+            pos = 0
+            while m := pattern.search(haystack, pos):
+                start = haystack.rfind("\n", 0, m.start()) + 1
+                end = haystack.find("\n", m.end())
+                if end == -1:
+                    end = len(haystack)
+                path = blob[start:end]
+                candidates += 1
+                yield _score(path, query), path
+                pos = end + 1
+
+        # Every match is scored; only the best ``limit`` are kept at a time
+        best = heapq.nlargest(limit, scored())
+        return [{"path": "/" + p, "score": s} for s, p in best], candidates
+
+    def walk(self, start: str, depth: int, max_entries: int) -> Iterator[dict]:
+        """Breadth-first records in the same shape as ``fs.walk_tree``.
+
+        Waits for a running build or refresh; call it in the threadpool.
+        """
+        with self._lock:
+            emitted = 0
+            queue = deque([(start, 1)])
+            records = []
+            while queue:
+                rel_dir, level = queue.popleft()
+                node = self._dirs.get(rel_dir)
+                if node is None:
+                    continue
+                entries = []
+                truncated = False
+                for name, is_dir in node.entries:
+                    if emitted >= max_entries:
+                        truncated = True
+                        break
+                    emitted += 1
+                    entries.append(
+                        {"name": name, "type": "directory" if is_dir else "file"}
+                    )
+                    if is_dir and level < depth:
+                        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                        queue.append((rel_path, level + 1))
+                record = {"path": "/" + rel_dir, "entries": entries}
+                if truncated:
+                    record["truncated"] = True
+                    records.append(record)
+                    break
+                records.append(record)
+        return iter(records)
+
+
+_indexes: OrderedDict[str, FileIndex] = OrderedDict()
+_building: dict[str, asyncio.Future] = {}
+_watched: dict[str, FileIndex] = {}
+
+
+async def _build(root: str) -> FileIndex:
+    index = FileIndex(root)
+    if settings.file_index_watch:
+        # Subscribed before the walk so changes made during it are not lost;
+        # while the watch is down, the index falls back to mtime polling
+        dir_watch.subscribe(root, index.on_changes)
+        index.subscribed = True
+        _watched[root] = index
+    try:
+        await run_in_threadpool(index.build)
+    except BaseException:
+        drop(root)
+        raise
+    _indexes[root] = index
+    _evict()
+    return index
+
+
+def drop(root: str) -> None:
+    """Forget an index and stop following its changes."""
+    _indexes.pop(root, None)
+    index = _watched.pop(root, None)
+    if index is not None:
+        dir_watch.unsubscribe(root, index.on_changes)
+
+
+def _evict() -> None:
+    now = time.monotonic()
+    for root, index in list(_indexes.items()):
+        if now - index.last_used > settings.file_index_idle_ttl:
+            drop(root)
+    budget = settings.file_index_max_memory_mb * 1024 * 1024
+    # Always keep the most recently used index, even if it alone is over budget
+    while len(_indexes) > 1 and sum(i.memory for i in _indexes.values()) > budget:
+        drop(next(iter(_indexes)))
+
+
+async def get_index(root: str) -> FileIndex:
+    """Return an up-to-date index for ``root``, building it on first use."""
+    index = _indexes.get(root)
+    if index is None:
+        future = _building.get(root)
+        if future is None:
+            future = asyncio.ensure_future(_build(root))
+            _building[root] = future
+            future.add_done_callback(lambda _: _building.pop(root, None))
+        index = await asyncio.shield(future)
+    else:
+        _indexes.move_to_end(root)
+        await run_in_threadpool(index.refresh)
+    index.last_used = time.monotonic()
+    return index
+
+
+async def run_janitor(interval: float = 60.0) -> None:
+    """Periodically drop idle indexes (runs for the app's lifetime)."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            _evict()
+    finally:
+        for root in [*_indexes, *_watched]:
+            drop(root)
+
+
+def stats() -> dict:
+    return {
+        "indexes": len(_indexes),
+        "files": sum(i.file_count for i in _indexes.values()),
+        "memory_bytes": sum(i.memory for i in _indexes.values()),
+        "watching": sum(1 for i in _indexes.values() if i.watching),
+    }
@@ -0,0 +1,181 @@
+"""Live file-change notifications for projects with connected clients.
+
+While at least one websocket in this process is subscribed to a project,
+a watcher task tries to take a short-lived Redis lock for the project; the
+process holding it follows the project's environment roots and publishes
+debounced, batched ``files_changed`` events on the project's channel, so
+every connected client (in any process) receives each change exactly once.
+Changes come from the ``dir_watch`` watches the file index also uses, so a
+root is never watched twice by one process.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager, suppress
+
+from watchfiles import Change
+
+from app.config import settings
+from app.db.redis import get_redis
+from app.utils import dir_watch
+from app.utils.gitignore import DEFAULT_EXCLUDES
+
+logger = logging.getLogger(__name__)
+
+LOCK_TTL = 30  # seconds; refreshed every LOCK_TTL / 3 by the owner
+
+_CHANGE_TYPES = {
+    Change.added: "created",
+    Change.modified: "modified",
+    Change.deleted: "deleted",
+}
+_ENVS = ("staging", "prod")
+
+_subscribers: dict[str, int] = {}
+_tasks: dict[str, asyncio.Task] = {}
+
+
+def _lock_key(project_id: str) -> str:
+    return f"filewatch:{project_id}"
+
+
+def build_event(project_dir: str, changes: set[tuple[Change, str]]) -> dict | None:
+    """Turn a batch of raw watcher changes into a ``files_changed`` event.
+
+    Paths inside default-excluded directories (``.git``, ``node_modules``...)
+    are dropped. Returns None when nothing relevant changed.
+    """
+    by_path: dict[tuple[str, str], str] = {}
+    for change, path in sorted(changes, key=lambda c: c[1]):
+        rel = os.path.relpath(path, project_dir).replace(os.sep, "/")
+        env, _, rel_path = rel.partition("/")
+        if env not in _ENVS or not rel_path:
+            continue
+        if any(part in DEFAULT_EXCLUDES for part in rel_path.split("/")):
+            continue
+        kind = _CHANGE_TYPES[change]
+        previous = by_path.get((env, rel_path))
+        if previous == "created" and kind == "modified":
+            continue  # still new to the client
+        if previous == "created" and kind == "deleted":
+            del by_path[(env, rel_path)]  # never existed as far as clients know
+            continue
+        by_path[(env, rel_path)] = kind
+
+    if not by_path:
+        return None
+    limit = settings.file_watch_max_batch
+    event = {
+        "type": "files_changed",
+        "changes": [
+            {"env": env, "path": "/" + rel_path, "type": kind}
+            for (env, rel_path), kind in list(by_path.items())[:limit]
+        ],
+    }
+    if len(by_path) > limit:
+        # Too much to describe; clients should refetch what they show
+        event["truncated"] = True
+    return event
+
+
+async def _keep_lock(project_id: str, token: str, stop: asyncio.Event) -> None:
+    redis = get_redis()
+    key = _lock_key(project_id)
+    try:
+        while not stop.is_set():
+            await asyncio.sleep(LOCK_TTL / 3)
+            owner = await redis.get(key)
+            if owner is None or owner.decode() != token:
+                break
+            await redis.expire(key, LOCK_TTL)
+    except Exception:
+        logger.warning("Lost file watch lock for project %s", project_id)
+    finally:
+        stop.set()
+
+
+async def _next_batch(
+    batches: asyncio.Queue, stop: asyncio.Event
+) -> set[tuple[Change, str]] | None:
+    """Changes arriving within one debounce window, or None once stopped."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            changes = set(await asyncio.wait_for(batches.get(), 1))
+        except asyncio.TimeoutError:
+            continue
+        deadline = loop.time() + settings.file_watch_debounce_ms / 1000
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                changes |= await asyncio.wait_for(batches.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return changes
+    return None
+
+
+async def _watch(project_id: str, token: str) -> None:
+    """Follow a project while holding its lock, publishing change batches."""
+    project_dir = os.path.join(settings.projects_data_dir, project_id)
+    roots = [os.path.join(project_dir, env) for env in _ENVS]
+    channel = f"project:{project_id}:chat"
+    stop = asyncio.Event()
+    batches: asyncio.Queue = asyncio.Queue()
+    for root in roots:
+        dir_watch.subscribe(root, batches.put_nowait)
+    keeper = asyncio.create_task(_keep_lock(project_id, token, stop))
+    try:
+        while (changes := await _next_batch(batches, stop)) is not None:
+            event = build_event(project_dir, changes)
+            if event is not None:
+                await get_redis().publish(channel, json.dumps({"event": event}))
+    finally:
+        for root in roots:
+            dir_watch.unsubscribe(root, batches.put_nowait)
+        stop.set()
+        keeper.cancel()
+        with suppress(asyncio.CancelledError):
+            await keeper
+
+
+async def _run(project_id: str) -> None:
+    """Take over watching a project whenever no other process does it."""
+    key = _lock_key(project_id)
+    token = uuid.uuid4().hex
+    while True:
+        try:
+            if await get_redis().set(key, token, nx=True, ex=LOCK_TTL):
+                try:
+                    await _watch(project_id, token)
+                finally:
+                    redis = get_redis()
+                    owner = await redis.get(key)
+                    if owner is not None and owner.decode() == token:
+                        await redis.delete(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Redis errors; dir_watch retries failed watches itself
+            logger.warning("File watcher for project %s failed: %s", project_id, e)
+        await asyncio.sleep(LOCK_TTL / 3)
+
+
+@asynccontextmanager
+async def subscription(project_id: str):
+    """Keep a project watched (by some process) while the block runs."""
+    _subscribers[project_id] = _subscribers.get(project_id, 0) + 1
+    if project_id not in _tasks:
+        _tasks[project_id] = asyncio.create_task(_run(project_id))
+    try:
+        yield
+    finally:
+        _subscribers[project_id] -= 1
+        if not _subscribers[project_id]:
+            del _subscribers[project_id]
+            task = _tasks.pop(project_id)
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
@@ -0,0 +1,343 @@
+"""Filesystem helpers for the file browser.
+
+Everything here is blocking and meant to run in a worker thread, never
+directly on the event loop.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Iterator
+
+from app.utils.gitignore import DEFAULT_EXCLUDES, IgnoreMatcher
+
+# Entries never shown in the file browser
+HIDDEN_NAMES = frozenset({".git"})
+
+
+def _entry_stat(entry: os.DirEntry) -> os.stat_result | None:
+    """Stat a directory entry, falling back to lstat for broken symlinks."""
+    try:
+        return entry.stat()
+    except OSError:
+        try:
+            return entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+
+
+def _entry_is_dir(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def file_etag(st: os.stat_result) -> str:
+    """Strong ETag derived from stat results (inode, mtime, size)."""
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+_write_locks = [threading.Lock() for _ in range(64)]
+
+
+def write_lock(path: str) -> threading.Lock:
+    """Lock serialising read-check-write cycles on ``path`` within this process."""
+    return _write_locks[hash(path) % len(_write_locks)]
+
+
+def atomic_write(path: str, data: bytes) -> os.stat_result:
+    """Replace ``path`` with ``data`` atomically and return the new file's stat.
+
+    The data goes to a temporary file in the same directory, which is then
+    renamed over the target, so readers see either the old or the new
+    content, never a partial write. An existing file's permissions are kept.
+    """
+    directory = os.path.dirname(path)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = None
+    fd, tmp = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates files as 0600
+        os.chmod(tmp, mode if mode is not None else 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return os.stat(path)
+
+
+def list_dir(
+    path: str,
+    sort: str = "name",
+    order: str = "asc",
+    dirs_first: bool = False,
+    offset: int = 0,
+    limit: int = 1000,
+) -> tuple[list[dict], int]:
+    """List one directory with a single ``scandir`` pass.
+
+    Returns ``(entries, total)`` where ``entries`` is the requested page of
+    ``{"name", "type", "size", "mtime"}`` dicts and ``total`` the number of
+    visible entries. When sorting by name, only the returned page is
+    stat'ed; ``is_dir`` comes from the directory entry itself.
+    """
+    with os.scandir(path) as it:
+        entries = [e for e in it if e.name not in HIDDEN_NAMES]
+
+    total = len(entries)
+    is_dir = {e.name: _entry_is_dir(e) for e in entries}
+    reverse = order == "desc"
+
+    if sort == "name":
+        entries.sort(key=lambda e: e.name, reverse=reverse)
+        stats = {}
+    else:
+        stats = {e.name: _entry_stat(e) for e in entries}
+        attr = "st_mtime" if sort == "mtime" else "st_size"
+        entries.sort(
+            key=lambda e: (getattr(stats[e.name], attr, 0), e.name), reverse=reverse
+        )
+
+    if dirs_first:
+        # Stable sort keeps the chosen order within each group
+        entries.sort(key=lambda e: not is_dir[e.name])
+
+    page = []
+    for entry in entries[offset : offset + limit]:
+        st = stats.get(entry.name) or _entry_stat(entry)
+        page.append(
+            {
+                "name": entry.name,
+                "type": "directory" if is_dir[entry.name] else "file",
+                "size": st.st_size if st else 0,
+                "mtime": st.st_mtime if st else 0.0,
+            }
+        )
+    return page, total
+
+
+_listing_cache: OrderedDict[
+    str, tuple[int, list[tuple[str, bool]], frozenset[str]]
+] = OrderedDict()
+_listing_lock = threading.Lock()
+_LISTING_CACHE_SIZE = 20_000
+
+
+def _scan(path: str) -> tuple[list[tuple[str, bool]], frozenset[str]]:
+    mtime = os.stat(path).st_mtime_ns
+    with _listing_lock:
+        cached = _listing_cache.get(path)
+        if cached and cached[0] == mtime:
+            _listing_cache.move_to_end(path)
+            return cached[1], cached[2]
+
+    with os.scandir(path) as it:
+        entries = list(it)
+    names = sorted((e.name, _entry_is_dir(e)) for e in entries)
+    links = frozenset(e.name for e in entries if e.is_symlink())
+
+    with _listing_lock:
+        _listing_cache[path] = (mtime, names, links)
+        while len(_listing_cache) > _LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return names, links
+
+
+def scan_names(path: str) -> list[tuple[str, bool]]:
+    """Return sorted ``(name, is_dir)`` pairs for a directory.
+
+    Results are cached and reused while the directory's mtime is unchanged
+    (creating, deleting or renaming an entry always bumps it), so repeated
+    walks of an untouched tree skip the ``scandir`` calls.
+    """
+    return _scan(path)[0]
+
+
+def _inside(root_real: str, path: str) -> bool:
+    real = os.path.realpath(path)
+    return real == root_real or real.startswith(root_real + os.sep)
+
+
+_digest_cache: OrderedDict[str, tuple[tuple[int, int, int], str]] = OrderedDict()
+_digest_lock = threading.Lock()
+_DIGEST_CACHE_SIZE = 500_000
+
+
+def file_digest(path: str) -> str | None:
+    """SHA-256 of a file's content, or None if it cannot be read.
+
+    Digests are cached by (size, mtime, inode), so unchanged files are
+    only stat'ed, never re-read.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+        if cached and cached[0] == key:
+            _digest_cache.move_to_end(path)
+            return cached[1]
+
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+    except OSError:
+        return None
+    digest = h.hexdigest()
+
+    with _digest_lock:
+        _digest_cache[path] = (key, digest)
+        while len(_digest_cache) > _DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+
+def _start_stack(matcher: IgnoreMatcher, start: str) -> tuple[str, list]:
+    """Normalise a walk's start path and collect the rules of its ancestors."""
+    stack: list = matcher.rules_for([], "")
+    parts = [p for p in start.split("/") if p]
+    for i in range(len(parts)):
+        stack = matcher.rules_for(stack, "/".join(parts[: i + 1]))
+    return "/".join(parts), stack
+
+
+def walk_tree(
+    root: str,
+    start: str = "",
+    depth: int = 5,
+    max_entries: int = 10_000,
+    use_gitignore: bool = True,
+    excludes: frozenset[str] = DEFAULT_EXCLUDES,
+    details: bool = False,
+) -> Iterator[dict]:
+    """Breadth-first walk yielding one ``{"path", "entries"}`` record per directory.
+
+    ``start`` is a POSIX path relative to ``root``. Ignored paths are
+    skipped entirely (their subtrees are never visited). With ``details``
+    every entry is stat'ed for size and mtime; without it the walk only
+    touches directories. Stops after ``max_entries`` entries; the last
+    record then carries ``"truncated": True``.
+    """
+    matcher = IgnoreMatcher(root, use_gitignore, excludes)
+    start, stack = _start_stack(matcher, start)
+
+    emitted = 0
+    queue = deque([(start, stack, 1)])
+    while queue:
+        rel_dir, stack, level = queue.popleft()
+        abs_dir = os.path.join(root, rel_dir)
+        try:
+            names = scan_names(abs_dir)
+        except OSError:
+            continue
+
+        entries = []
+        truncated = False
+        for name, is_dir in names:
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            if matcher.is_ignored(stack, rel_path, is_dir):
+                continue
+            if emitted >= max_entries:
+                truncated = True
+                break
+            emitted += 1
+
+            entry = {"name": name, "type": "directory" if is_dir else "file"}
+            if details:
+                try:
+                    st = os.stat(os.path.join(abs_dir, name))
+                    entry["size"] = st.st_size
+                    entry["mtime"] = st.st_mtime
+                except OSError:
+                    entry["size"] = 0
+                    entry["mtime"] = 0.0
+            entries.append(entry)
+
+            if is_dir and level < depth:
+                queue.append((rel_path, matcher.rules_for(stack, rel_path), level + 1))
+
+        record = {"path": "/" + rel_dir, "entries": entries}
+        if truncated:
+            record["truncated"] = True
+            yield record
+            return
+        yield record
+
+
+def iter_files(
+    root: str,
+    start: str = "",
+    use_gitignore: bool = True,
+    excludes: frozenset[str] = DEFAULT_EXCLUDES,
+    follow_symlinks: bool = True,
+) -> Iterator[str]:
+    """Yield POSIX paths (relative to ``root``) of every non-ignored file, depth-first.
+
+    Symlinks are followed only if they resolve inside ``root`` (directories
+    once; cycles are skipped); any other link is left out, so callers
+    reading the yielded paths never leave the tree. Without
+    ``follow_symlinks`` every symlink is yielded like a file and never
+    entered.
+    """
+    matcher = IgnoreMatcher(root, use_gitignore, excludes)
+    start, stack = _start_stack(matcher, start)
+    root_real = os.path.realpath(root)
+    if not _inside(root_real, os.path.join(root, start)):
+        return
+
+    seen: set[tuple[int, int]] = set()
+    pending = [(start, stack)]
+    # Symlinked directories are walked last, so a tree reachable both
+    # directly and through a link is listed under its real path
+    linked: list[tuple[str, list]] = []
+    while pending or linked:
+        rel_dir, stack = pending.pop() if pending else linked.pop()
+        abs_dir = os.path.join(root, rel_dir)
+        try:
+            st = os.stat(abs_dir)
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            names, links = _scan(abs_dir)
+        except OSError:
+            continue
+
+        subdirs = []
+        for name, is_dir in names:
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            if matcher.is_ignored(stack, rel_path, is_dir):
+                continue
+            if name in links:
+                if not follow_symlinks:
+                    yield rel_path
+                    continue
+                if not _inside(root_real, os.path.join(abs_dir, name)):
+                    continue
+                if is_dir:
+                    linked.append((rel_path, matcher.rules_for(stack, rel_path)))
+                    continue
+            if is_dir:
+                subdirs.append(rel_path)
+            else:
+                yield rel_path
+        # Reversed so the stack pops subdirectories in name order
+        for rel_path in reversed(subdirs):
+            pending.append((rel_path, matcher.rules_for(stack, rel_path)))
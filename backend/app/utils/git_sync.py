@@ -0,0 +1,115 @@
+"""Queue clones, fetches and pushes of projects' git repositories.
+
+The worker runs the jobs (``git_tasks`` queue) against a shared object
+cache per remote and records each outcome on the project as ``git.sync``;
+see ``worker/app/git_sync.py``. One job per project and action is queued
+at a time. :func:`run_scheduler` fetches every project with a remote
+periodically, so ``origin/*`` stays current without anyone asking.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+
+import redis.asyncio as aioredis
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.config import settings
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import invalidate_project
+from app.utils.security import decrypt_value
+
+logger = logging.getLogger(__name__)
+
+QUEUE = "git_tasks"
+PENDING_PREFIX = "git_tasks:pending"  # cleared by the worker when a job starts
+PENDING_TTL = 3600  # seconds; a lost job does not block its action for longer
+
+ACTIONS = ("clone", "fetch", "push")
+
+_SCHEDULER_KEY = "git_sync:scheduled"
+
+
+async def enqueue(
+    db: AsyncIOMotorDatabase, redis: aioredis.Redis, project: dict, action: str
+) -> dict:
+    """Queue ``action`` for a project; returns its ``git.sync`` state.
+
+    If the same action is already queued, nothing new is queued. Raises
+    400 when the project has no remote configured.
+    """
+    git = project.get("git") or {}
+    if not git.get("repo_url"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The project has no git remote configured",
+        )
+    project_id = str(project["_id"])
+    if not await redis.set(
+        f"{PENDING_PREFIX}:{project_id}:{action}", 1, nx=True, ex=PENDING_TTL
+    ):
+        current = await db.projects.find_one({"_id": project["_id"]}, {"git.sync": 1})
+        return ((current or {}).get("git") or {}).get("sync") or {}
+
+    token = decrypt_value(git["credentials"]) if git.get("credentials") else None
+    job_id = uuid.uuid4().hex
+    await redis.lpush(
+        QUEUE,
+        json.dumps(
+            {
+                "job_id": job_id,
+                "type": action,
+                "project_id": project_id,
+                "repo_url": git["repo_url"],
+                "branch": git.get("branch") or "main",
+                "token": token,
+            }
+        ),
+    )
+    sync = {
+        "job_id": job_id,
+        "action": action,
+        "state": "queued",
+        "error": None,
+        "queued_at": datetime.now(timezone.utc),
+    }
+    await db.projects.update_one({"_id": project["_id"]}, {"$set": {"git.sync": sync}})
+    await invalidate_project(str(project["_id"]))
+    return sync
+
+
+async def run_scheduler() -> None:
+    """Fetch every project with a git remote every ``git_fetch_interval``."""
+    interval = settings.git_fetch_interval
+    if interval <= 0:
+        return
+    while True:
+        try:
+            # One backend process schedules each round
+            if await get_redis().set(_SCHEDULER_KEY, 1, nx=True, ex=interval):
+                db = get_db()
+                cursor = db.projects.find(
+                    {
+                        "git.repo_url": {"$nin": [None, ""]},
+                        "git.cloned_at": {"$exists": True},
+                        "status": {"$ne": "deleting"},
+                    },
+                    {"git": 1},
+                )
+                async for project in cursor:
+                    await enqueue(db, get_redis(), project, "fetch")
+        except Exception:
+            logger.exception("Scheduling git fetches failed")
+        await asyncio.sleep(interval)
+
+
+def project_git(git: dict) -> dict:
+    """A project's ``git`` settings as returned by the API (no credentials)."""
+    shown = {k: v for k, v in git.items() if k != "credentials"}
+    shown["has_credentials"] = bool(git.get("credentials"))
+    return shown
+
@@ -0,0 +1,166 @@
+"""Minimal .gitignore matching.
+
+Supports the parts of the gitignore format that matter for browsing and
+searching a workspace: comments, negation (``!``), directory-only
+patterns (trailing ``/``), anchored patterns (containing ``/``), ``*``,
+``?``, character classes and ``**``. Nested .gitignore files apply to
+their own directory and override their parents, as in git.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Directories skipped by default in tree walks and searches
+DEFAULT_EXCLUDES = frozenset({".git", "node_modules", ".venv", "__pycache__"})
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore glob (without leading/trailing slashes) to a regex."""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i : i + 3] == "**/":
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern[i : i + 2] == "**":
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class IgnoreRules:
+    """Patterns from one .gitignore file, relative to its directory."""
+
+    def __init__(self, lines: list[str]):
+        self._rules: list[tuple[re.Pattern, bool, bool, bool]] = []
+        for raw in lines:
+            line = raw.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            line = line.lstrip("/")
+            regex = re.compile(_translate(line) + r"\Z")
+            self._rules.append((regex, negate, dir_only, anchored))
+
+    def match(self, rel_path: str, is_dir: bool) -> bool | None:
+        """True if ignored, False if re-included, None if no pattern applies."""
+        result = None
+        name = rel_path.rsplit("/", 1)[-1]
+        for regex, negate, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path if anchored else name):
+                result = not negate
+        return result
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+
+_rules_cache: OrderedDict[str, tuple[tuple[int, int], IgnoreRules]] = OrderedDict()
+_rules_lock = threading.Lock()
+_RULES_CACHE_SIZE = 2048
+
+
+def load_rules(path: str) -> IgnoreRules | None:
+    """Load and cache a .gitignore file, keyed by its (mtime, size)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    with _rules_lock:
+        cached = _rules_cache.get(path)
+        if cached and cached[0] == key:
+            _rules_cache.move_to_end(path)
+            return cached[1]
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            rules = IgnoreRules(f.readlines())
+    except OSError:
+        return None
+    with _rules_lock:
+        _rules_cache[path] = (key, rules)
+        while len(_rules_cache) > _RULES_CACHE_SIZE:
+            _rules_cache.popitem(last=False)
+    return rules
+
+
+class IgnoreMatcher:
+    """Decides what a walk skips: default excludes plus stacked .gitignore rules.
+
+    A rule stack is a list of ``(rel_dir, IgnoreRules)`` from the walk root
+    down to the current directory. ``rel_dir`` values are POSIX paths
+    relative to the walk root ("" for the root itself).
+    """
+
+    def __init__(
+        self,
+        root: str,
+        use_gitignore: bool = True,
+        excludes: frozenset[str] = DEFAULT_EXCLUDES,
+    ):
+        self.root = root
+        self.use_gitignore = use_gitignore
+        self.excludes = excludes
+
+    def rules_for(
+        self, parent: list[tuple[str, IgnoreRules]], rel_dir: str
+    ) -> list[tuple[str, IgnoreRules]]:
+        """Extend a parent directory's rule stack with this directory's .gitignore."""
+        if not self.use_gitignore:
+            return parent
+        rules = load_rules(os.path.join(self.root, rel_dir, ".gitignore"))
+        if rules:
+            return [*parent, (rel_dir, rules)]
+        return parent
+
+    def is_ignored(
+        self,
+        stack: list[tuple[str, IgnoreRules]],
+        rel_path: str,
+        is_dir: bool,
+    ) -> bool:
+        if rel_path.rsplit("/", 1)[-1] in self.excludes:
+            return True
+        ignored = False
+        for base, rules in stack:
+            sub = rel_path[len(base) + 1 :] if base else rel_path
+            result = rules.match(sub, is_dir)
+            if result is not None:
+                ignored = result
+        return ignored
@@ -0,0 +1,79 @@
+"""Cross-process cache invalidation over Redis pub/sub.
+
+Every backend process keeps small in-memory caches (global settings,
+decrypted secrets, ...). A change made in one process is announced on a
+Redis channel; every process, including the publisher, drops the affected
+entries. Handlers are registered per scope, e.g. ``"settings"``.
+"""
+
+import asyncio
+import json
+import logging
+from collections.abc import Callable
+
+import redis.asyncio as aioredis
+
+from app.db.redis import get_redis
+
+CHANNEL = "remotifex:invalidate"
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, list[Callable[[str | None], None]]] = {}
+
+
+def register(scope: str, handler: Callable[[str | None], None]) -> None:
+    """Register a handler called with the key (or None for "everything")."""
+    _handlers.setdefault(scope, []).append(handler)
+
+
+def invalidate_local(scope: str, key: str | None = None) -> None:
+    """Invalidate caches for a scope in this process only."""
+    for handler in _handlers.get(scope, []):
+        try:
+            handler(key)
+        except Exception:
+            logger.exception("Invalidation handler failed for scope %s", scope)
+
+
+def invalidate_all_local() -> None:
+    """Drop every registered cache in this process."""
+    for scope in list(_handlers):
+        invalidate_local(scope)
+
+
+async def publish(scope: str, key: str | None = None) -> None:
+    """Invalidate locally, then announce the change to other processes."""
+    invalidate_local(scope, key)
+    try:
+        await get_redis().publish(CHANNEL, json.dumps({"scope": scope, "key": key}))
+    except aioredis.RedisError:
+        logger.warning("Could not publish cache invalidation for %s", scope)
+
+
+async def listen() -> None:
+    """Apply invalidations published by other processes. Runs until cancelled.
+
+    Messages published while the subscription is down are lost, so every
+    (re)connect starts from empty caches.
+    """
+    while True:
+        pubsub = get_redis().pubsub()
+        try:
+            await pubsub.subscribe(CHANNEL)
+            invalidate_all_local()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                invalidate_local(data.get("scope", ""), data.get("key"))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("Invalidation listener disconnected, retrying in 5s")
+            await asyncio.sleep(5)
+        finally:
+            await pubsub.aclose()
@@ -0,0 +1,135 @@
+"""Line-windowed reads of large text files through a sparse line-offset index.
+
+The index records how many newlines precede each fixed-size block of the
+file, so it costs a few KB per hundred MB. Finding the byte offset of a
+line is a binary search over blocks plus a scan of at most one block.
+Indexes are cached by (path, size, mtime) and rebuilt when the file
+changes. Everything here is blocking and meant to run in a worker thread.
+"""
+
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+BLOCK_SIZE = 64 * 1024
+
+_cache: OrderedDict[tuple[str, int, int], "LineIndex"] = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 64
+
+
+class LineIndex:
+    def __init__(self, mm: mmap.mmap, size: int):
+        self.size = size
+        # newlines_before[b] = number of b"\n" in bytes [0, b * BLOCK_SIZE)
+        self.newlines_before = array("Q")
+        count = 0
+        for start in range(0, size, BLOCK_SIZE):
+            self.newlines_before.append(count)
+            count += mm[start : start + BLOCK_SIZE].count(b"\n")
+        self.newlines = count
+        self.ends_with_newline = size > 0 and mm[size - 1 : size] == b"\n"
+
+    @property
+    def total_lines(self) -> int:
+        if self.size == 0:
+            return 0
+        return self.newlines + (0 if self.ends_with_newline else 1)
+
+    def line_offset(self, mm: mmap.mmap, line: int) -> int:
+        """Byte offset where 0-based ``line`` starts (``size`` past the end)."""
+        if line <= 0:
+            return 0
+        if line > self.newlines:
+            return self.size
+        # Last block whose preceding newline count is still below ``line``
+        block = bisect_left(self.newlines_before, line) - 1
+        pos = block * BLOCK_SIZE
+        remaining = line - self.newlines_before[block]
+        while remaining:
+            pos = mm.find(b"\n", pos) + 1
+            remaining -= 1
+        return pos
+
+
+def _get_index(path: str, mm: mmap.mmap, st: os.stat_result) -> LineIndex:
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+
+    index = LineIndex(mm, st.st_size)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def read_lines(
+    path: str,
+    start: int | None,
+    end: int | None,
+    max_lines: int,
+    max_bytes: int,
+) -> dict:
+    """Read lines ``start`` through ``end`` (1-based, inclusive).
+
+    A negative ``start`` counts from the end of the file (``-100`` is the
+    last 100 lines). The window is clipped to ``max_lines`` lines and to
+    ``max_bytes`` bytes (stopping at a line boundary when possible).
+    Returns ``{"content", "start_line", "end_line", "total_lines", "size"}``.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            return {
+                "content": "",
+                "start_line": 0,
+                "end_line": 0,
+                "total_lines": 0,
+                "size": 0,
+            }
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            index = _get_index(path, mm, st)
+            total = index.total_lines
+
+            if start is None:
+                start = 1
+            elif start < 0:
+                start = max(1, total + start + 1)
+            start = max(1, start)
+            last = total if end is None else min(end, total)
+            last = min(last, start + max_lines - 1)
+
+            if start > total or last < start:
+                return {
+                    "content": "",
+                    "start_line": start,
+                    "end_line": start - 1,
+                    "total_lines": total,
+                    "size": st.st_size,
+                }
+
+            begin = index.line_offset(mm, start - 1)
+            stop = index.line_offset(mm, last)
+            if stop - begin > max_bytes:
+                cut = mm.rfind(b"\n", begin, begin + max_bytes)
+                stop = cut + 1 if cut != -1 else begin + max_bytes
+                last = start + mm[begin:stop].count(b"\n") - 1
+                last = max(last, start)
+
+            content = mm[begin:stop].decode("utf-8", errors="replace")
+
+    return {
+        "content": content,
+        "start_line": start,
+        "end_line": last,
+        "total_lines": total,
+        "size": st.st_size,
+    }
@@ -0,0 +1,147 @@
+"""Apply unified diffs and line-range edits to text.
+
+Both operate on lines that keep their terminators, so line endings
+(including a missing final newline) survive untouched outside the edited
+regions.
+"""
+
+import re
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_LINE = re.compile(r"[^\n]*\n|[^\n]+$")
+
+# How far (in lines) a hunk may have drifted from its stated position
+_MAX_OFFSET = 1000
+
+
+class PatchError(ValueError):
+    """The patch is malformed or does not apply to the current content."""
+
+
+def split_lines(text: str) -> list[str]:
+    """Split text into lines, each keeping its ``\\n`` (the last may lack one)."""
+    return _LINE.findall(text)
+
+
+def _parse_hunks(diff: str) -> list[tuple[int, list[str], list[str]]]:
+    """Parse ``(old_start, old_lines, new_lines)`` hunks from a unified diff.
+
+    Each hunk takes exactly the number of lines its header announces (one
+    when a count is omitted); anything after that up to the next header,
+    such as the next file's headers or trailing blank lines, is ignored.
+    """
+    hunks = []
+    old: list[str] = []
+    new: list[str] = []
+    old_left = new_left = 0
+    last_tag = ""
+    for raw in split_lines(diff):
+        header = _HUNK_HEADER.match(raw)
+        if header:
+            old, new = [], []
+            old_left = int(header.group(2) or 1)
+            new_left = int(header.group(4) or 1)
+            hunks.append((int(header.group(1)), old, new))
+            last_tag = ""
+            continue
+        if raw.startswith("\\"):
+            # "\ No newline at end of file" applies to the previous line
+            if last_tag in (" ", "-"):
+                old[-1] = old[-1].removesuffix("\n")
+            if last_tag in (" ", "+"):
+                new[-1] = new[-1].removesuffix("\n")
+            last_tag = ""
+            continue
+        if not old_left and not new_left:
+            # File headers ("---", "+++", "diff", "index"), preamble, or
+            # whatever follows a complete hunk
+            last_tag = ""
+            continue
+        # Some tools strip the space from blank context lines
+        tag, line = (" ", "\n") if raw == "\n" else (raw[:1], raw[1:])
+        if not line.endswith("\n"):
+            line += "\n"
+        if tag == " " and old_left and new_left:
+            old.append(line)
+            new.append(line)
+            old_left -= 1
+            new_left -= 1
+        elif tag == "-" and old_left:
+            old.append(line)
+            old_left -= 1
+        elif tag == "+" and new_left:
+            new.append(line)
+            new_left -= 1
+        else:
+            raise PatchError(f"Hunk {len(hunks)} does not match its line counts")
+        last_tag = tag
+    if not hunks:
+        raise PatchError("No hunks found in diff")
+    if old_left or new_left:
+        raise PatchError(f"Hunk {len(hunks)} is truncated")
+    return hunks
+
+
+def _find(lines: list[str], block: list[str], expected: int, lower: int) -> int:
+    """Position of ``block`` in ``lines`` nearest to ``expected``, at or after ``lower``."""
+    size = len(block)
+    for delta in range(_MAX_OFFSET + 1):
+        for pos in (expected - delta, expected + delta) if delta else (expected,):
+            if lower <= pos <= len(lines) - size and lines[pos : pos + size] == block:
+                return pos
+    return -1
+
+
+def apply_unified_diff(text: str, diff: str) -> str:
+    """Apply a unified diff (single file) to ``text``.
+
+    Hunks are matched exactly, but may have moved by up to a thousand lines
+    from the position in their header. Raises PatchError if any hunk does
+    not apply.
+    """
+    lines = split_lines(text)
+    out: list[str] = []
+    cursor = 0
+    offset = 0  # drift found for earlier hunks applies to later ones too
+    for number, (old_start, old, new) in enumerate(_parse_hunks(diff), 1):
+        # An empty old side means "insert after line old_start"
+        expected = (old_start if not old else max(old_start - 1, 0)) + offset
+        pos = _find(lines, old, max(expected, cursor), cursor)
+        if pos == -1:
+            raise PatchError(f"Hunk {number} does not apply")
+        offset += pos - expected
+        out.extend(lines[cursor:pos])
+        out.extend(new)
+        cursor = pos + len(old)
+    out.extend(lines[cursor:])
+    return "".join(out)
+
+
+def apply_range_edits(text: str, edits: list[tuple[int, int, str]]) -> str:
+    """Replace line ranges in ``text``.
+
+    Each edit is ``(start, end, content)`` with 1-based inclusive line
+    numbers as in the original text; ``end = start - 1`` inserts before
+    ``start`` without removing anything. ``content`` replaces the range
+    verbatim, so it should normally end with a newline. Ranges must not
+    overlap. Raises PatchError on invalid ranges.
+    """
+    if not edits:
+        return text
+    lines = split_lines(text)
+    ordered = sorted(edits, key=lambda e: (e[0], e[1]))
+    previous_end = 0
+    for start, end, _ in ordered:
+        if start < 1 or end < start - 1 or end > len(lines):
+            raise PatchError(f"Invalid line range {start}-{end}")
+        if start <= previous_end:
+            raise PatchError(f"Line range {start}-{end} overlaps another edit")
+        previous_end = max(previous_end, end)
+
+    if lines and not lines[-1].endswith("\n") and ordered[-1][0] > len(lines):
+        lines[-1] += "\n"  # appending after a final line without a newline
+
+    # Apply from the bottom so earlier line numbers stay valid
+    for start, end, content in reversed(ordered):
+        lines[start - 1 : end] = [content]
+    return "".join(lines)
@@ -0,0 +1,438 @@
+"""Serve project subdomains from preview containers started on demand.
+
+A project's environments are reachable at ``{slug}.{base_domain}`` (prod)
+and ``{slug}-staging.{base_domain}``. Caddy sends those hosts here and
+:class:`PreviewProxy` forwards each request to the environment's
+container. When none is running, the request asks the worker to start
+one and waits for it. The worker stops containers that nobody has
+requested for a while, so only environments in use take memory; see
+``worker/app/environments.py`` for the Redis keys both sides share. Each
+proxied request records the environment's last access, at most every
+``preview_touch_interval`` seconds per process.
+
+Previews run project code, so they sit on a network of their own that
+the API joins, away from MongoDB and Redis. The worker therefore cannot
+see when a new container starts listening; the first requests wait for
+that here (``env:booting``).
+
+WebSocket connections to previews (dev-server live reload) are refused.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+import redis.asyncio as aioredis
+from bson import ObjectId
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import settings
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.models.environment import ENV_TYPES, create_environment_doc
+from app.utils.cache import TTLCache
+from app.utils.settings_cache import get_global_settings
+
+logger = logging.getLogger(__name__)
+
+QUEUE = "env_requests"  # consumed by the worker
+LAST_ACCESS_KEY = "env:last_access"
+IMAGES_KEY = "env:images"
+
+# Seconds between checks while waiting for a container to start
+_START_POLL = 0.25
+
+# Headers about one connection rather than the request (RFC 9110, 7.6.1)
+_HOP_BY_HOP = frozenset(
+    {
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "proxy-connection",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    }
+)
+
+# Subdomain label -> environment document, or False for unknown labels
+_hosts = TTLCache(maxsize=10_000, ttl=30)
+# Environments whose last access this process recorded recently
+_touched = TTLCache(maxsize=10_000, ttl=settings.preview_touch_interval)
+
+_client: httpx.AsyncClient | None = None
+
+
+def env_key(project_id: str, env_type: str) -> str:
+    return f"{project_id}:{env_type}"
+
+
+def container_config(env: dict) -> dict:
+    """Image, command, port and idle timeout of an environment's container."""
+    return {
+        "image": env.get("image") or settings.preview_image,
+        "command": env.get("command") or settings.preview_command,
+        "port": env.get("port") or settings.preview_port,
+        "idle_timeout": env.get("idle_timeout") or None,
+    }
+
+
+def preview_url(settings_doc: dict | None, domain: str | None) -> str | None:
+    """Public URL of an environment, once a base domain is configured."""
+    base_domain = ((settings_doc or {}).get("domain") or {}).get("base_domain")
+    if not base_domain or not domain:
+        return None
+    # Caddy gets certificates for the subdomains when an email is configured
+    tls = bool(((settings_doc or {}).get("domain") or {}).get("ssl_email"))
+    port = ((settings_doc or {}).get("access") or {}).get("port", 80)
+    url = f"{'https' if tls else 'http'}://{domain}.{base_domain}"
+    if port not in (80, 443):
+        url += f":{port}"
+    return url
+
+
+async def ensure_environments(db: AsyncIOMotorDatabase, project: dict) -> list[dict]:
+    """A project's environment documents (staging, prod), created if missing.
+
+    An environment whose subdomain another project already has (``foo``'s
+    staging and a project called ``foo-staging``) gets none.
+    """
+    project_id = str(project["_id"])
+    envs = []
+    for env_type in ENV_TYPES:
+        doc = create_environment_doc(project_id, env_type, project["slug"])
+        query = {"project_id": project_id, "type": env_type}
+        try:
+            env = await db.environments.find_one_and_update(
+                query,
+                {"$setOnInsert": doc},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            del doc["domain"]
+            env = await db.environments.find_one_and_update(
+                query,
+                {"$setOnInsert": doc},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        envs.append(env)
+    return envs
+
+
+async def resolve(db: AsyncIOMotorDatabase, label: str) -> dict | None:
+    """The environment served at a subdomain label, if any."""
+    cached = _hosts.get(label)
+    if cached is not None:
+        return cached or None
+
+    env = await db.environments.find_one({"domain": label})
+    if env is None:
+        # Projects created before environments were recorded
+        slug, env_type = label, "prod"
+        if label.endswith("-staging"):
+            slug, env_type = label[: -len("-staging")], "staging"
+        project = await db.projects.find_one(
+            {"slug": slug, "status": {"$ne": "deleting"}}, {"slug": 1}
+        )
+        if project is not None:
+            for candidate in await ensure_environments(db, project):
+                if candidate["type"] == env_type and candidate.get("domain") == label:
+                    env = candidate
+    else:
+        project = await db.projects.find_one(
+            {"_id": ObjectId(env["project_id"]), "status": {"$ne": "deleting"}},
+            {"_id": 1},
+        )
+        if project is None:
+            env = None
+    _hosts.set(label, env or False)
+    return env
+
+
+async def register_image(redis: aioredis.Redis, image: str) -> None:
+    """Have the worker keep an image pulled, pulling a new one right away."""
+    if await redis.sadd(IMAGES_KEY, image):
+        await redis.lpush(QUEUE, json.dumps({"action": "prewarm", "image": image}))
+
+
+async def start(redis: aioredis.Redis, env: dict) -> None:
+    """Ask the worker to start an environment's container, once."""
+    key = env_key(env["project_id"], env["type"])
+    if not await redis.set(
+        f"env:starting:{key}", 1, nx=True, ex=settings.preview_start_timeout
+    ):
+        return  # already asked
+    # Subdomain lookups are cached; settings may have changed since
+    env = await get_db().environments.find_one({"_id": env["_id"]}) or env
+    config = container_config(env)
+    await register_image(redis, config["image"])
+    await redis.delete(f"env:error:{key}")
+    request = {
+        "action": "start",
+        "key": key,
+        "project_id": env["project_id"],
+        "env": env["type"],
+        **config,
+    }
+    await redis.lpush(QUEUE, json.dumps(request))
+
+
+async def stop(
+    redis: aioredis.Redis, project_id: str, env_type: str, remove: bool = False
+) -> None:
+    """Ask the worker to stop an environment's container (or remove it)."""
+    request = {
+        "action": "remove" if remove else "stop",
+        "key": env_key(project_id, env_type),
+    }
+    await redis.lpush(QUEUE, json.dumps(request))
+
+
+async def _port_open(host: str, port: int) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 2)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def _wait_listening(
+    redis: aioredis.Redis, env: dict, address: str, deadline: float
+) -> None:
+    """Wait until a new container accepts connections.
+
+    The API is the only other member of the preview network, so it checks
+    this for the worker. A container that never listens is stopped.
+    """
+    key = env_key(env["project_id"], env["type"])
+    host, port = address.rsplit(":", 1)
+    while not await _port_open(host, int(port)):
+        if time.monotonic() >= deadline:
+            error = (
+                f"Nothing listens on port {port} after "
+                f"{settings.preview_start_timeout}s; check the start command"
+            )
+            await redis.set(f"env:error:{key}", error, ex=60)
+            await stop(redis, env["project_id"], env["type"])
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"The preview could not start: {error}",
+            )
+        await asyncio.sleep(_START_POLL)
+    await redis.delete(f"env:booting:{key}")
+
+
+async def upstream(redis: aioredis.Redis, env: dict) -> str:
+    """``host:port`` of an environment's container, starting it if needed.
+
+    Raises 502 if the container could not start and 504 if it did not
+    start within ``preview_start_timeout``.
+    """
+    key = env_key(env["project_id"], env["type"])
+    deadline = time.monotonic() + settings.preview_start_timeout
+    address, booting = await redis.mget(f"env:upstream:{key}", f"env:booting:{key}")
+    if address is None:
+        await start(redis, env)
+        while address is None:
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    detail="The preview did not start in time",
+                )
+            await asyncio.sleep(_START_POLL)
+            address, booting, error = await redis.mget(
+                f"env:upstream:{key}", f"env:booting:{key}", f"env:error:{key}"
+            )
+            if address is None and error is not None:
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"The preview could not start: {error.decode()}",
+                )
+    address = address.decode()
+    if booting is not None:
+        await _wait_listening(redis, env, address, deadline)
+    return address
+
+
+async def state(redis: aioredis.Redis, project_id: str, env_type: str) -> dict:
+    """Whether an environment is running, with its last access and error."""
+    key = env_key(project_id, env_type)
+    pipe = redis.pipeline()
+    pipe.get(f"env:upstream:{key}")
+    pipe.exists(f"env:starting:{key}", f"env:booting:{key}")
+    pipe.zscore(LAST_ACCESS_KEY, key)
+    pipe.get(f"env:error:{key}")
+    address, starting, last_access, error = await pipe.execute()
+    if starting:
+        current = "starting"
+    elif address is not None:
+        current = "running"
+    else:
+        current = "stopped"
+    return {
+        "state": current,
+        "last_access": last_access if address is not None else None,
+        "error": error.decode() if error is not None else None,
+    }
+
+
+async def touch(redis: aioredis.Redis, key: str) -> None:
+    """Record an access to a running environment (throttled)."""
+    if _touched.get(key):
+        return
+    _touched.set(key, True)
+    await redis.zadd(LAST_ACCESS_KEY, {key: time.time()}, xx=True)
+
+
+async def prewarm_default_image() -> None:
+    """Have the worker pull the default image before any preview needs it."""
+    try:
+        await register_image(get_redis(), settings.preview_image)
+    except Exception:
+        logger.warning("Could not register the default preview image")
+
+
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.preview_proxy_timeout, connect=5),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+        )
+    return _client
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _forward(request: Request, env: dict) -> Response:
+    redis = get_redis()
+    key = env_key(env["project_id"], env["type"])
+    has_body = (
+        "transfer-encoding" in request.headers
+        or request.headers.get("content-length", "0") != "0"
+    )
+    headers = [
+        (name, value)
+        for name, value in request.headers.raw
+        if name.decode().lower() not in _HOP_BY_HOP
+    ]
+    client_host = request.client.host if request.client else ""
+    headers += [
+        (b"x-forwarded-for", client_host.encode()),
+        (b"x-forwarded-host", request.headers.get("host", "").encode()),
+        (b"x-forwarded-proto", request.url.scheme.encode()),
+    ]
+    target = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+
+    client = _http()
+    response = None
+    # A request without a body is tried again if the container went away
+    for _ in range(1 if has_body else 2):
+        try:
+            address = await upstream(redis, env)
+        except HTTPException as e:
+            return PlainTextResponse(e.detail, status_code=e.status_code)
+        outgoing = client.build_request(
+            request.method,
+            f"http://{address}{target}",
+            headers=headers,
+            content=request.stream() if has_body else None,
+        )
+        try:
+            response = await client.send(outgoing, stream=True)
+            break
+        except httpx.ConnectError:
+            # Forget the dead upstream, so the next request starts it again
+            pipe = redis.pipeline()
+            pipe.delete(f"env:upstream:{key}", f"env:booting:{key}")
+            pipe.zrem(LAST_ACCESS_KEY, key)
+            await pipe.execute()
+        except httpx.TimeoutException:
+            return PlainTextResponse(
+                "The preview did not respond in time", status_code=504
+            )
+        except httpx.HTTPError as e:
+            logger.warning("Proxying to preview %s failed: %s", key, e)
+            break
+    if response is None:
+        return PlainTextResponse("The preview is not responding", status_code=502)
+
+    await touch(redis, key)
+    proxied = StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        background=BackgroundTask(response.aclose),
+    )
+    proxied.raw_headers = [
+        (name, value)
+        for name, value in response.headers.raw
+        if name.decode().lower() not in _HOP_BY_HOP
+    ]
+    return proxied
+
+
+async def _match(host: str) -> tuple[bool, dict | None]:
+    """Whether ``host`` is a project subdomain, and its environment."""
+    host = host.lower().rstrip(".")
+    if ":" in host and not host.endswith("]"):
+        host = host.rsplit(":", 1)[0]
+    db = get_db()
+    doc = await get_global_settings(db) or {}
+    base_domain = ((doc.get("domain") or {}).get("base_domain") or "").lower()
+    access = doc.get("access") or {}
+    remotifex_domain = (access.get("remotifex_domain") or "").lower()
+    if not base_domain or not host.endswith(f".{base_domain}"):
+        return False, None
+    if host == remotifex_domain:
+        return False, None
+    label = host[: -len(base_domain) - 1]
+    if "." in label:
+        return True, None
+    return True, await resolve(db, label)
+
+
+class PreviewProxy:
+    """ASGI middleware serving project subdomains from their containers."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        host = ""
+        for name, value in scope["headers"]:
+            if name == b"host":
+                host = value.decode("latin-1")
+                break
+        is_preview, env = await _match(host)
+        if not is_preview:
+            await self.app(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008})
+        elif env is None:
+            response = PlainTextResponse("No such project", status_code=404)
+            await response(scope, receive, send)
+        else:
+            response = await _forward(Request(scope, receive), env)
+            await response(scope, receive, send)
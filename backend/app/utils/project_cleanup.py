@@ -0,0 +1,262 @@
+"""Background project deletion.
+
+Deleting a project only marks it ``deleting``; a job in one backend process
+(guarded by a Redis lock) then does the slow part. Workers are told to
+cancel the project's tasks (``project_cancel:{id}``) and the job waits
+until none is running, so nothing writes into the tree any more. The
+project directory is then moved aside with a single rename, the moved
+tree is removed in the threadpool while the project's MongoDB data is
+deleted in parallel, and the project document goes last. A job
+interrupted by a crash or restart is picked up again by
+:func:`run_janitor`. Progress is recorded on the project document under
+``deletion``.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import suppress
+
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.db.mongodb import get_db
+from app.db.redis import get_redis
+from app.dependencies import invalidate_project
+from app.utils import checkpoints, disk_usage, file_index, preview
+
+logger = logging.getLogger(__name__)
+
+# Collections holding per-project documents, keyed by "project_id"
+COLLECTIONS = ("environments", "chat_sessions", "chat_messages", "deploys", "tasks")
+
+LOCK_TTL = 60  # seconds; refreshed every LOCK_TTL / 3 by the owner
+
+# Subtrees removed at the same time; leaves threadpool room for requests
+_PARALLEL_REMOVALS = 8
+
+# Seconds between progress updates on the project document
+_PROGRESS_INTERVAL = 1
+
+# Seconds to wait for workers to stop the project's tasks (then retried)
+_TASK_STOP_TIMEOUT = 120
+
+# How often the janitor looks for deletions nobody is working on
+_JANITOR_INTERVAL = 300
+
+_jobs: dict[str, asyncio.Task] = {}
+
+
+def _trash_dir() -> str:
+    return os.path.join(settings.projects_data_dir, ".trash")
+
+
+def _move_to_trash(project_id: str) -> list[str]:
+    """Rename the project directory into the trash.
+
+    Returns every trashed copy of the project, including any left behind
+    by an interrupted job.
+    """
+    trash = _trash_dir()
+    os.makedirs(trash, exist_ok=True)
+    project_dir = os.path.join(settings.projects_data_dir, project_id)
+    try:
+        os.rename(project_dir, os.path.join(trash, f"{project_id}-{uuid.uuid4().hex}"))
+    except FileNotFoundError:
+        pass  # already moved, or never created
+    return [
+        os.path.join(trash, name)
+        for name in os.listdir(trash)
+        if name.startswith(f"{project_id}-")
+    ]
+
+
+def _subtrees(roots: list[str]) -> list[str]:
+    """Entries two levels down, so large trees are removed in parallel."""
+    paths = []
+    for root in roots:
+        for entry in os.scandir(root):
+            if entry.is_dir(follow_symlinks=False):
+                paths.extend(e.path for e in os.scandir(entry.path))
+            else:
+                paths.append(entry.path)
+    return paths
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+
+
+async def _remove_files(project_id: str, progress: dict) -> None:
+    roots = await run_in_threadpool(_move_to_trash, project_id)
+    paths = await run_in_threadpool(_subtrees, roots)
+    progress["entries_total"] = len(paths)
+    limit = asyncio.Semaphore(_PARALLEL_REMOVALS)
+
+    async def remove(path: str) -> None:
+        async with limit:
+            await run_in_threadpool(_remove, path)
+        progress["entries_removed"] += 1
+
+    await asyncio.gather(*(remove(path) for path in paths))
+    # What is left is the (now empty) directory skeleton
+    for root in roots:
+        await run_in_threadpool(shutil.rmtree, root, True)
+
+
+def _cancel_key(project_id: str) -> str:
+    return f"project_cancel:{project_id}"
+
+
+async def _stop_tasks(project_id: str) -> None:
+    """Have workers cancel the project's tasks and wait until none is left.
+
+    Workers watch the cancel key while a task runs, and fail (without
+    touching the workspace) tasks they take for a ``deleting`` project.
+    Tasks a worker has claimed are waited for, unless their worker died.
+    Raises RuntimeError after ``_TASK_STOP_TIMEOUT`` seconds.
+    """
+    await get_redis().set(_cancel_key(project_id), 1, ex=24 * 3600)
+    query = {
+        "project_id": project_id,
+        "$or": [
+            {"status": "running"},
+            {"status": "queued", "worker_id": {"$ne": None}},
+        ],
+    }
+    deadline = time.monotonic() + _TASK_STOP_TIMEOUT
+    while True:
+        active = 0
+        async for task in get_db().tasks.find(query, {"status": 1, "worker_id": 1}):
+            if not await checkpoints.task_orphaned(task):
+                active += 1
+        if not active:
+            return
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"{active} task(s) of the project are still running")
+        await asyncio.sleep(1)
+
+
+async def _remove_documents(project_id: str, progress: dict) -> None:
+    db = get_db()
+
+    async def remove(name: str) -> None:
+        await db[name].delete_many({"project_id": project_id})
+        progress["collections_done"] += 1
+
+    await asyncio.gather(*(remove(name) for name in COLLECTIONS))
+
+
+async def _delete(project_id: str) -> None:
+    db = get_db()
+    project_filter = {"_id": ObjectId(project_id), "status": "deleting"}
+    progress = {
+        "entries_total": None,
+        "entries_removed": 0,
+        "collections_total": len(COLLECTIONS),
+        "collections_done": 0,
+    }
+
+    async def report() -> None:
+        await db.projects.update_one(
+            project_filter, {"$set": {"deletion.progress": progress}}
+        )
+
+    done = asyncio.Event()
+
+    async def report_periodically() -> None:
+        while not done.is_set():
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(done.wait(), _PROGRESS_INTERVAL)
+            await report()
+
+    for env in ("staging", "prod"):
+        file_index.drop(os.path.join(settings.projects_data_dir, project_id, env))
+    for env in ("staging", "prod"):
+        await preview.stop(get_redis(), project_id, env, remove=True)
+    await _stop_tasks(project_id)
+    disk_usage.forget(project_id)
+    await get_redis().srem(disk_usage.DIRTY_KEY, project_id)
+
+    reporter = asyncio.create_task(report_periodically())
+    try:
+        await asyncio.gather(
+            _remove_files(project_id, progress),
+            _remove_documents(project_id, progress),
+        )
+    finally:
+        done.set()
+        await reporter
+
+    await db.projects.delete_one(project_filter)
+    await get_redis().delete(_cancel_key(project_id))
+    await invalidate_project(project_id)
+    logger.info(
+        "Deleted project %s (%d entries removed)",
+        project_id,
+        progress["entries_removed"],
+    )
+
+
+async def _keep_lock(key: str, token: str) -> None:
+    redis = get_redis()
+    while True:
+        await asyncio.sleep(LOCK_TTL / 3)
+        owner = await redis.get(key)
+        if owner is None or owner.decode() != token:
+            return
+        await redis.expire(key, LOCK_TTL)
+
+
+async def _run(project_id: str) -> None:
+    redis = get_redis()
+    key = f"project_delete:{project_id}"
+    token = uuid.uuid4().hex
+    if not await redis.set(key, token, nx=True, ex=LOCK_TTL):
+        return  # another process is deleting it
+    keeper = asyncio.create_task(_keep_lock(key, token))
+    try:
+        await _delete(project_id)
+    except Exception as e:
+        logger.exception("Deleting project %s failed; will retry", project_id)
+        await get_db().projects.update_one(
+            {"_id": ObjectId(project_id), "status": "deleting"},
+            {"$set": {"deletion.error": str(e)}},
+        )
+    finally:
+        keeper.cancel()
+        with suppress(asyncio.CancelledError):
+            await keeper
+        owner = await redis.get(key)
+        if owner is not None and owner.decode() == token:
+            await redis.delete(key)
+
+
+def start(project_id: str) -> None:
+    """Run the deletion of a ``deleting`` project in the background."""
+    if project_id in _jobs:
+        return
+    job = asyncio.create_task(_run(project_id))
+    _jobs[project_id] = job
+    job.add_done_callback(lambda _: _jobs.pop(project_id, None))
+
+
+async def run_janitor() -> None:
+    """Resume deletions left unfinished by crashed or restarted processes."""
+    while True:
+        try:
+            cursor = get_db().projects.find({"status": "deleting"}, {"_id": 1})
+            async for doc in cursor:
+                start(str(doc["_id"]))
+        except Exception:
+            logger.exception("Could not look for unfinished project deletions")
+        await asyncio.sleep(_JANITOR_INTERVAL)
+
@@ -0,0 +1,111 @@
+"""Fixed-window rate limiting backed by Redis counters."""
+
+import ipaddress
+import logging
+import socket
+import time
+
+import redis.asyncio as aioredis
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds before trusted proxy hostnames are resolved again
+_PROXY_RESOLVE_INTERVAL = 60
+
+_Network = ipaddress.IPv4Network | ipaddress.IPv6Network
+_proxies: tuple[float, list[_Network]] = (0.0, [])
+
+
+def _resolve_proxies() -> list[_Network]:
+    networks = []
+    for entry in settings.trusted_proxies.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+            continue
+        except ValueError:
+            pass
+        try:
+            infos = socket.getaddrinfo(entry, None)
+        except OSError:
+            continue  # e.g. the proxy container is not running
+        for info in infos:
+            networks.append(ipaddress.ip_network(info[4][0]))
+    return networks
+
+
+async def _trusted_proxies() -> list[_Network]:
+    global _proxies
+    resolved_at, networks = _proxies
+    if time.monotonic() - resolved_at >= _PROXY_RESOLVE_INTERVAL:
+        networks = await run_in_threadpool(_resolve_proxies)
+        _proxies = (time.monotonic(), networks)
+    return networks
+
+
+def _is_trusted(address: str, proxies: list[_Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+async def client_ip(request: Request) -> str:
+    """Address of the client: the peer, unless it is a trusted proxy.
+
+    Only a peer listed in ``trusted_proxies`` may vouch for a client in
+    X-Forwarded-For, and only the right-most address no trusted proxy
+    added is used, since anything further left is client-supplied.
+    """
+    peer = request.client.host if request.client else "unknown"
+    proxies = await _trusted_proxies()
+    if not _is_trusted(peer, proxies):
+        return peer
+    hops = [
+        hop.strip()
+        for header in request.headers.getlist("x-forwarded-for")
+        for hop in header.split(",")
+        if hop.strip()
+    ]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, proxies):
+            return hop
+    return hops[0] if hops else peer
+
+
+async def hit(redis: aioredis.Redis, key: str, limit: int, window: int) -> None:
+    """Count one attempt against ``key``; raise 429 once ``limit`` is exceeded.
+
+    Fails open (allows the attempt) if Redis is unavailable.
+    """
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, window, nx=True)
+            pipe.ttl(key)
+            count, _, ttl = await pipe.execute()
+    except aioredis.RedisError:
+        logger.warning("Rate limiter unavailable, allowing request for %s", key)
+        return
+
+    if count > limit:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, try again later",
+            headers={"Retry-After": str(max(ttl, 1))},
+        )
+
+
+async def reset(redis: aioredis.Redis, key: str) -> None:
+    """Clear the counter for ``key`` (e.g. after a successful login)."""
+    try:
+        await redis.delete(key)
+    except aioredis.RedisError:
+        pass
@@ -1,7 +1,10 @@
 """Security utilities: JWT tokens, password hashing, and encryption."""
 
+import asyncio
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
 import bcrypt
 from cryptography.fernet import Fernet
@@ -10,8 +13,9 @@ from jose import JWTError, jwt
 from app.config import settings
 
 
+@lru_cache(maxsize=1)
 def _get_fernet() -> Fernet:
-    """Get Fernet instance for symmetric encryption."""
+    """Get the (process-wide) Fernet instance for symmetric encryption."""
     # Derive a valid 32-byte key from the encryption_key setting
     key = settings.encryption_key.encode()
     # Pad or truncate to 32 bytes, then base64 encode for Fernet
@@ -19,9 +23,17 @@ def _get_fernet() -> Fernet:
     return Fernet(base64.urlsafe_b64encode(key))
 
 
+# bcrypt is deliberately slow (~250 ms at the default cost); run it on a
+# small dedicated pool so it never blocks the event loop.
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.password_hash_workers, thread_name_prefix="bcrypt"
+)
+
+
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt."""
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    """Hash a password using bcrypt at the configured cost factor."""
+    salt = bcrypt.gensalt(rounds=settings.bcrypt_rounds)
+    return bcrypt.hashpw(password.encode(), salt).decode()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -29,6 +41,30 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Whether a hash was made with a different cost factor than configured."""
+    # Format: $2b$<rounds>$<salt+hash>
+    try:
+        rounds = int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != settings.bcrypt_rounds
+
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password on the bcrypt thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the bcrypt thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _hash_executor, verify_password, plain_password, hashed_password
+    )
+
+
 def create_access_token(user_id: str) -> str:
     """Create a JWT access token."""
     expire = datetime.now(timezone.utc) + timedelta(
@@ -38,17 +74,22 @@ def create_access_token(user_id: str) -> str:
     return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 
-def decode_access_token(token: str) -> str | None:
-    """Decode a JWT token and return the user_id, or None if invalid."""
+def decode_access_token_claims(token: str) -> dict | None:
+    """Decode and verify a JWT token, returning its claims or None if invalid."""
     try:
-        payload = jwt.decode(
+        return jwt.decode(
             token, settings.jwt_secret, algorithms=[settings.jwt_algorithm]
         )
-        return payload.get("sub")
     except JWTError:
         return None
 
 
+def decode_access_token(token: str) -> str | None:
+    """Decode a JWT token and return the user_id, or None if invalid."""
+    claims = decode_access_token_claims(token)
+    return claims.get("sub") if claims else None
+
+
 def encrypt_value(value: str) -> str:
     """Encrypt a string value for storage."""
     f = _get_fernet()
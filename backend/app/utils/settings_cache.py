@@ -0,0 +1,73 @@
+"""In-process cache of the global settings document and decrypted secrets.
+
+Entries are dropped whenever a settings change is published on the
+invalidation channel (see ``app.utils.invalidation``). A TTL bounds how
+long a process can serve stale values if an invalidation is ever missed.
+"""
+
+import time
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.utils import invalidation
+from app.utils.security import decrypt_value
+
+SCOPE = "settings"
+
+# Upper bound on staleness if an invalidation message is lost
+_TTL_SECONDS = 300
+
+_doc: dict | None = None
+_loaded_at = 0.0
+_secrets: dict[str, str] = {}  # ciphertext -> plaintext
+# Bumped on every invalidation so a load racing with a change is not cached
+_generation = 0
+
+
+def invalidate(_key: str | None = None) -> None:
+    """Drop the cached settings document and decrypted secrets."""
+    global _doc, _loaded_at, _generation
+    _doc = None
+    _loaded_at = 0.0
+    _generation += 1
+    _secrets.clear()
+
+
+invalidation.register(SCOPE, invalidate)
+
+
+async def get_global_settings(db: AsyncIOMotorDatabase) -> dict | None:
+    """Return the global settings document, served from cache when fresh.
+
+    The returned dict is shared; callers must not mutate it.
+    """
+    global _doc, _loaded_at
+    if _doc is not None and time.monotonic() - _loaded_at < _TTL_SECONDS:
+        return _doc
+
+    generation = _generation
+    doc = await db.settings.find_one({"type": "global"})
+    if doc is not None and generation == _generation:
+        _doc = doc
+        _loaded_at = time.monotonic()
+        _secrets.clear()
+    return doc
+
+
+async def get_secret(db: AsyncIOMotorDatabase, section: str, field: str) -> str | None:
+    """Return a decrypted secret from the global settings, e.g. ("ai", "claude_api_key_encrypted")."""
+    doc = await get_global_settings(db)
+    encrypted = (doc or {}).get(section, {}).get(field)
+    if not encrypted:
+        return None
+
+    value = _secrets.get(encrypted)
+    if value is None:
+        value = decrypt_value(encrypted)
+        _secrets[encrypted] = value
+    return value
+
+
+async def publish_change() -> None:
+    """Invalidate the settings cache in every backend process."""
+    await invalidation.publish(SCOPE)
@@ -0,0 +1,153 @@
+"""Full-text search over chat messages backed by MongoDB's text index."""
+
+import re
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.schemas.chat import ChatSearchHit, ChatSearchResponse
+
+# Suffixes stripped when highlighting, so "fixed" also marks "fixes", "fixing"
+# (MongoDB's text index stems terms the same way when matching).
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+_WORD_RE = re.compile(r"[\w.-]+")
+
+
+def query_terms(query: str) -> list[str]:
+    """Split a search query into phrases and words (negated terms excluded)."""
+    phrases = [p.strip() for p in _PHRASE_RE.findall(query) if p.strip()]
+    rest = _PHRASE_RE.sub(" ", query)
+    words = []
+    for token in rest.split():
+        if not token.startswith("-"):
+            words.extend(_WORD_RE.findall(token))
+    return phrases + words
+
+
+def _term_pattern(term: str) -> str:
+    """Build a regex fragment matching a term and its simple inflections."""
+    if " " in term:
+        return re.escape(term)
+    stem = term
+    for suffix in _SUFFIXES:
+        if stem.lower().endswith(suffix) and len(stem) - len(suffix) >= 3:
+            stem = stem[: -len(suffix)]
+            break
+    return rf"\b{re.escape(stem)}\w*"
+
+
+def build_snippets(
+    content: str,
+    terms: list[str],
+    max_snippets: int = 3,
+    context: int = 60,
+) -> list[dict]:
+    """Extract highlighted snippets around term matches.
+
+    Each snippet is ``{"text": str, "matches": [[start, end], ...]}`` with
+    match offsets relative to the snippet text, so clients can render the
+    highlights without trusting any markup from the server.
+    """
+    if not terms:
+        return [{"text": content[: context * 2], "matches": []}]
+
+    pattern = re.compile(
+        "|".join(_term_pattern(t) for t in sorted(terms, key=len, reverse=True)),
+        re.IGNORECASE,
+    )
+    matches = [m.span() for m in pattern.finditer(content)]
+    if not matches:
+        return [{"text": content[: context * 2], "matches": []}]
+
+    # Group matches into windows of surrounding context
+    windows: list[list[tuple[int, int]]] = []
+    for span in matches:
+        if (
+            windows
+            and span[0] - windows[-1][-1][1] <= context
+            and span[1] - windows[-1][0][0] <= context * 4
+        ):
+            windows[-1].append(span)
+        else:
+            if len(windows) == max_snippets:
+                break
+            windows.append([span])
+
+    snippets = []
+    for spans in windows:
+        start = max(0, spans[0][0] - context)
+        end = min(len(content), spans[-1][1] + context)
+        snippets.append(
+            {
+                "text": content[start:end],
+                "matches": [[s - start, e - start] for s, e in spans],
+            }
+        )
+    return snippets
+
+
+async def search_messages(
+    db: AsyncIOMotorDatabase,
+    query: str,
+    project_ids: list[str],
+    page: int = 1,
+    page_size: int = 20,
+) -> ChatSearchResponse:
+    """Run a ranked, paginated text search over chat messages in the given projects."""
+    response = ChatSearchResponse(
+        query=query, page=page, page_size=page_size, has_more=False, results=[]
+    )
+    if not project_ids:
+        return response
+
+    flt: dict = {"$text": {"$search": query}}
+    if len(project_ids) == 1:
+        flt["project_id"] = project_ids[0]
+    else:
+        flt["project_id"] = {"$in": project_ids}
+
+    projection = {
+        "session_id": 1,
+        "project_id": 1,
+        "role": 1,
+        "content": 1,
+        "created_at": 1,
+        "score": {"$meta": "textScore"},
+    }
+    cursor = (
+        db.chat_messages.find(flt, projection)
+        .sort([("score", {"$meta": "textScore"}), ("created_at", -1)])
+        .skip((page - 1) * page_size)
+        .limit(page_size + 1)
+    )
+    hits = await cursor.to_list(length=page_size + 1)
+    has_more = len(hits) > page_size
+    hits = hits[:page_size]
+
+    # Resolve session titles for the page in a single query
+    session_ids = {h["session_id"] for h in hits if ObjectId.is_valid(h["session_id"])}
+    titles = {}
+    if session_ids:
+        async for s in db.chat_sessions.find(
+            {"_id": {"$in": [ObjectId(sid) for sid in session_ids]}}, {"title": 1}
+        ):
+            titles[str(s["_id"])] = s.get("title", "")
+
+    terms = query_terms(query)
+    response.has_more = has_more
+    response.results = [
+        ChatSearchHit(
+            id=str(hit["_id"]),
+            session_id=hit["session_id"],
+            session_title=titles.get(hit["session_id"], ""),
+            project_id=hit["project_id"],
+            role=hit["role"],
+            score=hit["score"],
+            snippets=build_snippets(hit.get("content", ""), terms),
+            created_at=hit["created_at"],
+        )
+        for hit in hits
+    ]
+    return response
@@ -0,0 +1,103 @@
+"""Compare two environments through their Merkle-hashed file indexes.
+
+Each directory's hash covers the names, types and contents of everything
+below it, so identical subtrees are skipped after a single comparison and
+the walk only descends where the hashes differ. With warm hash caches,
+comparing two large, mostly identical trees touches a handful of
+directories. Everything here is blocking and meant to run in a worker
+thread.
+"""
+
+import difflib
+
+from app.utils.file_index import FileIndex
+from app.utils.patch import split_lines
+
+# Largest file (per side) diffed line by line
+MAX_DIFF_SIZE = 2 * 1024 * 1024
+
+
+def compare(base: FileIndex, target: FileIndex) -> dict:
+    """Files added, removed and modified going from ``base`` to ``target``.
+
+    Paths are POSIX paths relative to the environment roots, sorted.
+    Directories a truncated index left out are not compared; callers must
+    check ``FileIndex.truncated``.
+    """
+    added: list[str] = []
+    removed: list[str] = []
+    modified: list[str] = []
+
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        if base.digest(rel_dir) == target.digest(rel_dir):
+            continue
+        old = base.hashed_entries(rel_dir)
+        new = target.hashed_entries(rel_dir)
+        for name in old.keys() | new.keys():
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            before, after = old.get(name), new.get(name)
+            if before == after:
+                continue
+            if before and after and before[0] and after[0]:
+                pending.append(rel_path)
+            elif before and after and not before[0] and not after[0]:
+                modified.append(rel_path)
+            else:
+                # Missing on one side, or a file replaced by a directory
+                for entry, paths, index in (
+                    (before, removed, base),
+                    (after, added, target),
+                ):
+                    if entry is None:
+                        continue
+                    if entry[0]:
+                        paths.extend(index.files_under(rel_path))
+                    else:
+                        paths.append(rel_path)
+
+    return {
+        "added": sorted(added),
+        "removed": sorted(removed),
+        "modified": sorted(modified),
+    }
+
+
+def unified_diff(
+    base_path: str | None,
+    target_path: str | None,
+    base_label: str,
+    target_label: str,
+    context: int = 3,
+) -> str:
+    """Unified diff between two text files (None or missing means empty).
+
+    Raises ValueError if either side is too large or not UTF-8 text.
+    """
+    sides = []
+    for path in (base_path, target_path):
+        if path is None:
+            sides.append([])
+            continue
+        try:
+            with open(path, "rb") as f:
+                data = f.read(MAX_DIFF_SIZE + 1)
+        except (FileNotFoundError, NotADirectoryError):
+            sides.append([])
+            continue
+        if len(data) > MAX_DIFF_SIZE:
+            raise ValueError("File too large to diff")
+        try:
+            sides.append(split_lines(data.decode("utf-8")))
+        except UnicodeDecodeError:
+            raise ValueError("Binary files cannot be diffed")
+
+    lines = difflib.unified_diff(
+        sides[0], sides[1], base_label, target_label, n=context
+    )
+    # Mark missing final newlines the way diff(1) does
+    return "".join(
+        line if line.endswith("\n") else line + "\n\\ No newline at end of file\n"
+        for line in lines
+    )
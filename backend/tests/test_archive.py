@@ -0,0 +1,79 @@
+import io
+
+import pytest
+
+from app.utils.archive import CHUNK_SIZE, ArchiveError, Importer, extract_multipart
+
+BOUNDARY = "----boundary1234"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def _body(*parts: tuple[str, str | None, bytes]) -> bytes:
+    out = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        out += (
+            f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        out += data + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def importer(tmp_path):
+    return Importer(str(tmp_path), "up", max_files=10, max_bytes=10 * CHUNK_SIZE)
+
+
+def test_files_are_written_while_the_body_streams(tmp_path):
+    big = bytes(range(256)) * (3 * CHUNK_SIZE // 256)
+    body = _body(
+        ("files", "big.bin", big),
+        ("note", None, b"ignored"),
+        ("files", "dir/small.txt", b"small"),
+        ("files", "", b""),
+        ("files", "last.bin", big),
+    )
+    reader = io.BytesIO(body)
+    # How much of the body had been read as each file was completed
+    positions = []
+    importer = Importer(
+        str(tmp_path),
+        "up",
+        max_files=10,
+        max_bytes=10 * CHUNK_SIZE,
+        on_file=lambda old, new: positions.append(reader.tell()),
+    )
+
+    extract_multipart(reader, CONTENT_TYPE, importer)
+
+    assert (tmp_path / "up" / "big.bin").read_bytes() == big
+    assert (tmp_path / "up" / "dir" / "small.txt").read_bytes() == b"small"
+    assert (tmp_path / "up" / "last.bin").read_bytes() == big
+    assert importer.result()["files"] == 3
+    # Each file was complete one chunk after its data, not at the end
+    assert positions[0] <= len(big) + CHUNK_SIZE < len(body)
+    assert positions[0] <= positions[1] < positions[2] == len(body)
+
+
+def test_truncated_body(importer):
+    body = _body(("files", "a.txt", b"a" * 100))[:-30]
+
+    with pytest.raises(ArchiveError, match="truncated"):
+        extract_multipart(io.BytesIO(body), CONTENT_TYPE, importer)
+
+
+def test_requires_multipart_boundary(importer):
+    with pytest.raises(ArchiveError):
+        extract_multipart(io.BytesIO(b""), "multipart/form-data", importer)
+    with pytest.raises(ArchiveError):
+        extract_multipart(io.BytesIO(b""), "application/json", importer)
+
+
+def test_too_many_fields(importer):
+    body = _body(*[(f"f{i}", None, b"x") for i in range(101)])
+
+    with pytest.raises(ArchiveError, match="Too many fields"):
+        extract_multipart(io.BytesIO(body), CONTENT_TYPE, importer)
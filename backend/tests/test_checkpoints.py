@@ -0,0 +1,37 @@
+import subprocess
+
+import pytest
+
+from app.config import settings
+from app.utils import checkpoints
+
+
+@pytest.fixture
+def staging(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "projects_data_dir", str(tmp_path))
+    subprocess.run(
+        ["git", "init", "-q", "--bare", str(tmp_path / "p1" / ".checkpoints.git")],
+        check=True,
+    )
+    path = tmp_path / "p1" / "staging"
+    path.mkdir()
+    return path
+
+
+def test_snapshot_workspace_skips_nested_empty_repository(staging):
+    (staging / "a.txt").write_text("a")
+    nested = staging / "sub"
+    nested.mkdir()
+    subprocess.run(["git", "init", "-q", str(nested)], check=True)
+
+    tree = checkpoints.snapshot_workspace("p1")
+
+    files = checkpoints._git("p1", "ls-tree", "-r", "--name-only", tree)
+    assert files.decode().splitlines() == ["a.txt"]
+
+
+def test_snapshot_workspace_without_repository(staging, tmp_path):
+    (tmp_path / "p1" / ".checkpoints.git").rename(tmp_path / "p1" / "moved.git")
+
+    with pytest.raises(checkpoints.CheckpointError):
+        checkpoints.snapshot_workspace("p1")
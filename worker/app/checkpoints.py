@@ -0,0 +1,209 @@
+"""Workspace checkpoints taken around each AI task.
+
+Checkpoints are git commits in a repository kept next to the workspace
+(``{project}/.checkpoints.git``), separate from any repository the project
+itself has, under ``refs/remotifex/checkpoints/{task_id}/before|after``.
+Git's index caches file stats, so a snapshot re-hashes only the files that
+changed since the previous one, and unchanged content is stored once.
+Gitignored files and dependency directories are not checkpointed.
+
+Projects with isolated sessions give each chat session a git worktree of
+this repository (``{project}/.sessions/{session_id}``, on branch
+``sessions/{session_id}``) that starts from a snapshot of ``staging`` and
+shares its object store; the session's task checkpoints are commits on
+that branch.
+
+The backend reads the same refs to show and roll back a task's changes,
+and merges session branches back into ``staging``.
+"""
+
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger("remotifex.worker.checkpoints")
+
+PROJECTS_DATA_DIR = os.environ.get("PROJECTS_DATA_DIR", "/data/projects")
+
+# Number of most recent tasks whose checkpoints are kept
+CHECKPOINT_KEEP = int(os.environ.get("CHECKPOINT_KEEP", "200"))
+
+REF_PREFIX = "refs/remotifex/checkpoints"
+
+# Never checkpointed: large, regenerable dependency trees
+EXCLUDES = ("node_modules/", ".venv/", "__pycache__/")
+
+
+class CheckpointError(Exception):
+    """A git command failed while taking a checkpoint."""
+
+
+def session_dir(project_id: str, session_id: str) -> str:
+    return os.path.join(PROJECTS_DATA_DIR, project_id, ".sessions", session_id)
+
+
+def git_env(project_id: str, session_id: str | None = None) -> dict:
+    """Environment pointing git at ``staging`` or a session worktree.
+
+    The API uses index files of its own, so the two never contend for
+    the same index lock.
+    """
+    project_dir = os.path.join(PROJECTS_DATA_DIR, project_id)
+    git_dir = os.path.join(project_dir, ".checkpoints.git")
+    work_tree = os.path.join(project_dir, "staging")
+    if session_id:
+        git_dir = os.path.join(git_dir, "worktrees", session_id)
+        work_tree = session_dir(project_id, session_id)
+    env = os.environ.copy()
+    env.update(
+        {
+            "GIT_DIR": git_dir,
+            "GIT_WORK_TREE": work_tree,
+            "GIT_INDEX_FILE": os.path.join(git_dir, "index"),
+            "GIT_LITERAL_PATHSPECS": "1",
+            "GIT_AUTHOR_NAME": "Remotifex",
+            "GIT_AUTHOR_EMAIL": "checkpoints@remotifex.local",
+            "GIT_COMMITTER_NAME": "Remotifex",
+            "GIT_COMMITTER_EMAIL": "checkpoints@remotifex.local",
+            "GIT_TERMINAL_PROMPT": "0",
+        }
+    )
+    return env
+
+
+async def _run(
+    env: dict, *args: str, stdin: bytes | None = None
+) -> tuple[int, bytes, bytes]:
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        "-c", "advice.addEmbeddedRepo=false",
+        "-c", "core.autocrlf=false",
+        *args,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=env["GIT_WORK_TREE"],
+        env=env,
+    )
+    out, err = await process.communicate(stdin)
+    return process.returncode, out, err
+
+
+async def _git(env: dict, *args: str, stdin: bytes | None = None) -> str:
+    returncode, out, err = await _run(env, *args, stdin=stdin)
+    if returncode != 0:
+        raise CheckpointError(
+            f"git {args[0]} failed: {err.decode(errors='replace').strip()}"
+        )
+    return out.decode().strip()
+
+
+async def _ensure_repo(env: dict) -> None:
+    git_dir = env["GIT_DIR"]
+    if os.path.isfile(os.path.join(git_dir, "HEAD")):
+        return
+    await _git(env, "init", "-q")
+    for key, value in (
+        ("core.untrackedCache", "true"),
+        ("index.version", "4"),
+        ("gc.auto", "2000"),
+    ):
+        await _git(env, "config", key, value)
+    with open(os.path.join(git_dir, "info", "exclude"), "a") as f:
+        f.write("\n".join(EXCLUDES) + "\n")
+
+
+async def _commit_work_tree(env: dict, message: str, parent: str | None) -> str:
+    returncode, _, err = await _run(env, "add", "--all", "--ignore-errors")
+    # 1: some paths (a nested repository without commits, an unreadable
+    # file) were skipped and everything else was added
+    if returncode not in (0, 1):
+        raise CheckpointError(f"git add failed: {err.decode(errors='replace').strip()}")
+    if returncode == 1:
+        logger.warning(
+            f"Checkpoint of {env['GIT_WORK_TREE']} skipped paths: "
+            f"{err.decode(errors='replace').strip()}"
+        )
+    tree = await _git(env, "write-tree")
+    args = ["commit-tree", tree, "-m", message]
+    if parent:
+        args += ["-p", parent]
+    return await _git(env, *args)
+
+
+async def snapshot(
+    project_id: str,
+    task_id: str,
+    label: str,
+    parent: str | None = None,
+    session_id: str | None = None,
+) -> str:
+    """Commit the current ``staging`` tree as ``{task_id}/{label}``.
+
+    With ``session_id``, the session worktree is committed instead, on top
+    of its branch, which then moves to the new commit. Returns the commit id.
+    """
+    if session_id:
+        env = git_env(project_id, session_id)
+        parent = await _git(env, "rev-parse", "HEAD")
+        commit = await _commit_work_tree(env, f"Task {task_id} ({label})", parent)
+        await _git(env, "update-ref", "HEAD", commit)
+    else:
+        env = git_env(project_id)
+        await _ensure_repo(env)
+        commit = await _commit_work_tree(env, f"Task {task_id} ({label})", parent)
+    await _git(env, "update-ref", f"{REF_PREFIX}/{task_id}/{label}", commit)
+    return commit
+
+
+async def ensure_session(
+    project_id: str, session_id: str, staging_lock: asyncio.Lock
+) -> str:
+    """Create the session's worktree from ``staging`` if needed; return its path.
+
+    The snapshot it starts from is recorded as the session's merge base
+    (``refs/remotifex/sessions/{session_id}/base``). It is taken through
+    staging's git index, so only while holding ``staging_lock`` (staging's
+    workspace lock), never alongside a staging task or sync.
+    """
+    path = session_dir(project_id, session_id)
+    if os.path.isfile(os.path.join(path, ".git")):
+        return path
+    async with staging_lock:
+        env = git_env(project_id)
+        await _ensure_repo(env)
+        base = await _commit_work_tree(env, f"Session {session_id} (base)", None)
+        await _git(
+            env, "update-ref", f"refs/remotifex/sessions/{session_id}/base", base
+        )
+
+    # Checking out into the new worktree must not touch staging's index
+    add_env = {k: v for k, v in env.items() if k != "GIT_INDEX_FILE"}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    branch = f"sessions/{session_id}"
+    await _git(add_env, "worktree", "add", "--quiet", "-B", branch, path, base)
+    return path
+
+
+async def prune(project_id: str) -> None:
+    """Drop checkpoints beyond the newest ``CHECKPOINT_KEEP`` tasks."""
+    env = git_env(project_id)
+    refs = await _git(
+        env,
+        "for-each-ref",
+        "--sort=-committerdate",
+        "--format=%(refname)",
+        f"{REF_PREFIX}/",
+    )
+    tasks: list[str] = []
+    stale: list[str] = []
+    for ref in refs.splitlines():
+        task_id = ref[len(REF_PREFIX) + 1 :].rsplit("/", 1)[0]
+        if task_id not in tasks and len(tasks) < CHECKPOINT_KEEP:
+            tasks.append(task_id)
+        if task_id not in tasks:
+            stale.append(ref)
+    if stale:
+        commands = "".join(f"delete {ref}\n" for ref in stale)
+        await _git(env, "update-ref", "--stdin", stdin=commands.encode())
+    await _git(env, "gc", "--auto", "--quiet")
@@ -4,15 +4,55 @@ import asyncio
 import json
 import logging
 import os
+import socket
+import time
+import uuid
+import weakref
+from contextlib import suppress
 from datetime import datetime, timezone
 
 import redis.asyncio as aioredis
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from app import checkpoints, package_cache
+from app.invalidation import invalidate_project
+
 logger = logging.getLogger("remotifex.worker.claude")
 
 PROJECTS_DATA_DIR = os.environ.get("PROJECTS_DATA_DIR", "/data/projects")
 
+# Seconds between recounts of each project's queued and running tasks
+TASK_STATS_RECONCILE_INTERVAL = int(
+    os.environ.get("TASK_STATS_RECONCILE_INTERVAL", "300")
+)
+
+
+# A worker refreshes its heartbeat key this often; the key expires after
+# WORKER_HEARTBEAT_TTL seconds, after which its tasks count as orphaned
+WORKER_HEARTBEAT_INTERVAL = 15
+WORKER_HEARTBEAT_TTL = int(os.environ.get("WORKER_HEARTBEAT_TTL", "60"))
+
+ACTIVE_TASK_STATUSES = ["queued", "running"]
+
+# Seconds between checks for a cancellation of a running task's project, and
+# for claude to exit after SIGTERM before it is killed
+CANCEL_POLL_INTERVAL = 1
+CANCEL_GRACE = 5
+
+
+def heartbeat_key(worker_id: str) -> str:
+    return f"worker:{worker_id}:alive"
+
+
+def cancel_key(project_id: str) -> str:
+    """Set by the API while it deletes a project."""
+    return f"project_cancel:{project_id}"
+
+
+class TaskCancelled(Exception):
+    """The task's project is being deleted."""
+
 
 class ClaudeRunner:
     """Executes Claude Code tasks and streams results via Redis pub/sub."""
@@ -20,10 +60,236 @@ class ClaudeRunner:
     def __init__(self, redis_url: str, mongodb_url: str):
         self.redis_url = redis_url
         self.mongodb_url = mongodb_url
+        # Unique per process: tasks of a restarted worker are orphaned too
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # One lock per working directory, alive while a task holds or awaits it
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
 
     async def execute(self, task: dict) -> None:
         """Execute a Claude Code task.
 
+        Tasks sharing a working directory (``staging``, or the worktree of an
+        isolated session) run one at a time in the order received; tasks in
+        different directories run concurrently.
+        """
+        isolated_session = task["session_id"] if task.get("isolated") else None
+        await self._claim(task)
+        async with self.workspace_lock(task["project_id"], isolated_session):
+            if not await self._project_exists(task["project_id"]):
+                # Deleted (or being deleted) while the task was queued; failed
+                # so that the deletion does not wait for it
+                logger.info(f"Skipping task {task['task_id']}: project is gone")
+                await self.reject(task, "The project was deleted")
+                return
+            await self._run(task, isolated_session)
+
+    async def reject(self, task: dict, error: str) -> None:
+        """Fail a task that cannot be run at all."""
+        mongo = AsyncIOMotorClient(self.mongodb_url)
+        r = aioredis.from_url(self.redis_url)
+        try:
+            db = mongo.remotifex
+            await db.tasks.update_one(
+                {"task_id": task["task_id"]},
+                {
+                    "$set": {
+                        "status": "failed",
+                        "completed_at": datetime.now(timezone.utc),
+                        "error": error,
+                    }
+                },
+            )
+            await self._update_project_stats(
+                db, r, task["project_id"], "failed", finished=True
+            )
+            await r.publish(
+                f"project:{task['project_id']}:chat",
+                json.dumps(
+                    {
+                        "task_id": task["task_id"],
+                        "event": {"type": "task_error", "error": error},
+                    }
+                ),
+            )
+        finally:
+            await r.aclose()
+            mongo.close()
+
+    async def heartbeat(self, r: aioredis.Redis) -> None:
+        """Mark this worker alive for the next ``WORKER_HEARTBEAT_TTL`` seconds."""
+        await r.set(heartbeat_key(self.worker_id), 1, ex=WORKER_HEARTBEAT_TTL)
+
+    async def run_heartbeat(self, r: aioredis.Redis) -> None:
+        """Keep this worker's heartbeat key alive until cancelled."""
+        try:
+            while True:
+                try:
+                    await self.heartbeat(r)
+                except Exception as e:
+                    logger.warning(f"Could not refresh worker heartbeat: {e}")
+                await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+        finally:
+            with suppress(Exception):
+                await r.delete(heartbeat_key(self.worker_id))
+
+    async def fail_orphaned_tasks(self, db, r: aioredis.Redis) -> None:
+        """Fail queued or running tasks whose worker is gone.
+
+        A task belongs to the worker that took it off the queue
+        (``worker_id``); once that worker's heartbeat has expired (OOM kill,
+        host restart...) nothing will ever finish the task. Running tasks
+        without an owner predate owner ids and are orphaned as well.
+        """
+        query = {
+            "status": {"$in": ACTIVE_TASK_STATUSES},
+            "$or": [{"worker_id": {"$ne": None}}, {"status": "running"}],
+        }
+        alive: dict[str, bool] = {}
+        fields = {"task_id": 1, "project_id": 1, "status": 1, "worker_id": 1}
+        async for task in db.tasks.find(query, fields):
+            owner = task.get("worker_id")
+            if owner and owner not in alive:
+                alive[owner] = bool(await r.exists(heartbeat_key(owner)))
+            if owner and alive[owner]:
+                continue
+
+            error = "The worker running this task stopped"
+            result = await db.tasks.update_one(
+                {"_id": task["_id"], "status": task["status"], "worker_id": owner},
+                {
+                    "$set": {
+                        "status": "failed",
+                        "completed_at": datetime.now(timezone.utc),
+                        "error": error,
+                    }
+                },
+            )
+            if not result.modified_count:
+                continue
+            logger.info(f"Failed orphaned task {task['task_id']} of worker {owner}")
+            await r.publish(
+                f"project:{task['project_id']}:chat",
+                json.dumps(
+                    {
+                        "task_id": task["task_id"],
+                        "event": {"type": "task_error", "error": error},
+                    }
+                ),
+            )
+
+    async def reconcile_task_counts(self) -> None:
+        """Reset drifted ``stats.active_tasks`` from the task documents.
+
+        Counts drift when a worker dies mid-task and never decrements them;
+        its orphaned tasks are failed first, so they are not counted. A
+        project is only updated if its count did not change meanwhile.
+        """
+        mongo = AsyncIOMotorClient(self.mongodb_url)
+        r = aioredis.from_url(self.redis_url)
+        try:
+            db = mongo.remotifex
+            await self.fail_orphaned_tasks(db, r)
+            actual = {
+                doc["_id"]: doc["count"]
+                async for doc in db.tasks.aggregate(
+                    [
+                        {"$match": {"status": {"$in": ACTIVE_TASK_STATUSES}}},
+                        {"$group": {"_id": "$project_id", "count": {"$sum": 1}}},
+                    ]
+                )
+            }
+            busy = [ObjectId(p) for p in actual if ObjectId.is_valid(p)]
+            query = {
+                "$or": [
+                    {"stats.active_tasks": {"$nin": [0, None]}},
+                    {"_id": {"$in": busy}},
+                ]
+            }
+            async for project in db.projects.find(query, {"stats.active_tasks": 1}):
+                counted = project.get("stats", {}).get("active_tasks")
+                expected = actual.get(str(project["_id"]), 0)
+                if counted != expected:
+                    await db.projects.update_one(
+                        {"_id": project["_id"], "stats.active_tasks": counted},
+                        {"$set": {"stats.active_tasks": expected}},
+                    )
+                    await invalidate_project(r, str(project["_id"]))
+                    logger.info(
+                        f"Reset active task count of project {project['_id']} "
+                        f"from {counted} to {expected}"
+                    )
+        finally:
+            await r.aclose()
+            mongo.close()
+
+    async def run_reconciler(self) -> None:
+        """Fail orphaned tasks and recount active ones at startup, then periodically."""
+        while True:
+            try:
+                await self.reconcile_task_counts()
+            except Exception:
+                logger.exception("Reconciling active task counts failed")
+            await asyncio.sleep(TASK_STATS_RECONCILE_INTERVAL)
+
+    def workspace_lock(
+        self, project_id: str, session_id: str | None = None
+    ) -> asyncio.Lock:
+        """Lock of ``staging``, or of an isolated session's worktree."""
+        key = (project_id, session_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def _claim(self, task: dict) -> None:
+        """Record this worker as the owner of a task it took off the queue."""
+        mongo = AsyncIOMotorClient(self.mongodb_url)
+        try:
+            await mongo.remotifex.tasks.update_one(
+                {"task_id": task["task_id"], "status": "queued"},
+                {"$set": {"worker_id": self.worker_id}},
+            )
+        except Exception as e:
+            logger.warning(f"Could not claim task {task['task_id']}: {e}")
+        finally:
+            mongo.close()
+
+    async def _watch_cancel(
+        self,
+        r: aioredis.Redis,
+        project_id: str,
+        process: asyncio.subprocess.Process,
+        cancelled: asyncio.Event,
+    ) -> None:
+        """Stop ``process`` once the project's deletion asks for it."""
+        while True:
+            try:
+                if await r.exists(cancel_key(project_id)):
+                    break
+            except Exception as e:
+                logger.warning(f"Could not check for deletion of {project_id}: {e}")
+            await asyncio.sleep(CANCEL_POLL_INTERVAL)
+        cancelled.set()
+        with suppress(ProcessLookupError):
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), CANCEL_GRACE)
+            except asyncio.TimeoutError:
+                process.kill()
+
+    async def _project_exists(self, project_id: str) -> bool:
+        mongo = AsyncIOMotorClient(self.mongodb_url)
+        try:
+            project = await mongo.remotifex.projects.find_one(
+                {"_id": ObjectId(project_id)}, {"status": 1}
+            )
+        finally:
+            mongo.close()
+        return project is not None and project.get("status") != "deleting"
+
+    async def _run(self, task: dict, isolated_session: str | None) -> None:
+        """Run one task in its working directory.
+
         Spawns `claude -p` as a subprocess, reads stream-json output line by line,
         and publishes events to Redis pub/sub for real-time delivery to the frontend.
         """
@@ -87,6 +353,8 @@ class ClaudeRunner:
         env["HOME"] = home_dir
         if api_key:
             env["ANTHROPIC_API_KEY"] = api_key
+        if package_cache.enabled():
+            env.update(package_cache.task_env(home_dir))
 
         r = aioredis.from_url(self.redis_url)
         mongo = AsyncIOMotorClient(self.mongodb_url)
@@ -99,9 +367,11 @@ class ClaudeRunner:
                 "$set": {
                     "status": "running",
                     "started_at": datetime.now(timezone.utc),
+                    "worker_id": self.worker_id,
                 }
             },
         )
+        await self._update_project_stats(db, r, project_id, "running")
 
         # Publish start event
         await r.publish(
@@ -114,13 +384,45 @@ class ClaudeRunner:
             ),
         )
 
-        logger.info(f"Starting Claude Code: {' '.join(cmd[:6])}...")
-        logger.info(f"Working directory: {project_dir}")
-
         accumulated_text = ""
         result_session_id = None
+        checkpoint = {}
+        cancelled = asyncio.Event()
+        watcher = None
+        cache_lease = None
+        started = time.time()
+        final_status = "failed"
 
         try:
+            if package_cache.enabled():
+                cache_lease = await package_cache.acquire()
+
+            if isolated_session:
+                project_dir = await checkpoints.ensure_session(
+                    project_id, isolated_session, self.workspace_lock(project_id)
+                )
+
+            # Checkpoint the workspace so the task's changes can be rolled back
+            checkpoint["before"] = await self._checkpoint(
+                project_id, task_id, "before", session_id=isolated_session
+            )
+            await db.tasks.update_one(
+                {"task_id": task_id},
+                {
+                    "$set": {
+                        "checkpoint": checkpoint,
+                        "isolated": bool(isolated_session),
+                    }
+                },
+            )
+
+            if await r.exists(cancel_key(project_id)):
+                cancelled.set()
+                raise TaskCancelled("The project is being deleted")
+
+            logger.info(f"Starting Claude Code: {' '.join(cmd[:6])}...")
+            logger.info(f"Working directory: {project_dir}")
+
             process = await asyncio.create_subprocess_exec(
                 *cmd,
                 cwd=project_dir,
@@ -128,6 +430,9 @@ class ClaudeRunner:
                 stderr=asyncio.subprocess.PIPE,
                 env=env,
             )
+            watcher = asyncio.create_task(
+                self._watch_cancel(r, project_id, process, cancelled)
+            )
 
             # Stream stdout line by line (NDJSON)
             async for line in process.stdout:
@@ -164,6 +469,16 @@ class ClaudeRunner:
             return_code = process.returncode
 
             logger.info(f"Claude Code exited with code {return_code}")
+            if cancelled.is_set():
+                raise TaskCancelled("The project is being deleted")
+
+            checkpoint["after"] = await self._checkpoint(
+                project_id,
+                task_id,
+                "after",
+                checkpoint["before"],
+                session_id=isolated_session,
+            )
 
             # Store assistant message
             from app.stream_parser import StreamParser
@@ -188,13 +503,15 @@ class ClaudeRunner:
                 )
 
             # Update task status
+            final_status = "completed" if return_code == 0 else "failed"
             await db.tasks.update_one(
                 {"task_id": task_id},
                 {
                     "$set": {
-                        "status": "completed" if return_code == 0 else "failed",
+                        "status": final_status,
                         "completed_at": datetime.now(timezone.utc),
                         "result": {"return_code": return_code},
+                        "checkpoint": checkpoint,
                     }
                 },
             )
@@ -209,6 +526,7 @@ class ClaudeRunner:
                             "type": "task_complete",
                             "return_code": return_code,
                             "session_id": result_session_id,
+                            "checkpoint": checkpoint,
                         },
                     }
                 ),
@@ -216,6 +534,21 @@ class ClaudeRunner:
 
         except Exception as e:
             logger.exception(f"Error running Claude Code for task {task_id}")
+            final_status = "failed"
+
+            # A deleted project's workspace must not be recreated
+            if (
+                checkpoint.get("before")
+                and "after" not in checkpoint
+                and not cancelled.is_set()
+            ):
+                checkpoint["after"] = await self._checkpoint(
+                    project_id,
+                    task_id,
+                    "after",
+                    checkpoint["before"],
+                    session_id=isolated_session,
+                )
 
             await db.tasks.update_one(
                 {"task_id": task_id},
@@ -224,6 +557,7 @@ class ClaudeRunner:
                         "status": "failed",
                         "completed_at": datetime.now(timezone.utc),
                         "error": str(e),
+                        "checkpoint": checkpoint,
                     }
                 },
             )
@@ -239,9 +573,73 @@ class ClaudeRunner:
             )
 
         finally:
+            if watcher is not None:
+                watcher.cancel()
+                with suppress(asyncio.CancelledError):
+                    await watcher
+            # Exactly once per task, however it ended
+            await self._update_project_stats(
+                db, r, project_id, final_status, finished=True
+            )
+            package_cache.release(cache_lease)
+            deleted = cancelled.is_set() or not await self._project_exists(project_id)
+            try:
+                # Have the API re-measure the project's disk usage
+                if not deleted:
+                    await r.sadd("disk_usage:dirty", project_id)
+                if cache_lease is not None:
+                    await package_cache.record_use(r, started)
+            except Exception as e:
+                logger.warning(f"Could not record usage of task {task_id}: {e}")
             await r.aclose()
             mongo.close()
 
+        if deleted:
+            return
+        try:
+            await checkpoints.prune(project_id)
+        except Exception as e:
+            logger.warning(f"Could not prune checkpoints of project {project_id}: {e}")
+
+    async def _update_project_stats(
+        self, db, r, project_id: str, status: str, finished: bool = False
+    ) -> None:
+        """Keep the project's task counters (shown in project lists) current."""
+        fields = {
+            "stats.last_task_status": status,
+            "last_activity_at": datetime.now(timezone.utc),
+        }
+        if finished:
+            # A pipeline update, so a drifted count stops at zero
+            active = {"$ifNull": ["$stats.active_tasks", 0]}
+            fields["stats.active_tasks"] = {"$max": [0, {"$subtract": [active, 1]}]}
+            update = [{"$set": fields}]
+        else:
+            update = {"$set": fields}
+        try:
+            await db.projects.update_one({"_id": ObjectId(project_id)}, update)
+        except Exception as e:
+            logger.warning(f"Could not update stats of project {project_id}: {e}")
+            return
+        await invalidate_project(r, project_id)
+
+    async def _checkpoint(
+        self,
+        project_id: str,
+        task_id: str,
+        label: str,
+        parent: str | None = None,
+        session_id: str | None = None,
+    ) -> str | None:
+        """Snapshot the workspace; a failure is logged and never fails the task."""
+        try:
+            return await checkpoints.snapshot(
+                project_id, task_id, label, parent, session_id
+            )
+        except Exception as e:
+            logger.warning(f"Could not checkpoint task {task_id} ({label}): {e}")
+            return None
+
     def _parse_event(self, event: dict) -> dict | None:
         """Parse a Claude Code stream-json event into our normalized format."""
         event_type = event.get("type")
@@ -0,0 +1,342 @@
+"""Preview containers for project environments, started on demand.
+
+A project's ``staging`` and ``prod`` environments are served by one
+container each, but only while they are being used. The API queues
+``start`` on the ``env_requests`` list when a request arrives for an
+environment that is not running and waits for its upstream address to
+appear in Redis. Every proxied request refreshes the environment's score
+in the ``env:last_access`` sorted set, and environments idle for longer
+than their timeout are stopped. Stopped containers are kept, so starting
+again skips creating them. When ``PREVIEW_MAX_RUNNING`` environments are
+running, starting another stops the least recently used one.
+
+Redis keys (``{key}`` is ``{project_id}:{env}``):
+
+* ``env:upstream:{key}``: ``host:port`` of a running environment
+* ``env:booting:{key}``: set while a new container may not listen yet;
+  the API, the only other member of the preview network, waits for it
+* ``env:starting:{key}``: set by the API while a start is queued
+* ``env:error:{key}``: why the last start failed (expires)
+* ``env:last_access``: sorted set of running environments by last access
+* ``env:idle_timeout``: hash of per-environment idle timeouts (seconds)
+* ``env:images``: images to keep pulled, so first starts do not download;
+  the API also queues ``prewarm`` when it adds one
+
+Previews run the projects' own code, so they get a network of their own
+(``PREVIEW_NETWORK``) that only the API joins, never the one with MongoDB
+and Redis. A project's ``prod`` is mounted read-only: its files are
+hardlinks to objects shared by every release.
+
+The Docker client is injected, so the manager can run against a fake
+Docker API; it only uses ``containers.list/get/run``, the containers'
+``start/stop/remove`` and ``images.pull``.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import suppress
+
+logger = logging.getLogger("remotifex.worker.environments")
+
+PROJECTS_DATA_DIR = os.environ.get("PROJECTS_DATA_DIR", "/data/projects")
+
+# Stop environments not accessed for this long (seconds), unless the
+# environment sets its own timeout
+PREVIEW_IDLE_TIMEOUT = int(os.environ.get("PREVIEW_IDLE_TIMEOUT", "600"))
+
+# Environments running at once, and memory each container may use
+PREVIEW_MAX_RUNNING = int(os.environ.get("PREVIEW_MAX_RUNNING", "40"))
+PREVIEW_MEMORY_MB = int(os.environ.get("PREVIEW_MEMORY_MB", "256"))
+
+# Seconds a new container is given to start listening on its port
+PREVIEW_READY_TIMEOUT = int(os.environ.get("PREVIEW_READY_TIMEOUT", "60"))
+
+# Docker network shared with the API, which proxies to the containers;
+# nothing else may be on it
+PREVIEW_NETWORK = os.environ.get("PREVIEW_NETWORK", "remotifex_previews")
+
+# The network of MongoDB, Redis and the worker, refused for previews
+INTERNAL_NETWORK = "remotifex_net"
+
+# Host path of PROJECTS_DATA_DIR; found by inspecting this container if unset
+PREVIEW_HOST_DATA_DIR = os.environ.get("PREVIEW_HOST_DATA_DIR")
+
+# Seconds between pulls of the environments' images
+PREVIEW_PREWARM_INTERVAL = int(os.environ.get("PREVIEW_PREWARM_INTERVAL", "3600"))
+
+QUEUE = "env_requests"
+LAST_ACCESS_KEY = "env:last_access"
+IDLE_TIMEOUT_KEY = "env:idle_timeout"
+IMAGES_KEY = "env:images"
+
+_LABEL = "remotifex.environment"
+
+# Seconds between checks for idle environments
+_REAP_INTERVAL = 15
+
+
+class PreviewError(Exception):
+    """A preview container could not be started."""
+
+
+def container_name(key: str) -> str:
+    return "remotifex-" + key.replace(":", "-")
+
+
+class EnvironmentManager:
+    """Starts, stops and reaps preview containers; see the module docstring."""
+
+    def __init__(
+        self,
+        redis,
+        docker_client=None,
+        host_data_dir: str | None = None,
+    ):
+        self.redis = redis
+        self._docker = docker_client
+        self._host_data_dir = host_data_dir or PREVIEW_HOST_DATA_DIR
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    @property
+    def docker(self):
+        if self._docker is None:
+            import docker
+
+            self._docker = docker.from_env()
+        return self._docker
+
+    def host_data_dir(self) -> str:
+        """Where PROJECTS_DATA_DIR is on the Docker host, for bind mounts."""
+        if self._host_data_dir is None:
+            me = self.docker.containers.get(socket.gethostname())
+            for mount in me.attrs.get("Mounts", []):
+                if mount.get("Destination") == PROJECTS_DATA_DIR:
+                    self._host_data_dir = mount["Source"]
+                    break
+            else:
+                raise PreviewError(
+                    f"{PROJECTS_DATA_DIR} is not a mount; set PREVIEW_HOST_DATA_DIR"
+                )
+        return self._host_data_dir
+
+    def _find(self, name: str):
+        containers = self.docker.containers.list(all=True, filters={"name": name})
+        for container in containers:
+            if container.name == name:
+                return container
+        return None
+
+    def _run_container(self, request: dict) -> str:
+        """Start (or create) an environment's container; returns ``host:port``."""
+        if PREVIEW_NETWORK == INTERNAL_NETWORK:
+            raise PreviewError(f"Previews must not join {INTERNAL_NETWORK}")
+        name = container_name(request["key"])
+        port = int(request["port"])
+        # Only staging is edited in place; prod shares deploy objects
+        mode = "rw" if request["env"] == "staging" else "ro"
+        config = {
+            "image": request["image"],
+            "command": request["command"],
+            "port": port,
+            "memory_mb": PREVIEW_MEMORY_MB,
+            "network": PREVIEW_NETWORK,
+            "mode": mode,
+        }
+        digest = hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode()
+        ).hexdigest()
+
+        container = self._find(name)
+        if container is not None and container.labels.get(_LABEL) != digest:
+            container.remove(force=True)  # configuration changed
+            container = None
+        if container is None:
+            source = os.path.join(
+                self.host_data_dir(), request["project_id"], request["env"]
+            )
+            container = self.docker.containers.run(
+                request["image"],
+                ["sh", "-c", request["command"]],
+                name=name,
+                detach=True,
+                working_dir="/app",
+                environment={"PORT": str(port), "HOST": "0.0.0.0"},
+                volumes={source: {"bind": "/app", "mode": mode}},
+                network=PREVIEW_NETWORK,
+                mem_limit=f"{PREVIEW_MEMORY_MB}m",
+                pids_limit=512,
+                labels={_LABEL: digest, "remotifex.key": request["key"]},
+            )
+        elif container.status != "running":
+            container.start()
+        return f"{name}:{port}"
+
+    def _stop_container(self, key: str, remove: bool) -> None:
+        container = self._find(container_name(key))
+        if container is None:
+            return
+        if remove:
+            container.remove(force=True)
+        elif container.status == "running":
+            container.stop(timeout=10)
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    async def start(self, request: dict) -> None:
+        key = request["key"]
+        try:
+            async with self._lock(key):
+                if await self.redis.get(f"env:upstream:{key}"):
+                    return  # started by an earlier request
+                await self._make_room(key)
+                upstream = await asyncio.to_thread(self._run_container, request)
+
+                pipe = self.redis.pipeline()
+                pipe.zadd(LAST_ACCESS_KEY, {key: time.time()})
+                if request.get("idle_timeout"):
+                    pipe.hset(IDLE_TIMEOUT_KEY, key, int(request["idle_timeout"]))
+                else:
+                    pipe.hdel(IDLE_TIMEOUT_KEY, key)
+                pipe.set(f"env:upstream:{key}", upstream)
+                pipe.set(f"env:booting:{key}", 1, ex=PREVIEW_READY_TIMEOUT)
+                pipe.delete(f"env:error:{key}")
+                await pipe.execute()
+                logger.info(f"Started environment {key} at {upstream}")
+        except Exception as e:
+            logger.warning(f"Could not start environment {key}: {e}")
+            await self.redis.set(f"env:error:{key}", str(e) or repr(e), ex=60)
+            # Not counted against the limit, so it must not keep running
+            with suppress(Exception):
+                await asyncio.to_thread(self._stop_container, key, False)
+        finally:
+            await self.redis.delete(f"env:starting:{key}")
+
+    async def stop(self, key: str, remove: bool = False) -> None:
+        async with self._lock(key):
+            # Forget the upstream first, so new requests start it again
+            pipe = self.redis.pipeline()
+            pipe.delete(f"env:upstream:{key}", f"env:booting:{key}")
+            pipe.zrem(LAST_ACCESS_KEY, key)
+            await pipe.execute()
+            await asyncio.to_thread(self._stop_container, key, remove)
+            logger.info(f"{'Removed' if remove else 'Stopped'} environment {key}")
+
+    async def _make_room(self, starting: str) -> None:
+        """Stop least recently used environments down to the limit."""
+        while await self.redis.zcard(LAST_ACCESS_KEY) >= PREVIEW_MAX_RUNNING:
+            oldest = await self.redis.zrange(LAST_ACCESS_KEY, 0, 0)
+            if not oldest or oldest[0].decode() == starting:
+                return
+            await self.stop(oldest[0].decode())
+
+    async def reap(self) -> None:
+        """Stop every environment idle for longer than its timeout."""
+        now = time.time()
+        timeouts = {
+            k.decode(): int(v)
+            for k, v in (await self.redis.hgetall(IDLE_TIMEOUT_KEY)).items()
+        }
+        candidates = await self.redis.zrangebyscore(
+            LAST_ACCESS_KEY, 0, now - min([PREVIEW_IDLE_TIMEOUT, *timeouts.values()])
+        )
+        for member in candidates:
+            key = member.decode()
+            # Accessed since the range was read?
+            last = await self.redis.zscore(LAST_ACCESS_KEY, key)
+            timeout = timeouts.get(key, PREVIEW_IDLE_TIMEOUT)
+            if last is not None and now - last >= timeout:
+                await self.stop(key)
+
+    async def reconcile(self) -> None:
+        """Match Redis to the containers actually running (after restarts)."""
+        containers = await asyncio.to_thread(
+            self.docker.containers.list, filters={"label": _LABEL}
+        )
+        running = {}
+        for container in containers:
+            key = container.labels.get("remotifex.key")
+            if key:
+                running[key] = container
+        for member in await self.redis.zrange(LAST_ACCESS_KEY, 0, -1):
+            key = member.decode()
+            if key not in running:
+                await self.stop(key)
+        for key in running:
+            if await self.redis.zscore(LAST_ACCESS_KEY, key) is None:
+                # Unknown to Redis: stop it, a request starts it again
+                await self.stop(key)
+
+    async def pull(self, image: str) -> None:
+        try:
+            await asyncio.to_thread(self.docker.images.pull, image)
+        except Exception as e:
+            logger.warning(f"Could not pull {image}: {e}")
+
+    async def prewarm(self) -> None:
+        """Pull the environments' images so starting never waits for one."""
+        for image in await self.redis.smembers(IMAGES_KEY):
+            await self.pull(image.decode())
+
+    async def handle(self, request: dict) -> None:
+        action = request.get("action")
+        if action == "start":
+            await self.start(request)
+        elif action in ("stop", "remove"):
+            await self.stop(request["key"], remove=action == "remove")
+        elif action == "prewarm":
+            await self.pull(request["image"])
+        else:
+            logger.warning(f"Unknown environment request: {action}")
+
+    async def run(self) -> None:
+        """Serve ``env_requests`` and stop idle environments, until cancelled."""
+        try:
+            await self.reconcile()
+        except Exception:
+            logger.exception("Could not reconcile preview containers")
+        background = [
+            asyncio.create_task(self._reap_periodically()),
+            asyncio.create_task(self._prewarm_periodically()),
+        ]
+        pending: set[asyncio.Task] = set()
+        try:
+            while True:
+                try:
+                    result = await self.redis.brpop(QUEUE, timeout=5)
+                    if result is None:
+                        continue
+                    t = asyncio.create_task(self.handle(json.loads(result[1])))
+                    pending.add(t)
+                    t.add_done_callback(pending.discard)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Error reading environment requests")
+                    await asyncio.sleep(1)
+        finally:
+            for t in background + list(pending):
+                t.cancel()
+
+    async def _reap_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(_REAP_INTERVAL)
+            try:
+                # One worker reaps each round
+                if await self.redis.set("env:reaper", 1, nx=True, ex=_REAP_INTERVAL):
+                    await self.reap()
+            except Exception:
+                logger.exception("Stopping idle environments failed")
+
+    async def _prewarm_periodically(self) -> None:
+        while True:
+            try:
+                await self.prewarm()
+            except Exception:
+                logger.exception("Pulling environment images failed")
+            await asyncio.sleep(PREVIEW_PREWARM_INTERVAL)
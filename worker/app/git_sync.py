@@ -0,0 +1,325 @@
+"""Clone, fetch and push projects' git repositories (the ``git_tasks`` queue).
+
+Objects are downloaded once per remote into a bare cache repository
+(``{PROJECTS_DATA_DIR}/.git-cache/{key}.git``). A project's repository, in
+``staging/.git``, borrows the cache's objects through git alternates and
+fetches from the cache, so cloning a remote that is already cached copies
+no objects. Its own objects are only the commits made in the project.
+Every project still fetches the remote with its own credentials before
+it is given the cache's objects.
+
+Caches never prune objects, because attached repositories may still
+reference objects the remote has dropped. Related remotes such as forks
+get separate caches: alternates expose every object of a cache to the
+repositories attached to it, so sharing across remotes could leak private
+objects between projects.
+"""
+
+import asyncio
+import base64
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit
+
+import redis.asyncio as aioredis
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.invalidation import invalidate_project
+
+logger = logging.getLogger("remotifex.worker.git")
+
+PROJECTS_DATA_DIR = os.environ.get("PROJECTS_DATA_DIR", "/data/projects")
+
+GIT_CACHE_DIR = os.environ.get(
+    "GIT_CACHE_DIR", os.path.join(PROJECTS_DATA_DIR, ".git-cache")
+)
+
+PENDING_PREFIX = "git_tasks:pending"  # {prefix}:{project_id}:{action}, set by the API
+
+
+class GitSyncError(Exception):
+    """A git command failed while syncing a project."""
+
+
+def cache_key(repo_url: str) -> str:
+    """Key of a remote's cache; credentials and spelling variants are ignored."""
+    parts = urlsplit(repo_url.strip())
+    if parts.scheme:
+        host = (parts.hostname or "").lower()
+        if parts.port:
+            host = f"{host}:{parts.port}"
+        path = parts.path
+        normalized = urlunsplit((parts.scheme.lower(), host, path, "", ""))
+    else:
+        normalized = repo_url.strip()  # scp-like: git@host:owner/repo
+    normalized = normalized.rstrip("/")
+    if normalized.endswith(".git"):
+        normalized = normalized[: -len(".git")]
+    return hashlib.sha256(normalized.encode()).hexdigest()[:24]
+
+
+def _auth_env(token: str | None) -> dict:
+    """Send an HTTPS token without writing it to any git config file."""
+    if not token:
+        return {}
+    basic = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+    return {
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": "http.extraHeader",
+        "GIT_CONFIG_VALUE_0": f"Authorization: Basic {basic}",
+    }
+
+
+async def _git(cwd: str, *args: str, env: dict | None = None) -> str:
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0", **(env or {})},
+    )
+    out, err = await process.communicate()
+    if process.returncode != 0:
+        raise GitSyncError(
+            f"git {args[0]} failed: {err.decode(errors='replace').strip()}"
+        )
+    return out.decode().strip()
+
+
+def _lock_file(path: str) -> int:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+async def update_cache(repo_url: str, token: str | None) -> str:
+    """Fetch a remote into its cache; returns the cache's git directory.
+
+    Fetches of the same remote (from any worker) take turns, so a project
+    arriving while another fetches mostly finds the objects already there.
+    """
+    os.makedirs(GIT_CACHE_DIR, exist_ok=True)
+    key = cache_key(repo_url)
+    cache = os.path.join(GIT_CACHE_DIR, f"{key}.git")
+    lock_path = os.path.join(GIT_CACHE_DIR, f"{key}.lock")
+    fd = await asyncio.to_thread(_lock_file, lock_path)
+    try:
+        if not os.path.isfile(os.path.join(cache, "HEAD")):
+            await _git(GIT_CACHE_DIR, "init", "-q", "--bare", cache)
+            for name, value in (
+                ("gc.pruneExpire", "never"),
+                ("gc.reflogExpireUnreachable", "never"),
+                ("core.logAllRefUpdates", "false"),
+            ):
+                await _git(cache, "config", name, value)
+        await _git(
+            cache,
+            "fetch",
+            "--quiet",
+            "--prune",
+            "--no-write-fetch-head",
+            repo_url,
+            "+refs/heads/*:refs/heads/*",
+            "+refs/tags/*:refs/tags/*",
+            env=_auth_env(token),
+        )
+        await _git(cache, "gc", "--auto", "--quiet")
+    finally:
+        os.close(fd)
+    return cache
+
+
+def _attach(repo_dir: str, cache: str) -> None:
+    """List the cache's objects as an alternate of a project repository."""
+    alternates = os.path.join(repo_dir, "objects", "info", "alternates")
+    objects = os.path.join(cache, "objects")
+    try:
+        with open(alternates) as f:
+            if objects in f.read().splitlines():
+                return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(alternates), exist_ok=True)
+    with open(alternates, "a") as f:
+        f.write(objects + "\n")
+
+
+async def _fetch_from_cache(work_tree: str, cache: str) -> None:
+    # Every object is already reachable through the alternate, so this
+    # only updates refs. Tags are not pruned: the project may have its own.
+    for args in (
+        ("--prune", "+refs/heads/*:refs/remotes/origin/*"),
+        ("+refs/tags/*:refs/tags/*",),
+    ):
+        await _git(
+            work_tree, "fetch", "--quiet", "--no-write-fetch-head", cache, *args
+        )
+
+
+async def _status(work_tree: str, branch: str) -> dict:
+    """Where the project's branch stands relative to the remote's."""
+    status = {"head": None, "ahead": None, "behind": None}
+    try:
+        status["head"] = await _git(work_tree, "rev-parse", "--verify", "HEAD")
+        counts = await _git(
+            work_tree,
+            "rev-list",
+            "--left-right",
+            "--count",
+            f"HEAD...refs/remotes/origin/{branch}",
+        )
+    except GitSyncError:
+        return status  # nothing checked out, or no such remote branch
+    status["ahead"], status["behind"] = (int(n) for n in counts.split())
+    return status
+
+
+async def clone(project_id: str, repo_url: str, branch: str, token: str | None) -> dict:
+    """Check out ``branch`` of the remote into ``staging``.
+
+    ``staging`` becomes (or stays) a repository whose ``origin`` is the
+    remote. Files the branch also contains are overwritten; other files
+    are left alone.
+    """
+    cache = await update_cache(repo_url, token)
+    work_tree = os.path.join(PROJECTS_DATA_DIR, project_id, "staging")
+    repo_dir = os.path.join(work_tree, ".git")
+    os.makedirs(work_tree, exist_ok=True)
+    if not os.path.isfile(os.path.join(repo_dir, "HEAD")):
+        await _git(work_tree, "init", "-q", f"--initial-branch={branch}")
+    _attach(repo_dir, cache)
+
+    remotes = (await _git(work_tree, "remote")).split()
+    if "origin" in remotes:
+        await _git(work_tree, "remote", "set-url", "origin", repo_url)
+    else:
+        await _git(work_tree, "remote", "add", "origin", repo_url)
+    await _fetch_from_cache(work_tree, cache)
+    await _git(
+        work_tree,
+        "checkout",
+        "--quiet",
+        "-f",
+        "-B",
+        branch,
+        f"refs/remotes/origin/{branch}",
+    )
+    await _git(work_tree, "branch", "--quiet", f"--set-upstream-to=origin/{branch}")
+    return await _status(work_tree, branch)
+
+
+async def fetch(project_id: str, repo_url: str, branch: str, token: str | None) -> dict:
+    """Bring the cache and the project's ``origin/*`` refs up to date.
+
+    The working tree and local branches are not touched.
+    """
+    cache = await update_cache(repo_url, token)
+    work_tree = os.path.join(PROJECTS_DATA_DIR, project_id, "staging")
+    repo_dir = os.path.join(work_tree, ".git")
+    if not os.path.isfile(os.path.join(repo_dir, "HEAD")):
+        return {"head": None, "ahead": None, "behind": None}  # not cloned yet
+    _attach(repo_dir, cache)
+    await _fetch_from_cache(work_tree, cache)
+    return await _status(work_tree, branch)
+
+
+async def push(project_id: str, repo_url: str, branch: str, token: str | None) -> dict:
+    """Push the project's ``HEAD`` to ``branch`` of the remote."""
+    work_tree = os.path.join(PROJECTS_DATA_DIR, project_id, "staging")
+    if not os.path.isfile(os.path.join(work_tree, ".git", "HEAD")):
+        raise GitSyncError("The project has not been cloned")
+    await _git(
+        work_tree,
+        "push",
+        "--quiet",
+        repo_url,
+        f"HEAD:refs/heads/{branch}",
+        env=_auth_env(token),
+    )
+    await _git(work_tree, "update-ref", f"refs/remotes/origin/{branch}", "HEAD")
+    return await _status(work_tree, branch)
+
+
+_ACTIONS = {"clone": clone, "fetch": fetch, "push": push}
+
+
+class GitSync:
+    """Runs ``git_tasks`` jobs and records their outcome on the project."""
+
+    def __init__(self, redis_url: str, mongodb_url: str, workspace_lock):
+        self.redis_url = redis_url
+        self.mongodb_url = mongodb_url
+        # Cloning rewrites staging, so it waits for AI tasks working there
+        self.workspace_lock = workspace_lock
+
+    async def execute(self, job: dict) -> None:
+        project_id = job["project_id"]
+        action = job["type"]
+        r = aioredis.from_url(self.redis_url)
+        mongo = AsyncIOMotorClient(self.mongodb_url)
+        db = mongo.remotifex
+        # A request arriving from now on needs a job of its own
+        await r.delete(f"{PENDING_PREFIX}:{project_id}:{action}")
+
+        sync = {
+            "job_id": job.get("job_id") or uuid.uuid4().hex,
+            "action": action,
+            "state": "running",
+            "error": None,
+            "started_at": datetime.now(timezone.utc),
+        }
+        try:
+            project = await db.projects.find_one(
+                {"_id": ObjectId(project_id)}, {"status": 1}
+            )
+            if project is None or project.get("status") == "deleting":
+                logger.info(f"Skipping git {action} of {project_id}: project is gone")
+                return
+            await self._report(db, r, project_id, sync)
+
+            run = _ACTIONS[action]
+            args = (project_id, job["repo_url"], job["branch"], job.get("token"))
+            if action == "clone":
+                async with self.workspace_lock(project_id):
+                    result = await run(*args)
+            else:
+                result = await run(*args)
+            sync.update(result, state="done")
+            if action == "clone":
+                await db.projects.update_one(
+                    {"_id": ObjectId(project_id)},
+                    {"$set": {"git.cloned_at": datetime.now(timezone.utc)}},
+                )
+                await invalidate_project(r, project_id)
+        except Exception as e:
+            logger.warning(f"git {action} of project {project_id} failed: {e}")
+            sync.update(state="failed", error=str(e))
+        finally:
+            if sync["state"] != "running":
+                sync["finished_at"] = datetime.now(timezone.utc)
+                await self._report(db, r, project_id, sync)
+            await r.aclose()
+            mongo.close()
+
+    async def _report(self, db, r, project_id: str, sync: dict) -> None:
+        await db.projects.update_one(
+            {"_id": ObjectId(project_id), "status": {"$ne": "deleting"}},
+            {"$set": {"git.sync": sync}},
+        )
+        await invalidate_project(r, project_id)
+        event = {"type": "git_sync", **sync}
+        for name in ("started_at", "finished_at"):
+            if event.get(name):
+                event[name] = event[name].isoformat()
+        await r.publish(f"project:{project_id}:chat", json.dumps({"event": event}))
@@ -0,0 +1,25 @@
+"""Announce changed project documents to the API's caches.
+
+The API caches project documents per request owner and drops them when
+a message arrives on its invalidation channel; the worker publishes
+there after updating a project so the API never serves stale stats or
+git state.
+"""
+
+import json
+import logging
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger("remotifex.worker.invalidation")
+
+# Must match the API's app.utils.invalidation.CHANNEL
+CHANNEL = "remotifex:invalidate"
+
+
+async def invalidate_project(r: aioredis.Redis, project_id: str) -> None:
+    """Have every API process drop its cached copies of a project."""
+    try:
+        await r.publish(CHANNEL, json.dumps({"scope": "project", "key": project_id}))
+    except aioredis.RedisError as e:
+        logger.warning(f"Could not invalidate cached project {project_id}: {e}")
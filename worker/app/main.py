@@ -1,4 +1,8 @@
-"""Worker main loop: consumes AI tasks from Redis queue."""
+"""Worker main loop: consumes AI and git tasks from Redis queues.
+
+Preview containers for project environments are managed alongside, see
+``app.environments``.
+"""
 
 import asyncio
 import json
@@ -6,10 +10,14 @@ import logging
 import os
 import signal
 import sys
+from contextlib import suppress
 
 import redis.asyncio as aioredis
 
+from app import package_cache
 from app.claude_runner import ClaudeRunner
+from app.environments import EnvironmentManager
+from app.git_sync import GitSync
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +28,12 @@ logger = logging.getLogger("remotifex.worker")
 REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
 MONGODB_URL = os.environ.get("MONGODB_URL", "mongodb://mongo:27017/remotifex")
 
+# Set to 0 to not manage preview containers from this worker
+PREVIEW_ENABLED = os.environ.get("PREVIEW_ENABLED", "1") != "0"
+
+# Tasks run at the same time (tasks sharing a workspace still run in turn)
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+
 shutdown = False
 
 
@@ -29,6 +43,25 @@ def handle_signal(sig, frame):
     shutdown = True
 
 
+async def run_task(claude_runner: ClaudeRunner, task: dict) -> None:
+    tool = task.get("tool", "claude")
+    try:
+        if tool == "claude":
+            await claude_runner.execute(task)
+        else:
+            logger.warning(f"Unknown tool: {tool}, failing task")
+            await claude_runner.reject(task, f"Unknown tool: {tool}")
+    except Exception:
+        logger.exception(f"Error processing task {task['task_id']}")
+
+
+async def run_git_job(git_sync: GitSync, job: dict) -> None:
+    try:
+        await git_sync.execute(job)
+    except Exception:
+        logger.exception(f"Error processing git {job['type']} job {job.get('job_id')}")
+
+
 async def main():
     """Main worker loop: pop tasks from Redis and execute them."""
     signal.signal(signal.SIGTERM, handle_signal)
@@ -45,35 +78,69 @@ async def main():
     logger.info("Connected to Redis")
 
     claude_runner = ClaudeRunner(redis_url=REDIS_URL, mongodb_url=MONGODB_URL)
+    git_sync = GitSync(REDIS_URL, MONGODB_URL, claude_runner.workspace_lock)
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+    # Alive before the first task is claimed, and before orphans are failed
+    await claude_runner.heartbeat(r)
+    background = [
+        asyncio.create_task(claude_runner.run_heartbeat(r)),
+        asyncio.create_task(claude_runner.run_reconciler()),
+    ]
+    if package_cache.enabled():
+        background.append(asyncio.create_task(package_cache.run_pruner(r)))
+    if PREVIEW_ENABLED:
+        background.append(asyncio.create_task(EnvironmentManager(r).run()))
+
+    def task_done(t: asyncio.Task) -> None:
+        running.discard(t)
+        slots.release()
 
     while not shutdown:
+        # Only take a task off the queue when there is capacity to start it
+        await slots.acquire()
         try:
             # Blocking pop with 5 second timeout
-            result = await r.brpop("ai_tasks", timeout=5)
+            result = await r.brpop(["ai_tasks", "git_tasks"], timeout=5)
             if result is None:
+                slots.release()
                 continue
 
-            _, task_json = result
+            queue, task_json = result
             task = json.loads(task_json)
 
-            logger.info(
-                f"Received task {task['task_id']} for project {task['project_id']}"
-            )
-
-            # Execute the task
-            tool = task.get("tool", "claude")
-            if tool == "claude":
-                await claude_runner.execute(task)
+            if queue == b"git_tasks":
+                logger.info(
+                    f"Received git {task['type']} job for project {task['project_id']}"
+                )
+                job = run_git_job(git_sync, task)
             else:
-                logger.warning(f"Unknown tool: {tool}, skipping task")
+                logger.info(
+                    f"Received task {task['task_id']} for project {task['project_id']}"
+                )
+                job = run_task(claude_runner, task)
+
+            # Execute the task in the background
+            t = asyncio.create_task(job)
+            running.add(t)
+            t.add_done_callback(task_done)
 
         except aioredis.ConnectionError:
+            slots.release()
             logger.error("Lost Redis connection, retrying in 5s...")
             await asyncio.sleep(5)
         except Exception:
+            slots.release()
             logger.exception("Error processing task")
             await asyncio.sleep(1)
 
+    if running:
+        logger.info(f"Waiting for {len(running)} running tasks...")
+        await asyncio.gather(*running)
+    for t in background:
+        t.cancel()
+        with suppress(asyncio.CancelledError):
+            await t
     await r.aclose()
     logger.info("Worker shut down cleanly")
 
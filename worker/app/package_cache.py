@@ -0,0 +1,390 @@
+"""Package-manager caches shared by the tasks of all projects.
+
+Every project has a home directory of its own, so without this each one
+downloaded and stored its own copy of every npm, pip, cargo and go
+dependency. Tasks instead point the tools at per-ecosystem caches under
+``PACKAGE_CACHE_DIR`` through their environment variables. The tools'
+own cache formats are safe for concurrent use. Cargo has no variable for
+its cache alone, so each project keeps its own ``CARGO_HOME`` (config,
+credentials and installed binaries stay per project) in which
+``registry/``, ``git/`` and cargo's package cache lock files are symlinks
+to the shared ones.
+
+The cache is pruned least recently used first down to 90% of
+``PACKAGE_CACHE_MAX_MB``. Each running task holds a lease: a file under
+``.leases/`` created when the task starts and ``flock``ed until it ends.
+Pruning never waits for tasks; it only removes entries last used before
+the oldest live lease was taken, so nothing a running install has touched
+disappears from under it. Leases whose lock is free belonged to a worker
+that died and are removed. Entries are pruned whole: a file, or for cargo
+and go an unpacked package directory.
+
+Use is measured per task from access times: an entry written during the
+task is a miss, one only read is a hit. Afterwards the entry's atime and
+mtime are both set to its last use, which lets ``relatime`` mounts record
+the next read and leaves the last use in the mtime for pruning. Counts are
+approximate while tasks overlap, and hits are not seen on ``noatime``
+mounts. Totals are kept in the Redis hash ``package_cache:stats``.
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import stat
+import time
+import uuid
+from contextlib import suppress
+
+logger = logging.getLogger("remotifex.worker.package_cache")
+
+PROJECTS_DATA_DIR = os.environ.get("PROJECTS_DATA_DIR", "/data/projects")
+
+PACKAGE_CACHE_DIR = os.environ.get(
+    "PACKAGE_CACHE_DIR", os.path.join(PROJECTS_DATA_DIR, ".package-cache")
+)
+
+# Size the caches are pruned to stay under; 0 turns sharing off
+PACKAGE_CACHE_MAX_MB = int(os.environ.get("PACKAGE_CACHE_MAX_MB", "20480"))
+
+# Seconds between pruning attempts
+PACKAGE_CACHE_PRUNE_INTERVAL = int(
+    os.environ.get("PACKAGE_CACHE_PRUNE_INTERVAL", "900")
+)
+
+STATS_KEY = "package_cache:stats"
+
+# Environment variables pointing each tool at its cache, as paths relative
+# to the ecosystem's directory
+ECOSYSTEMS = {
+    "npm": {"npm_config_cache": ""},
+    "pip": {"PIP_CACHE_DIR": ""},
+    "cargo": {},  # shared through symlinks in CARGO_HOME, see _share_cargo
+    "go": {"GOMODCACHE": "mod", "GOCACHE": "build"},
+}
+
+# Entries of CARGO_HOME that are shared; cargo takes its package cache
+# locks on the two files, so they are shared along with the caches
+_CARGO_SHARED_DIRS = ("registry", "git")
+_CARGO_SHARED_FILES = (".package-cache", ".package-cache-mutate")
+
+# Left in the shared cargo directory by when the whole CARGO_HOME was shared
+_CARGO_PRIVATE = ("config", "config.toml", "credentials", "credentials.toml")
+
+# Pruning stops at this fraction of the limit, so it does not run every time
+_LOW_WATERMARK = 0.9
+
+# Seconds before trying again when entries in use kept the caches too large
+_BUSY_RETRY = 60
+
+_LEASE_DIR = os.path.join(PACKAGE_CACHE_DIR, ".leases")
+
+
+def enabled() -> bool:
+    return PACKAGE_CACHE_MAX_MB > 0
+
+
+def _share_cargo(cargo_home: str) -> None:
+    """Point a project's CARGO_HOME at the shared registry and git caches.
+
+    An entry the project already has as a real file or directory (from
+    before sharing) is left alone; that project then keeps its own copy.
+    """
+    shared = os.path.join(PACKAGE_CACHE_DIR, "cargo")
+    os.makedirs(cargo_home, exist_ok=True)
+    for name in _CARGO_SHARED_DIRS + _CARGO_SHARED_FILES:
+        target = os.path.join(shared, name)
+        if name in _CARGO_SHARED_DIRS:
+            os.makedirs(target, exist_ok=True)
+        else:
+            os.close(os.open(target, os.O_WRONLY | os.O_CREAT, 0o644))
+        link = os.path.join(cargo_home, name)
+        if os.path.islink(link) and os.readlink(link) == target:
+            continue
+        if os.path.lexists(link) and not os.path.islink(link):
+            continue
+        tmp = f"{link}.{os.getpid()}.tmp"
+        with suppress(FileNotFoundError):
+            os.unlink(tmp)
+        os.symlink(target, tmp)
+        os.replace(tmp, link)
+
+
+def task_env(home_dir: str) -> dict:
+    """Environment variables giving a task the shared caches."""
+    cargo_home = os.path.join(home_dir, ".cargo")
+    env = {"CARGO_HOME": cargo_home}
+    try:
+        for ecosystem, variables in ECOSYSTEMS.items():
+            for name, subdir in variables.items():
+                path = os.path.join(PACKAGE_CACHE_DIR, ecosystem, subdir)
+                os.makedirs(path, exist_ok=True)
+                env[name] = path.rstrip("/")
+        _share_cargo(cargo_home)
+    except OSError as e:
+        logger.warning(f"Package caches unavailable, tasks use their own: {e}")
+        return {}
+    return env
+
+
+def _take_lease() -> tuple[int, str]:
+    os.makedirs(_LEASE_DIR, exist_ok=True)
+    name = uuid.uuid4().hex
+    # Locked before it gets a name the pruner looks at, which would
+    # otherwise take an unlocked lease for a dead worker's
+    tmp = os.path.join(_LEASE_DIR, f".{name}")
+    path = os.path.join(_LEASE_DIR, name)
+    fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        os.rename(tmp, path)
+    except BaseException:
+        os.close(fd)
+        with suppress(OSError):
+            os.unlink(tmp)
+        raise
+    return fd, path
+
+
+async def acquire() -> tuple[int, str] | None:
+    """Take a lease on the caches for a task; pass the result to release."""
+    try:
+        return await asyncio.to_thread(_take_lease)
+    except OSError as e:
+        logger.warning(f"Could not lease the package caches: {e}")
+        return None
+
+
+def release(lease: tuple[int, str] | None) -> None:
+    if lease is not None:
+        fd, path = lease
+        with suppress(OSError):
+            os.unlink(path)
+        os.close(fd)
+
+
+def _oldest_lease() -> float | None:
+    """When the oldest running task took its lease; drops dead workers' leases."""
+    oldest = None
+    try:
+        entries = list(os.scandir(_LEASE_DIR))
+    except FileNotFoundError:
+        return None
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        try:
+            fd = os.open(entry.path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue  # released meanwhile
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                started = os.fstat(fd).st_mtime
+                oldest = started if oldest is None else min(oldest, started)
+                continue
+            with suppress(FileNotFoundError):
+                os.unlink(entry.path)
+        finally:
+            os.close(fd)
+    return oldest
+
+
+def _is_unit_dir(ecosystem: str, parts: tuple[str, ...]) -> bool:
+    """Whether a directory is pruned (and measured) as a whole."""
+    if ecosystem == "cargo":
+        if parts[:2] == ("registry", "src"):
+            return len(parts) == 4  # registry/src/{index}/{crate-version}
+        return len(parts) == 3 and parts[:2] in (
+            ("registry", "index"),
+            ("git", "db"),
+            ("git", "checkouts"),
+        )
+    if ecosystem == "go":
+        return parts[0] == "mod" and "@" in parts[-1]  # mod/{module}@{version}
+    return False
+
+
+def _is_prunable(ecosystem: str, parts: tuple[str, ...]) -> bool:
+    if len(parts) < 2:
+        return False  # top-level files: tool configuration and state
+    if ecosystem == "cargo":
+        return parts[0] in ("registry", "git")  # not bin/, config, credentials
+    return True
+
+
+def _units(ecosystem: str):
+    """Yield ``(path, is_dir, stat)`` for each prunable entry of a cache."""
+    root = os.path.join(PACKAGE_CACHE_DIR, ecosystem)
+    stack = [(root, ())]
+    while stack:
+        path, parts = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            rel = parts + (entry.name,)
+            try:
+                st = entry.stat(follow_symlinks=False)
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir and not _is_unit_dir(ecosystem, rel):
+                stack.append((entry.path, rel))
+            elif _is_prunable(ecosystem, rel):
+                yield entry.path, is_dir, st
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def _size(path: str, is_dir: bool, st: os.stat_result) -> int:
+    return st.st_blocks * 512 + (_tree_size(path) if is_dir else 0)
+
+
+def _scan_use(since: float) -> dict:
+    """Hits and misses per ecosystem since ``since``; marks the entries used."""
+    stats = {}
+    for ecosystem in ECOSYSTEMS:
+        hits = misses = miss_bytes = 0
+        for path, is_dir, st in _units(ecosystem):
+            if st.st_mtime >= since:
+                misses += 1
+                miss_bytes += _size(path, is_dir, st)
+            elif st.st_atime >= since:
+                hits += 1
+            else:
+                continue
+            last_use = max(st.st_atime_ns, st.st_mtime_ns)
+            try:
+                os.utime(path, ns=(last_use, last_use), follow_symlinks=False)
+            except OSError:
+                pass  # read-only entries of other users
+        stats[ecosystem] = {"hits": hits, "misses": misses, "miss_bytes": miss_bytes}
+    return stats
+
+
+async def record_use(r, since: float) -> None:
+    """Add a finished task's cache hits and misses to the totals."""
+    stats = await asyncio.to_thread(_scan_use, since)
+    pipe = r.pipeline()
+    for ecosystem, counts in stats.items():
+        for name, value in counts.items():
+            if value:
+                pipe.hincrby(STATS_KEY, f"{ecosystem}:{name}", value)
+    await pipe.execute()
+    summary = ", ".join(
+        f"{e} {c['hits']} hits/{c['misses']} misses" for e, c in stats.items()
+    )
+    logger.info(f"Package caches: {summary}")
+
+
+def _remove(path: str, is_dir: bool) -> None:
+    if not is_dir:
+        os.unlink(path)
+        return
+
+    def make_writable(function, failed_path, exc):
+        # Go makes its module cache read-only
+        os.chmod(os.path.dirname(failed_path), stat.S_IRWXU)
+        if os.path.isdir(failed_path) and not os.path.islink(failed_path):
+            os.chmod(failed_path, stat.S_IRWXU)
+        function(failed_path)
+
+    shutil.rmtree(path, onexc=make_writable)
+
+
+def prune(max_bytes: int) -> dict:
+    """Remove least recently used entries until the caches fit.
+
+    Entries used since the oldest running task started are kept, so the
+    caches can stay over the limit until those tasks finish. Returns sizes
+    and what was evicted.
+    """
+    in_use_since = _oldest_lease()
+    units = []
+    sizes = {ecosystem: 0 for ecosystem in ECOSYSTEMS}
+    counts = {ecosystem: 0 for ecosystem in ECOSYSTEMS}
+    for ecosystem in ECOSYSTEMS:
+        for path, is_dir, st in _units(ecosystem):
+            size = _size(path, is_dir, st)
+            last_use = max(st.st_atime, st.st_mtime)
+            units.append((last_use, size, path, is_dir, ecosystem))
+            sizes[ecosystem] += size
+            counts[ecosystem] += 1
+
+    total = sum(sizes.values())
+    evicted = {ecosystem: 0 for ecosystem in ECOSYSTEMS}
+    if total > max_bytes:
+        units.sort()
+        target = max_bytes * _LOW_WATERMARK
+        for last_use, size, path, is_dir, ecosystem in units:
+            if total <= target:
+                break
+            if in_use_since is not None and last_use >= in_use_since:
+                break  # the rest may be in use by a running task
+            try:
+                _remove(path, is_dir)
+            except OSError as e:
+                logger.warning(f"Could not prune {path}: {e}")
+                continue
+            total -= size
+            sizes[ecosystem] -= size
+            counts[ecosystem] -= 1
+            evicted[ecosystem] += size
+    return {"bytes": sizes, "entries": counts, "evicted_bytes": evicted}
+
+
+async def _publish_sizes(r, max_bytes: int, result: dict) -> None:
+    sizes = {"max_bytes": max_bytes, "pruned_at": int(time.time())}
+    for ecosystem in ECOSYSTEMS:
+        sizes[f"{ecosystem}:bytes"] = result["bytes"][ecosystem]
+        sizes[f"{ecosystem}:entries"] = result["entries"][ecosystem]
+    pipe = r.pipeline()
+    pipe.hset(STATS_KEY, mapping=sizes)
+    for ecosystem, evicted in result["evicted_bytes"].items():
+        if evicted:
+            pipe.hincrby(STATS_KEY, f"{ecosystem}:evicted_bytes", evicted)
+    await pipe.execute()
+
+
+def _drop_cargo_private() -> None:
+    for name in _CARGO_PRIVATE:
+        path = os.path.join(PACKAGE_CACHE_DIR, "cargo", name)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        logger.info(f"Removed {path} from the shared cargo cache")
+
+
+async def run_pruner(r) -> None:
+    """Keep the caches under their size limit and publish their sizes."""
+    max_bytes = PACKAGE_CACHE_MAX_MB * 1024 * 1024
+    try:
+        await asyncio.to_thread(_drop_cargo_private)
+    except OSError as e:
+        logger.warning(f"Could not clean the shared cargo cache: {e}")
+    while True:
+        delay = PACKAGE_CACHE_PRUNE_INTERVAL
+        try:
+            result = await asyncio.to_thread(prune, max_bytes)
+            await _publish_sizes(r, max_bytes, result)
+            if any(result["evicted_bytes"].values()):
+                logger.info(f"Pruned package caches: {result['evicted_bytes']}")
+            if sum(result["bytes"].values()) > max_bytes:
+                delay = _BUSY_RETRY
+        except Exception:
+            logger.exception("Pruning the package caches failed")
+        await asyncio.sleep(delay)
@@ -0,0 +1,106 @@
+import fakeredis
+import pytest
+import pytest_asyncio
+
+
+class FakeNotFound(Exception):
+    pass
+
+
+class FakeContainer:
+    def __init__(self, client, name, image, labels, kwargs):
+        self._client = client
+        self.name = name
+        self.image = image
+        self.labels = labels
+        self.kwargs = kwargs
+        self.status = "running"
+        self.attrs = {}
+        self.starts = 0
+
+    def start(self):
+        self.starts += 1
+        self.status = "running"
+
+    def stop(self, timeout=None):
+        self.status = "exited"
+
+    def remove(self, force=False):
+        if self.status == "running" and not force:
+            raise RuntimeError(f"{self.name} is running")
+        del self._client.by_name[self.name]
+
+
+class FakeContainers:
+    """The part of ``docker.models.containers.ContainerCollection`` used."""
+
+    def __init__(self, client):
+        self._client = client
+        self.fail_run = None
+
+    def list(self, all=False, filters=None):
+        filters = filters or {}
+        result = []
+        for container in self._client.by_name.values():
+            if not all and container.status != "running":
+                continue
+            # Docker matches names by substring
+            if "name" in filters and filters["name"] not in container.name:
+                continue
+            if "label" in filters:
+                label, _, value = filters["label"].partition("=")
+                if label not in container.labels:
+                    continue
+                if value and container.labels[label] != value:
+                    continue
+            result.append(container)
+        return result
+
+    def get(self, name):
+        try:
+            return self._client.by_name[name]
+        except KeyError:
+            raise FakeNotFound(name)
+
+    def run(self, image, command=None, name=None, labels=None, **kwargs):
+        if self.fail_run is not None:
+            raise self.fail_run
+        if name in self._client.by_name:
+            raise RuntimeError(f"Conflict: {name} already exists")
+        container = FakeContainer(
+            self._client, name, image, labels or {}, {"command": command, **kwargs}
+        )
+        self._client.by_name[name] = container
+        self._client.runs.append(container)
+        return container
+
+
+class FakeImages:
+    def __init__(self):
+        self.pulled = []
+
+    def pull(self, image):
+        self.pulled.append(image)
+
+
+class FakeDocker:
+    """In-memory Docker client: ``containers.list/get/run``, the containers'
+    ``start/stop/remove`` and ``images.pull``."""
+
+    def __init__(self):
+        self.by_name: dict[str, FakeContainer] = {}
+        self.runs: list[FakeContainer] = []
+        self.containers = FakeContainers(self)
+        self.images = FakeImages()
+
+
+@pytest.fixture
+def docker():
+    return FakeDocker()
+
+
+@pytest_asyncio.fixture
+async def redis():
+    client = fakeredis.FakeAsyncRedis()
+    yield client
+    await client.aclose()
@@ -0,0 +1,43 @@
+import subprocess
+
+import pytest
+
+from app import checkpoints
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "PROJECTS_DATA_DIR", str(tmp_path))
+    staging = tmp_path / "p1" / "staging"
+    staging.mkdir(parents=True)
+    return staging
+
+
+@pytest.mark.asyncio
+async def test_snapshot_skips_nested_empty_repository(project):
+    (project / "a.txt").write_text("a")
+    nested = project / "sub"
+    nested.mkdir()
+    subprocess.run(["git", "init", "-q", str(nested)], check=True)
+    (nested / "b.txt").write_text("b")
+
+    commit = await checkpoints.snapshot("p1", "t1", "before")
+
+    env = checkpoints.git_env("p1")
+    files = await checkpoints._git(env, "ls-tree", "-r", "--name-only", commit)
+    assert files.splitlines() == ["a.txt"]
+    ref = f"{checkpoints.REF_PREFIX}/t1/before"
+    assert await checkpoints._git(env, "rev-parse", ref) == commit
+
+
+@pytest.mark.asyncio
+async def test_snapshot_raises_on_git_failure(project):
+    (project / "a.txt").write_text("a")
+    await checkpoints.snapshot("p1", "t1", "before")
+    # A corrupt index is a real failure, not a skipped path
+    env = checkpoints.git_env("p1")
+    with open(env["GIT_INDEX_FILE"], "wb") as f:
+        f.write(b"garbage")
+
+    with pytest.raises(checkpoints.CheckpointError):
+        await checkpoints.snapshot("p1", "t1", "after")
@@ -0,0 +1,168 @@
+import time
+
+import pytest
+
+from app import environments
+from app.environments import (
+    IDLE_TIMEOUT_KEY,
+    LAST_ACCESS_KEY,
+    EnvironmentManager,
+    container_name,
+)
+
+
+def _request(key="p1:staging", **overrides):
+    project_id, env = key.split(":")
+    return {
+        "action": "start",
+        "key": key,
+        "project_id": project_id,
+        "env": env,
+        "image": "node:22",
+        "command": "npm start",
+        "port": 3000,
+        **overrides,
+    }
+
+
+@pytest.fixture
+def manager(redis, docker):
+    return EnvironmentManager(redis, docker, host_data_dir="/host/projects")
+
+
+async def _touch(redis, key, seconds_ago):
+    await redis.zadd(LAST_ACCESS_KEY, {key: time.time() - seconds_ago})
+
+
+@pytest.mark.asyncio
+async def test_start_runs_container_and_publishes_upstream(manager, redis, docker):
+    await redis.set("env:starting:p1:prod", 1)
+
+    await manager.start(_request("p1:prod", idle_timeout=120))
+
+    container = docker.by_name[container_name("p1:prod")]
+    assert container.status == "running"
+    assert container.kwargs["volumes"] == {
+        "/host/projects/p1/prod": {"bind": "/app", "mode": "ro"}
+    }
+    assert container.labels["remotifex.key"] == "p1:prod"
+    assert await redis.get("env:upstream:p1:prod") == b"remotifex-p1-prod:3000"
+    assert await redis.get("env:booting:p1:prod") is not None
+    assert await redis.zscore(LAST_ACCESS_KEY, "p1:prod") is not None
+    assert await redis.hget(IDLE_TIMEOUT_KEY, "p1:prod") == b"120"
+    assert await redis.get("env:starting:p1:prod") is None
+
+
+@pytest.mark.asyncio
+async def test_start_reuses_stopped_container(manager, docker):
+    await manager.start(_request())
+    await manager.stop("p1:staging")
+    container = docker.by_name[container_name("p1:staging")]
+    assert container.status == "exited"
+
+    await manager.start(_request())
+
+    assert len(docker.runs) == 1
+    assert container.starts == 1
+    assert container.status == "running"
+
+
+@pytest.mark.asyncio
+async def test_start_recreates_container_when_config_changes(manager, docker):
+    await manager.start(_request())
+    await manager.stop("p1:staging")
+    old = docker.by_name[container_name("p1:staging")]
+
+    await manager.start(_request(command="npm run dev"))
+
+    new = docker.by_name[container_name("p1:staging")]
+    assert new is not old
+    assert len(docker.runs) == 2
+    assert new.kwargs["command"] == ["sh", "-c", "npm run dev"]
+    assert new.labels[environments._LABEL] != old.labels[environments._LABEL]
+
+
+@pytest.mark.asyncio
+async def test_start_failure_is_reported(manager, redis, docker):
+    await redis.set("env:starting:p1:staging", 1)
+    docker.containers.fail_run = RuntimeError("no such image")
+
+    await manager.start(_request())
+
+    assert await redis.get("env:error:p1:staging") == b"no such image"
+    assert await redis.get("env:upstream:p1:staging") is None
+    assert await redis.get("env:starting:p1:staging") is None
+
+
+@pytest.mark.asyncio
+async def test_make_room_stops_least_recently_used(manager, redis, docker, monkeypatch):
+    monkeypatch.setattr(environments, "PREVIEW_MAX_RUNNING", 2)
+    await manager.start(_request("p1:staging"))
+    await manager.start(_request("p2:staging"))
+    await _touch(redis, "p1:staging", 10)
+    await _touch(redis, "p2:staging", 20)
+
+    await manager.start(_request("p3:staging"))
+
+    assert docker.by_name[container_name("p2:staging")].status == "exited"
+    assert await redis.get("env:upstream:p2:staging") is None
+    assert docker.by_name[container_name("p1:staging")].status == "running"
+    assert await redis.zcard(LAST_ACCESS_KEY) == 2
+
+
+@pytest.mark.asyncio
+async def test_reap_uses_each_environments_timeout(manager, redis, docker):
+    await manager.start(_request("p1:staging", idle_timeout=60))
+    await manager.start(_request("p2:staging"))
+    await manager.start(_request("p3:staging"))
+    await _touch(redis, "p1:staging", 120)  # own timeout passed
+    await _touch(redis, "p2:staging", 120)  # default timeout not yet
+    await _touch(redis, "p3:staging", environments.PREVIEW_IDLE_TIMEOUT + 1)
+
+    await manager.reap()
+
+    statuses = {
+        key: docker.by_name[container_name(key)].status
+        for key in ("p1:staging", "p2:staging", "p3:staging")
+    }
+    assert statuses == {
+        "p1:staging": "exited",
+        "p2:staging": "running",
+        "p3:staging": "exited",
+    }
+    assert [m.decode() for m in await redis.zrange(LAST_ACCESS_KEY, 0, -1)] == [
+        "p2:staging"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_matches_redis_to_running_containers(manager, redis, docker):
+    await manager.start(_request("p1:staging"))
+    await manager.start(_request("p2:staging"))
+    # p1's container stopped behind our back; p3's is unknown to Redis
+    docker.by_name[container_name("p1:staging")].stop()
+    docker.containers.run(
+        "node:22",
+        name=container_name("p3:staging"),
+        labels={environments._LABEL: "x", "remotifex.key": "p3:staging"},
+    )
+
+    await manager.reconcile()
+
+    assert await redis.get("env:upstream:p1:staging") is None
+    assert await redis.zscore(LAST_ACCESS_KEY, "p1:staging") is None
+    assert docker.by_name[container_name("p3:staging")].status == "exited"
+    assert docker.by_name[container_name("p2:staging")].status == "running"
+    assert await redis.get("env:upstream:p2:staging") is not None
+
+
+@pytest.mark.asyncio
+async def test_remove_and_prewarm(manager, redis, docker):
+    await manager.start(_request())
+    await redis.sadd(environments.IMAGES_KEY, "node:22")
+
+    await manager.handle({"action": "remove", "key": "p1:staging"})
+    await manager.prewarm()
+
+    assert container_name("p1:staging") not in docker.by_name
+    assert docker.images.pulled == ["node:22"]